@@ -0,0 +1,650 @@
+"""Local stand-in for the Box API used by the benchmarks"""
+
+# Standard libraries
+import os
+import re
+import json
+import time
+import base64
+import random
+import hashlib
+import datetime
+import threading
+import itertools
+import collections
+import email.parser
+import email.policy
+import http.server
+import urllib.parse
+
+# Specialized libraries
+import boxsdk.config
+
+
+class FakeBox:
+    """
+    Class FakeBox for an in-memory tree of Box folders and files,
+    with options for the latency and bandwidth of each request,
+    the largest page of a folder listing, and the fraction of
+    requests answered with an injected 429 or 503 error.
+    """
+
+    def __init__(
+        self,
+        latency=0.0,
+        bandwidth=None,
+        page_size=1000,
+        error_rate=0.0,
+        retry_after=1,
+        part_size=8388608,
+        seed=0,
+    ):
+        """
+        Constructor
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.page_size = page_size
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.part_size = part_size
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.ids = itertools.count(1000)
+        self.calls = collections.Counter()
+        self.sessions = {}
+        self.events = []
+        self.items = {
+            "0": {
+                "type": "folder",
+                "id": "0",
+                "name": "All Files",
+                "parent": None,
+                "children": {},
+                "etag": "0",
+                "sequence_id": "0",
+                "size": 0,
+                "modified_at": fakebox_now(),
+            }
+        }
+
+    def new_id(self):
+        """
+        Get a new item id
+        """
+        return str(next(self.ids))
+
+    def item_json(self, item):
+        """
+        JSON representation of an item
+        """
+        fields = {
+            key: value
+            for key, value in item.items()
+            if key not in ["children", "data", "parent"]
+        }
+        if item["parent"] is not None:
+            fields["parent"] = {"type": "folder", "id": item["parent"]}
+        return fields
+
+    def full_json(self, item):
+        """
+        JSON representation of an item with its path collection
+        """
+        ancestors = []
+        parent_id = item["parent"]
+        while parent_id is not None:
+            ancestors.insert(0, self.items[parent_id])
+            parent_id = self.items[parent_id]["parent"]
+
+        fields = self.item_json(item)
+        fields["path_collection"] = {
+            "total_count": len(ancestors),
+            "entries": [
+                {"type": "folder", "id": folder["id"], "name": folder["name"]}
+                for folder in ancestors
+            ],
+        }
+        return fields
+
+    def tree(self, folder_id="0"):
+        """
+        \b
+        Folders and files under a folder
+
+        Returns
+        -------
+        folders	: dictionary of ids by path
+        files	: dictionary of (id, sha1) by path
+        """
+        folders, files = {}, {}
+        stack = [("", folder_id)]
+
+        with self.lock:
+            while stack:
+                folder_path, item_id = stack.pop()
+                for name, child_id in self.items[item_id]["children"].items():
+                    child = self.items[child_id]
+                    child_path = os.path.join(folder_path, name)
+                    if child["type"] == "folder":
+                        folders[child_path] = child_id
+                        stack.append((child_path, child_id))
+                    else:
+                        files[child_path] = (child_id, child["sha1"])
+
+        return folders, files
+
+    def touch(self, folder_id, size):
+        """
+        \b
+        Update the modified time and the size of a folder
+        and its ancestors after their contents changed. This
+        is what map-items --skip-unchanged assumes Box does,
+        so the benchmarks cannot check that assumption
+        """
+        while folder_id is not None:
+            folder = self.items[folder_id]
+            folder["size"] += size
+            folder["modified_at"] = fakebox_now()
+            folder_id = folder["parent"]
+
+    def add_event(self, event_type, item):
+        """
+        Append an event with the current state of an item
+        """
+        with self.lock:
+            self.events.append(
+                {
+                    "type": "event",
+                    "event_id": str(len(self.events)),
+                    "event_type": event_type,
+                    "source": self.full_json(item),
+                }
+            )
+
+    def move(self, item_id, parent_id, name=None):
+        """
+        Move or rename an item
+        """
+        with self.lock:
+            item = self.items[item_id]
+            event_type = "ITEM_RENAME" if item["parent"] == parent_id else "ITEM_MOVE"
+            del self.items[item["parent"]]["children"][item["name"]]
+            self.touch(item["parent"], -item["size"])
+            item["parent"] = parent_id
+            item["name"] = name or item["name"]
+            self.items[parent_id]["children"][item["name"]] = item_id
+            self.touch(parent_id, item["size"])
+            if item["type"] == "folder":
+                item["sequence_id"] = str(int(item["sequence_id"]) + 1)
+                item["etag"] = item["sequence_id"]
+            self.add_event(event_type, item)
+
+    def trash(self, item_id):
+        """
+        Move an item to the trash
+        """
+        with self.lock:
+            item = self.items.pop(item_id)
+            del self.items[item["parent"]]["children"][item["name"]]
+            self.touch(item["parent"], -item["size"])
+            self.add_event("ITEM_TRASH", item)
+
+    def conflict(self, folder, name):
+        """
+        Get the item named name in a folder, if any
+        """
+        item_id = folder["children"].get(name)
+        return self.items[item_id] if item_id else None
+
+    def add_folder(self, parent_id, name):
+        """
+        Add a folder, returning None on a name conflict
+        """
+        with self.lock:
+            parent = self.items[parent_id]
+            if self.conflict(parent, name):
+                return None
+            folder = {
+                "type": "folder",
+                "id": self.new_id(),
+                "name": name,
+                "parent": parent_id,
+                "children": {},
+                "etag": "0",
+                "sequence_id": "0",
+                "size": 0,
+                "modified_at": fakebox_now(),
+            }
+            self.items[folder["id"]] = folder
+            parent["children"][name] = folder["id"]
+            self.touch(parent_id, 0)
+            self.add_event("ITEM_CREATE", folder)
+            return folder
+
+    def put_file(self, data, parent_id=None, name=None, file_id=None):
+        """
+        Add a file or a new version of one, returning
+        None on a name conflict
+        """
+        with self.lock:
+            if file_id is None:
+                parent = self.items[parent_id]
+                if self.conflict(parent, name):
+                    return None
+                item = {
+                    "type": "file",
+                    "id": self.new_id(),
+                    "name": name,
+                    "parent": parent_id,
+                    "etag": "-1",
+                }
+                self.items[item["id"]] = item
+                parent["children"][name] = item["id"]
+            else:
+                item = self.items[file_id]
+
+            self.touch(item["parent"], len(data) - item.get("size", 0))
+            item["data"] = data
+            item["sha1"] = hashlib.sha1(data).hexdigest()
+            item["size"] = len(data)
+            item["etag"] = str(int(item["etag"]) + 1)
+            item["modified_at"] = fakebox_now()
+            self.add_event("ITEM_UPLOAD", item)
+            return item
+
+
+def fakebox_now():
+    """
+    Current time in the format used by Box
+    """
+    return datetime.datetime.now(datetime.timezone.utc).strftime(
+        "%Y-%m-%dT%H:%M:%S+00:00"
+    )
+
+
+class FakeBoxHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Class FakeBoxHandler answering Box API requests from the FakeBox
+    of the server. Only the endpoints used by figaro are served.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    # (method, path pattern, route) for each endpoint
+    ROUTES = [
+        ("GET", r"/2\.0/events", "events"),
+        ("GET", r"/2\.0/folders/(\w+)/items", "list_items"),
+        ("GET", r"/2\.0/folders/(\w+)", "get_folder"),
+        ("POST", r"/2\.0/folders", "create_folder"),
+        ("GET", r"/2\.0/files/(\w+)/content", "download"),
+        ("GET", r"/2\.0/files/(\w+)", "get_file"),
+        ("POST", r"/api/2\.0/files/content", "upload"),
+        ("POST", r"/api/2\.0/files/upload_sessions", "create_session"),
+        ("GET", r"/api/2\.0/files/upload_sessions/(\w+)", "get_session"),
+        ("PUT", r"/api/2\.0/files/upload_sessions/(\w+)", "upload_part"),
+        ("POST", r"/api/2\.0/files/upload_sessions/(\w+)/commit", "commit_session"),
+        ("DELETE", r"/api/2\.0/files/upload_sessions/(\w+)", "abort_session"),
+        ("POST", r"/api/2\.0/files/(\w+)/content", "upload_version"),
+        ("POST", r"/api/2\.0/files/(\w+)/upload_sessions", "create_session"),
+    ]
+
+    def log_message(self, *args):
+        """
+        Keep the benchmark output quiet
+        """
+
+    @property
+    def box(self):
+        """
+        FakeBox of the server
+        """
+        return self.server.box
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_PUT(self):
+        self.dispatch("PUT")
+
+    def do_DELETE(self):
+        self.dispatch("DELETE")
+
+    def dispatch(self, method):
+        """
+        Route a request, after the simulated latency
+        and a possible injected error
+        """
+        url = urllib.parse.urlsplit(self.path)
+        self.query = dict(urllib.parse.parse_qsl(url.query))
+        self.body = self.read_body()
+
+        for route_method, pattern, route in self.ROUTES:
+            match = re.fullmatch(pattern, url.path)
+            if route_method == method and match:
+                break
+        else:
+            return self.send_json(404, {"type": "error", "status": 404})
+
+        with self.box.lock:
+            self.box.calls[f"{method} {route}"] += 1
+            roll = self.box.random.random()
+
+        time.sleep(self.box.latency)
+
+        if roll < self.box.error_rate / 2:
+            return self.send_json(
+                429,
+                {"type": "error", "status": 429, "code": "rate_limit_exceeded"},
+                {"Retry-After": str(self.box.retry_after)},
+            )
+
+        if roll < self.box.error_rate:
+            return self.send_json(503, {"type": "error", "status": 503})
+
+        getattr(self, f"route_{route}")(*match.groups())
+
+    def read_body(self):
+        """
+        Read the request body at the simulated bandwidth
+        """
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        self.throttle(len(body))
+        return body
+
+    def throttle(self, size):
+        """
+        Wait as long as size bytes take at the simulated bandwidth
+        """
+        if self.box.bandwidth:
+            time.sleep(size / self.box.bandwidth)
+
+    def send_bytes(self, status, data, content_type, headers=None):
+        """
+        Send a response at the simulated bandwidth
+        """
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.throttle(len(data))
+        self.wfile.write(data)
+
+    def send_json(self, status, content, headers=None):
+        """
+        Send a JSON response
+        """
+        data = json.dumps(content).encode()
+        self.send_bytes(status, data, "application/json", headers)
+
+    def send_conflict(self, item):
+        """
+        Send a name conflict error
+        """
+        self.send_json(
+            409,
+            {
+                "type": "error",
+                "status": 409,
+                "code": "item_name_in_use",
+                "context_info": {"conflicts": [self.box.item_json(item)]},
+            },
+        )
+
+    def route_list_items(self, folder_id):
+        folder = self.box.items[folder_id]
+        limit = min(int(self.query.get("limit", 100)), self.box.page_size)
+        offset = int(self.query.get("offset", 0))
+        children = sorted(folder["children"].values(), key=int)
+        entries = [
+            self.box.item_json(self.box.items[item_id])
+            for item_id in children[offset : offset + limit]
+        ]
+        self.send_json(
+            200,
+            {
+                "total_count": len(children),
+                "entries": entries,
+                "offset": offset,
+                "limit": limit,
+            },
+        )
+
+    def route_events(self):
+        with self.box.lock:
+            events = list(self.box.events)
+        position = self.query.get("stream_position", "0")
+        first = len(events) if position == "now" else int(position)
+        limit = int(self.query.get("limit", 100))
+        entries = events[first : first + limit]
+        self.send_json(
+            200,
+            {
+                "chunk_size": len(entries),
+                "next_stream_position": first + len(entries),
+                "entries": entries,
+            },
+        )
+
+    def route_get_folder(self, folder_id):
+        self.send_json(200, self.box.item_json(self.box.items[folder_id]))
+
+    def route_create_folder(self):
+        attributes = json.loads(self.body)
+        parent_id = attributes["parent"]["id"]
+        folder = self.box.add_folder(parent_id, attributes["name"])
+        if folder is None:
+            conflict = self.box.conflict(self.box.items[parent_id], attributes["name"])
+            return self.send_conflict(conflict)
+        self.send_json(201, self.box.item_json(folder))
+
+    def route_get_file(self, file_id):
+        if file_id not in self.box.items:
+            return self.send_json(404, {"type": "error", "status": 404})
+        self.send_json(200, self.box.item_json(self.box.items[file_id]))
+
+    def route_download(self, file_id):
+        data = self.box.items[file_id]["data"]
+        byte_range = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if byte_range:
+            first = int(byte_range.group(1))
+            last = int(byte_range.group(2) or len(data) - 1)
+            self.send_bytes(
+                206,
+                data[first : last + 1],
+                "application/octet-stream",
+                {"Content-Range": f"bytes {first}-{last}/{len(data)}"},
+            )
+        else:
+            self.send_bytes(200, data, "application/octet-stream")
+
+    def multipart(self):
+        """
+        Parse a multipart upload into attributes and file bytes
+        """
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b"Content-Type: "
+            + self.headers["Content-Type"].encode()
+            + b"\r\n\r\n"
+            + self.body
+        )
+        parts = {
+            part.get_param("name", header="content-disposition"): part.get_payload(
+                decode=True
+            )
+            for part in message.iter_parts()
+        }
+        return json.loads(parts.get("attributes") or b"{}"), parts["file"]
+
+    def check_digest(self, data):
+        """
+        Check the Content-MD5 header, which Box uses for SHA-1
+        """
+        digest = self.headers.get("Content-MD5")
+        return digest is None or digest == hashlib.sha1(data).hexdigest()
+
+    def check_part_digest(self, data):
+        """
+        Check the Digest header of upload session requests
+        """
+        algorithm, _, digest = self.headers.get("Digest", "").partition("=")
+        return (
+            algorithm.lower() == "sha"
+            and digest == base64.b64encode(hashlib.sha1(data).digest()).decode()
+        )
+
+    def check_etag(self, file_id):
+        """
+        Check the If-Match header against the etag of a file
+        """
+        etag = self.headers.get("If-Match")
+        return etag is None or etag == self.box.items[file_id]["etag"]
+
+    def route_upload(self):
+        attributes, data = self.multipart()
+        if not self.check_digest(data):
+            return self.send_json(400, {"type": "error", "status": 400})
+        parent_id = attributes["parent"]["id"]
+        item = self.box.put_file(data, parent_id=parent_id, name=attributes["name"])
+        if item is None:
+            conflict = self.box.conflict(self.box.items[parent_id], attributes["name"])
+            return self.send_conflict(conflict)
+        self.send_json(201, {"total_count": 1, "entries": [self.box.item_json(item)]})
+
+    def route_upload_version(self, file_id):
+        _, data = self.multipart()
+        if not self.check_etag(file_id):
+            return self.send_json(412, {"type": "error", "status": 412})
+        if not self.check_digest(data):
+            return self.send_json(400, {"type": "error", "status": 400})
+        item = self.box.put_file(data, file_id=file_id)
+        self.send_json(201, {"total_count": 1, "entries": [self.box.item_json(item)]})
+
+    def session_json(self, session):
+        """
+        JSON representation of an upload session
+        """
+        return {
+            "type": "upload_session",
+            "id": session["id"],
+            "part_size": self.box.part_size,
+            "total_parts": -(-session["file_size"] // self.box.part_size),
+            "num_parts_processed": len(session["parts"]),
+            "session_expires_at": fakebox_now(),
+            "session_endpoints": {},
+        }
+
+    def route_create_session(self, file_id=None):
+        attributes = json.loads(self.body)
+        session = {
+            "id": self.box.new_id(),
+            "file_id": file_id,
+            "folder_id": attributes.get("folder_id"),
+            "file_name": attributes.get("file_name"),
+            "file_size": attributes["file_size"],
+            "parts": {},
+        }
+        with self.box.lock:
+            self.box.sessions[session["id"]] = session
+        self.send_json(201, self.session_json(session))
+
+    def route_get_session(self, session_id):
+        session = self.box.sessions.get(session_id)
+        if session is None:
+            return self.send_json(404, {"type": "error", "status": 404})
+        self.send_json(200, self.session_json(session))
+
+    def route_upload_part(self, session_id):
+        session = self.box.sessions.get(session_id)
+        if session is None:
+            return self.send_json(404, {"type": "error", "status": 404})
+        first = int(re.match(r"bytes (\d+)-", self.headers["Content-Range"]).group(1))
+        if not self.check_part_digest(self.body):
+            return self.send_json(412, {"type": "error", "status": 412})
+        part = {
+            "part_id": f"{first:08X}",
+            "offset": first,
+            "size": len(self.body),
+            "sha1": hashlib.sha1(self.body).hexdigest(),
+        }
+        with self.box.lock:
+            session["parts"][first] = (part, self.body)
+        self.send_json(200, {"part": part})
+
+    def route_commit_session(self, session_id):
+        session = self.box.sessions.get(session_id)
+        if session is None:
+            return self.send_json(404, {"type": "error", "status": 404})
+        if session["file_id"] and not self.check_etag(session["file_id"]):
+            return self.send_json(412, {"type": "error", "status": 412})
+        parts = json.loads(self.body)["parts"]
+        data = b"".join(session["parts"][part["offset"]][1] for part in parts)
+        if len(data) != session["file_size"] or not self.check_part_digest(data):
+            return self.send_json(400, {"type": "error", "status": 400})
+        if session["file_id"]:
+            item = self.box.put_file(data, file_id=session["file_id"])
+        else:
+            item = self.box.put_file(
+                data, parent_id=session["folder_id"], name=session["file_name"]
+            )
+            if item is None:
+                conflict = self.box.conflict(
+                    self.box.items[session["folder_id"]], session["file_name"]
+                )
+                return self.send_conflict(conflict)
+        with self.box.lock:
+            del self.box.sessions[session_id]
+        self.send_json(201, {"total_count": 1, "entries": [self.box.item_json(item)]})
+
+    def route_abort_session(self, session_id):
+        with self.box.lock:
+            self.box.sessions.pop(session_id, None)
+        self.send_bytes(204, b"", "application/json")
+
+
+def start_fakebox(box):
+    """
+    \b
+    Serve a FakeBox on a free local port from
+    a background thread and point the Box SDK
+    at it
+
+    Arguments
+    ---------
+    box	: FakeBox object
+
+    Returns
+    -------
+    server	: http.server.ThreadingHTTPServer object
+    """
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeBoxHandler)
+    server.daemon_threads = True
+    server.box = box
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    use_fakebox(f"http://127.0.0.1:{server.server_address[1]}")
+
+    return server
+
+
+def use_fakebox(url):
+    """
+    \b
+    Point the Box SDK of this process at a
+    fake server, for commands run in other
+    processes than the server
+
+    Arguments
+    ---------
+    url	: base URL of the server
+    """
+    boxsdk.config.API.BASE_API_URL = f"{url}/2.0"
+    boxsdk.config.API.UPLOAD_URL = f"{url}/api/2.0"
+    boxsdk.config.API.OAUTH2_API_URL = f"{url}/oauth2"
@@ -0,0 +1,247 @@
+"""Benchmarks of figaro commands against a local fake Box server"""
+
+# Standard libraries
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import contextlib
+
+# Feature libraries
+import click
+import toml
+
+# Internal imports
+import figaro
+import fakebox
+import trees
+
+# Commands run for each scenario, in order
+COMMANDS = [
+    ("upload-folder", ["upload-folder", "."]),
+    ("map-items", ["map-items"]),
+    ("download-folder", ["download-folder", "."]),
+]
+
+# Directory of saved baselines
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+
+def run_command(box, project, args, num_files, num_bytes):
+    """
+    \b
+    Run one figaro command in process and
+    measure it
+
+    Returns
+    -------
+    report	: dictionary of metrics
+    """
+    calls = box.calls.copy()
+    cwd = os.getcwd()
+    output = io.StringIO()
+
+    os.chdir(project)
+    start = time.perf_counter()
+
+    try:
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            figaro.cli.figaro.main(args, standalone_mode=False)
+    finally:
+        seconds = time.perf_counter() - start
+        os.chdir(cwd)
+
+    endpoints = dict(box.calls - calls)
+    api_calls = sum(endpoints.values())
+
+    return {
+        "seconds": seconds,
+        "items": num_files,
+        "bytes": num_bytes,
+        "items_per_s": num_files / seconds,
+        "mb_per_s": num_bytes / seconds / 1e6,
+        "api_calls": api_calls,
+        "calls_per_file": api_calls / max(num_files, 1),
+        "endpoints": endpoints,
+    }
+
+
+def run_scenario(name, scale, server_options, config_options):
+    """
+    \b
+    Generate a tree, then upload, map and
+    download it against a fresh fake server
+
+    Returns
+    -------
+    results	: dictionary of reports by command
+    """
+    box = fakebox.FakeBox(**server_options)
+    server = fakebox.start_fakebox(box)
+    results = {}
+
+    try:
+        with tempfile.TemporaryDirectory(prefix="figaro-bench-") as project:
+            os.makedirs(os.path.join(project, ".figaro"))
+            config = {
+                "credentials": {
+                    "client_id": "benchmark",
+                    "client_secret": "benchmark",
+                    "access_token": "benchmark",
+                },
+                "folder": {"box_id": "0"},
+                **config_options,
+            }
+            with open(os.path.join(project, ".figaro", "config"), "w") as stream:
+                toml.dump(config, stream)
+
+            num_files, num_bytes = trees.TREES[name](project, scale)
+
+            for command, args in COMMANDS:
+                if command == "download-folder":
+                    for entry in os.listdir(project):
+                        if entry != ".figaro":
+                            shutil.rmtree(os.path.join(project, entry))
+
+                results[command] = run_command(box, project, args, num_files, num_bytes)
+
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return results
+
+
+def compare_baseline(name, results, tolerance):
+    """
+    \b
+    Compare results with the saved baseline of
+    a scenario, printing every metric that is
+    worse by more than tolerance
+
+    Returns
+    -------
+    regressed	: True if any metric regressed
+    """
+    baseline_file = os.path.join(BASELINE_DIR, f"{name}.json")
+
+    if not os.path.isfile(baseline_file):
+        print(f"    - No baseline for {name}")
+        return False
+
+    with open(baseline_file) as stream:
+        baseline = json.load(stream)
+
+    regressed = False
+
+    for command, report in results.items():
+        if command not in baseline:
+            continue
+
+        for metric, higher_is_better in [
+            ("items_per_s", True),
+            ("mb_per_s", True),
+            ("calls_per_file", False),
+        ]:
+            old, new = baseline[command][metric], report[metric]
+            if not old:
+                continue
+            change = new / old - 1 if higher_is_better else old / new - 1
+            if change < -tolerance:
+                regressed = True
+                print(
+                    f"    - REGRESSION {name} {command} {metric}: {old:.3f} -> {new:.3f}"
+                )
+
+    return regressed
+
+
+def print_results(name, results):
+    """
+    Print the reports of a scenario as a table
+    """
+    print(f"{name}:")
+    for command, report in results.items():
+        print(
+            f"    {command:<16}{report['seconds']:>9.2f} s"
+            + f"{report['items_per_s']:>11.1f} items/s"
+            + f"{report['mb_per_s']:>9.2f} MB/s"
+            + f"{report['calls_per_file']:>8.2f} calls/file"
+        )
+
+
+@click.command()
+@click.argument("scenarios", nargs=-1, type=click.Choice(sorted(trees.TREES)))
+@click.option("--scale", default=1.0, help="Scale of the generated trees")
+@click.option("--latency", default=0.02, help="Seconds added to each request")
+@click.option("--bandwidth", default=100e6, help="Bytes per second per request")
+@click.option("--page-size", default=1000, help="Largest page of a folder listing")
+@click.option(
+    "--error-rate", default=0.0, help="Fraction of requests failing with 429/503"
+)
+@click.option("--retry-after", default=1, help="Retry-After of injected 429 errors")
+@click.option("--cap", default=None, type=int, help="[concurrency] cap of figaro")
+@click.option("--output", type=click.Path(), help="Write all results to a JSON file")
+@click.option("--save", is_flag=True, help="Save results as the new baselines")
+@click.option("--compare", is_flag=True, help="Compare results with the baselines")
+@click.option("--tolerance", default=0.2, help="Allowed relative regression")
+def benchmark(
+    scenarios,
+    scale,
+    latency,
+    bandwidth,
+    page_size,
+    error_rate,
+    retry_after,
+    cap,
+    output,
+    save,
+    compare,
+    tolerance,
+):
+    """
+    \b
+    Benchmark figaro commands against a local fake Box server
+    for the given scenarios, all of them by default
+    """
+    server_options = {
+        "latency": latency,
+        "bandwidth": bandwidth,
+        "page_size": page_size,
+        "error_rate": error_rate,
+        "retry_after": retry_after,
+    }
+    config_options = {"concurrency": {"cap": cap}} if cap else {}
+
+    all_results = {}
+    regressed = False
+
+    for name in scenarios or sorted(trees.TREES):
+        results = run_scenario(name, scale, server_options, config_options)
+        all_results[name] = results
+        print_results(name, results)
+
+        if compare:
+            regressed = compare_baseline(name, results, tolerance) or regressed
+
+        if save:
+            os.makedirs(BASELINE_DIR, exist_ok=True)
+            with open(os.path.join(BASELINE_DIR, f"{name}.json"), "w") as stream:
+                json.dump(results, stream, indent=2)
+
+    if output:
+        with open(output, "w") as stream:
+            json.dump(
+                {"options": server_options, "scale": scale, "results": all_results},
+                stream,
+                indent=2,
+            )
+
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    benchmark()
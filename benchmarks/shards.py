@@ -0,0 +1,282 @@
+"""Check of sharded transfers run by several local processes"""
+
+# Standard libraries
+import os
+import sys
+import random
+import shutil
+import hashlib
+import tempfile
+import subprocess
+
+# Feature libraries
+import click
+import toml
+
+# Internal imports
+import figaro
+import fakebox
+import trees
+
+
+def shard_tree(root, scale, num_shards):
+    """
+    \b
+    Generate a benchmark tree with empty folders, some
+    of them next to a single file that lands on a shard
+    other than 0
+
+    Returns
+    -------
+    num_files	: number of files written
+    num_bytes	: number of bytes written
+    """
+    num_files, num_bytes = trees.TREES["wide"](root, scale)
+    rng = random.Random(0)
+
+    for index in range(num_shards):
+        num_bytes += trees.tree_write(root, f"lone{index}/file.dat", 1024, rng)
+        os.makedirs(os.path.join(root, f"lone{index}", "empty"))
+        num_files += 1
+
+    os.makedirs(os.path.join(root, "empty", "deeper"))
+    return num_files, num_bytes
+
+
+def local_tree(root):
+    """
+    \b
+    Folders and files of a local tree
+
+    Returns
+    -------
+    folders	: set of paths
+    files	: dictionary of sha1 by path
+    """
+    folders, files = set(), {}
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if name != ".figaro"]
+        folder_path = os.path.relpath(dirpath, root)
+        folders.update(
+            os.path.normpath(os.path.join(folder_path, name)) for name in dirnames
+        )
+        for name in filenames:
+            with open(os.path.join(dirpath, name), "rb") as stream:
+                files[os.path.normpath(os.path.join(folder_path, name))] = hashlib.sha1(
+                    stream.read()
+                ).hexdigest()
+
+    return folders, files
+
+
+def run_shards(url, project, num_shards, args):
+    """
+    \b
+    Run a figaro command as every shard at once,
+    each in its own process, then merge the deltas
+
+    Returns
+    -------
+    failed	: list of (shard, output) of shards that failed
+    """
+    # Workers import the same figaro as this process
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(figaro.__file__)))]
+        + [path for path in [env.get("PYTHONPATH")] if path]
+    )
+    processes = [
+        subprocess.Popen(
+            [
+                sys.executable,
+                __file__,
+                "--worker",
+                url,
+                "--shard",
+                f"{index}/{num_shards}",
+            ]
+            + args,
+            cwd=project,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        for index in range(num_shards)
+    ]
+    outputs = [process.communicate()[0] for process in processes]
+    failed = [
+        (index, output)
+        for index, (process, output) in enumerate(zip(processes, outputs))
+        if process.returncode != 0
+    ]
+
+    if not failed:
+        cwd = os.getcwd()
+        os.chdir(project)
+        try:
+            figaro.cli.figaro.main(["merge-shards"], standalone_mode=False)
+        finally:
+            os.chdir(cwd)
+
+    return failed
+
+
+def check_map(project, box_folders, box_files):
+    """
+    \b
+    Compare the merged map of a project with the
+    tree on the server
+
+    Returns
+    -------
+    errors	: list of messages
+    """
+    config = {"folder": {"local_path": project}}
+    filemap, foldermap = figaro.lib.load_boxmap(config)
+    map_folders = dict(foldermap.items())
+    map_files = {path: (entry.id, entry.sha1) for path, entry in filemap.entries()}
+    errors = []
+
+    if map_folders != box_folders:
+        errors.append(
+            "map folders differ from Box: "
+            + f"{sorted(set(map_folders.items()) ^ set(box_folders.items()))}"
+        )
+    if map_files != box_files:
+        errors.append(
+            "map files differ from Box: "
+            + f"{sorted(set(map_files.items()) ^ set(box_files.items()))}"
+        )
+
+    return errors
+
+
+def shards_run(num_shards, scale, latency):
+    """
+    \b
+    Upload a generated tree with several local processes,
+    merge their deltas, check the Box tree and the map
+    against the local tree, then download it the same
+    way and check the contents
+
+    Returns
+    -------
+    num_files	: number of files in the tree
+    errors	: list of messages
+    """
+    box = fakebox.FakeBox(latency=latency)
+    server = fakebox.start_fakebox(box)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    errors = []
+
+    try:
+        with tempfile.TemporaryDirectory(prefix="figaro-shards-") as project:
+            os.makedirs(os.path.join(project, ".figaro"))
+            with open(os.path.join(project, ".figaro", "config"), "w") as stream:
+                toml.dump(
+                    {
+                        "credentials": {
+                            "client_id": "benchmark",
+                            "client_secret": "benchmark",
+                            "access_token": "benchmark",
+                        },
+                        "folder": {"box_id": "0"},
+                    },
+                    stream,
+                )
+
+            num_files, _ = shard_tree(project, scale, num_shards)
+            local_folders, local_files = local_tree(project)
+
+            for command, args in [
+                ("upload-folder", ["upload-folder", "."]),
+                ("download-folder", ["download-folder", "."]),
+            ]:
+                if command == "download-folder":
+                    for entry in os.listdir(project):
+                        if entry != ".figaro":
+                            shutil.rmtree(os.path.join(project, entry))
+
+                failed = run_shards(url, project, num_shards, args)
+                errors.extend(
+                    f"{command} shard {index} failed:\n{output}"
+                    for index, output in failed
+                )
+                if failed:
+                    break
+
+                box_folders, box_files = box.tree()
+                if command == "upload-folder":
+                    if set(box_folders) != local_folders:
+                        errors.append(
+                            "Box folders differ from local: "
+                            + f"{sorted(set(box_folders) ^ local_folders)}"
+                        )
+                    if {
+                        path: sha1 for path, (_, sha1) in box_files.items()
+                    } != local_files:
+                        errors.append("Box files differ from local")
+                else:
+                    downloaded_folders, downloaded_files = local_tree(project)
+                    if (downloaded_folders, downloaded_files) != (
+                        local_folders,
+                        local_files,
+                    ):
+                        errors.append(
+                            "downloaded tree differs from the upload: "
+                            + f"{sorted(set(downloaded_files.items()) ^ set(local_files.items()))}"
+                        )
+
+                errors.extend(
+                    f"{command}: {error}"
+                    for error in check_map(project, box_folders, box_files)
+                )
+
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return num_files, errors
+
+
+@click.command(
+    context_settings={"ignore_unknown_options": True, "allow_interspersed_args": False}
+)
+@click.option("--shards", "num_shards", default=4, help="Number of shards")
+@click.option("--scale", default=0.2, help="Scale of the generated tree")
+@click.option("--latency", default=0.01, help="Seconds added to each request")
+@click.option("--runs", default=1, help="Number of times the check is run")
+@click.option("--worker", "worker_url", hidden=True)
+@click.argument("figaro_args", nargs=-1, type=click.UNPROCESSED)
+def shards(num_shards, scale, latency, runs, worker_url, figaro_args):
+    """
+    \b
+    Check sharded uploads and downloads run by several
+    local processes, as many times as --runs, since
+    races between the shards do not show on every run
+    """
+    if worker_url:
+        fakebox.use_fakebox(worker_url)
+        figaro.cli.figaro.main(list(figaro_args))
+
+    num_failed = 0
+
+    for run in range(runs):
+        num_files, errors = shards_run(num_shards, scale, latency)
+        num_failed += bool(errors)
+
+        for error in errors:
+            print(f"    - {error}")
+
+        print(
+            f"Run {run + 1}/{runs}, {num_shards} shards, {num_files} files: "
+            + ("FAILED" if errors else "map and trees match")
+        )
+
+    sys.exit(1 if num_failed else 0)
+
+
+if __name__ == "__main__":
+    shards()
@@ -0,0 +1,102 @@
+"""Synthetic project trees for the benchmarks"""
+
+# Standard libraries
+import os
+import random
+
+
+def tree_write(root, path_from_root, size, rng):
+    """
+    Write a file of random bytes, returning its size
+    """
+    file_path = os.path.join(root, path_from_root)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "wb") as stream:
+        stream.write(rng.randbytes(size))
+    return size
+
+
+def tree_wide(root, scale=1.0, seed=0):
+    """
+    \b
+    Many sibling folders with a few files each
+
+    Returns
+    -------
+    num_files	: number of files written
+    num_bytes	: number of bytes written
+    """
+    rng = random.Random(seed)
+    paths = [
+        os.path.join(f"dir{folder:04d}", f"file{index:03d}.dat")
+        for folder in range(int(100 * scale))
+        for index in range(10)
+    ]
+    return len(paths), sum(tree_write(root, path, 4096, rng) for path in paths)
+
+
+def tree_deep(root, scale=1.0, seed=0):
+    """
+    \b
+    A single chain of nested folders
+    with a few files at each level
+
+    Returns
+    -------
+    num_files	: number of files written
+    num_bytes	: number of bytes written
+    """
+    rng = random.Random(seed)
+    paths = []
+    folder = ""
+
+    for depth in range(int(40 * scale)):
+        folder = os.path.join(folder, f"level{depth:03d}")
+        paths.extend(os.path.join(folder, f"file{index}.dat") for index in range(5))
+
+    return len(paths), sum(tree_write(root, path, 4096, rng) for path in paths)
+
+
+def tree_many_small(root, scale=1.0, seed=0):
+    """
+    \b
+    Thousands of sub-kilobyte files
+    in a handful of folders
+
+    Returns
+    -------
+    num_files	: number of files written
+    num_bytes	: number of bytes written
+    """
+    rng = random.Random(seed)
+    paths = [
+        os.path.join(f"run{index // 1000:02d}", f"out{index:06d}.txt")
+        for index in range(int(5000 * scale))
+    ]
+    return len(paths), sum(tree_write(root, path, 512, rng) for path in paths)
+
+
+def tree_few_huge(root, scale=1.0, seed=0):
+    """
+    \b
+    A few files large enough for
+    chunked uploads and ranged downloads
+
+    Returns
+    -------
+    num_files	: number of files written
+    num_bytes	: number of bytes written
+    """
+    rng = random.Random(seed)
+    size = int(80000000 * scale)
+    paths = [os.path.join("checkpoints", f"chk{index:04d}.h5") for index in range(3)]
+    return len(paths), sum(tree_write(root, path, size, rng) for path in paths)
+
+
+# Generators by scenario name
+TREES = {
+    "wide": tree_wide,
+    "deep": tree_deep,
+    "many-small": tree_many_small,
+    "few-huge": tree_few_huge,
+}
@@ -1,4 +1,15 @@
 """Initialization method for Figaro"""
 
-from . import lib
-from . import cli
+# Standard libraries
+import importlib
+
+
+def __getattr__(name):
+    """
+    Import lib and cli on first use, so commands
+    that need neither, like --version, start fast
+    """
+    if name in ["lib", "cli"]:
+        return importlib.import_module(f".{name}", __name__)
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -8,7 +8,13 @@ from figaro import lib
 
 
 @figaro.command("map-items")
-def map_items():
+@click.option("--full", is_flag=True, help="List every folder, ignoring events")
+@click.option(
+    "--skip-unchanged",
+    is_flag=True,
+    help="Copy folders whose markers did not change from the map",
+)
+def map_items(full, skip_unchanged):
     """
     \b
     Write project directory map from Box cloud storage
@@ -17,19 +23,20 @@ def map_items():
     config = lib.load_config()
     client = lib.validate_credentials(config)
 
-    filemap, foldermap = lib.boxmap_from_root(client, config)
-    lib.write_boxmap(config, filemap, foldermap)
+    lib.boxmap_refresh(client, config, full, skip_unchanged)
 
 
 @figaro.command("upload-files")
 @click.argument("sourcelist", nargs=-1)
-def upload_files(sourcelist):
+@click.option("--rehash", is_flag=True, help="Ignore cached hashes of local files")
+def upload_files(sourcelist, rehash):
     """
     \b
     Upload files to Box cloud storage
     """
 
     config = lib.load_config()
+    config.setdefault("sync", {})["rehash"] = rehash
     filemap, foldermap = lib.load_boxmap(config)
     client = lib.validate_credentials(config)
 
@@ -38,12 +45,14 @@ def upload_files(sourcelist):
 
 @figaro.command("upload-folder")
 @click.argument("folderpath", type=click.Path(exists=True))
-def upload_folder(folderpath):
+@click.option("--rehash", is_flag=True, help="Ignore cached hashes of local files")
+def upload_folder(folderpath, rehash):
     """
     \b
     Upload a folder and its contents to Box cloud storage
     """
     config = lib.load_config()
+    config.setdefault("sync", {})["rehash"] = rehash
     filemap, foldermap = lib.load_boxmap(config)
     client = lib.validate_credentials(config)
 
@@ -52,28 +61,86 @@ def upload_folder(folderpath):
 
 @figaro.command("download-files")
 @click.argument("sourcelist", nargs=-1)
-def download_files(sourcelist):
+@click.option("--rehash", is_flag=True, help="Ignore cached hashes of local files")
+def download_files(sourcelist, rehash):
     """
     \b
     Download files from Box cloud storage
     """
 
     config = lib.load_config()
+    config.setdefault("sync", {})["rehash"] = rehash
     filemap, foldermap = lib.load_boxmap(config)
     client = lib.validate_credentials(config)
+    lib.boxmap_pull_events(client, config, filemap, foldermap)
 
     lib.filedownload_from_list(client, config, filemap, foldermap, sourcelist)
 
 
 @figaro.command("download-folder")
 @click.argument("folderpath", type=click.Path(exists=True))
-def download_folder(folderpath):
+@click.option("--rehash", is_flag=True, help="Ignore cached hashes of local files")
+def download_folder(folderpath, rehash):
     """
     \b
     Download a folder and its contents from Box cloud storage
     """
     config = lib.load_config()
+    config.setdefault("sync", {})["rehash"] = rehash
     filemap, foldermap = lib.load_boxmap(config)
     client = lib.validate_credentials(config)
+    lib.boxmap_pull_events(client, config, filemap, foldermap)
 
     lib.folderdownload_recursive(client, config, filemap, foldermap, folderpath)
+
+
+@figaro.command("sync")
+@click.argument("folderpath", type=click.Path(exists=True), default=".")
+@click.option("--plan", "dry_run", is_flag=True, help="Print the plan and exit")
+@click.option("--rehash", is_flag=True, help="Ignore cached hashes of local files")
+def sync(folderpath, dry_run, rehash):
+    """
+    \b
+    Sync a folder with Box cloud storage in both directions
+    """
+    config = lib.load_config()
+    config.setdefault("sync", {})["rehash"] = rehash
+    filemap, foldermap = lib.load_boxmap(config)
+    client = lib.validate_credentials(config)
+    lib.boxmap_pull_events(client, config, filemap, foldermap)
+
+    plan = lib.plan_sync(client, config, filemap, foldermap, folderpath)
+    lib.print_plan(plan)
+
+    if dry_run:
+        return
+
+    messages = lib.execute_plan(client, config, filemap, foldermap, plan)
+    lib.write_boxmap(config, filemap, foldermap)
+    [print(f"{message}") for message in messages]
+
+
+@figaro.command("merge-shards")
+def merge_shards():
+    """
+    \b
+    Merge the map deltas written by the shards of a sharded run
+    """
+    config = lib.load_config()
+
+    lib.shard_merge(config)
+
+
+@figaro.command("watch")
+@click.argument("folderpath", type=click.Path(exists=True), default=".")
+@click.option("--poll", is_flag=True, help="Poll for changes instead of inotify")
+def watch(folderpath, poll):
+    """
+    \b
+    Upload a folder, then keep uploading files as they change
+    """
+    config = lib.load_config()
+    filemap, foldermap = lib.load_boxmap(config)
+    client = lib.validate_credentials(config)
+
+    lib.watch_folder(client, config, filemap, foldermap, folderpath, poll)
@@ -1,29 +1,47 @@
 """Command line interface for Jobrunner"""
 
-# Standard libraries
-import subprocess
-import pkg_resources
-
 # Feature libraries
 import click
 
+# Internal imports
+from figaro import lib
+from figaro.__meta__ import __version__
+
 
 @click.group(name="figaro", invoke_without_command=True)
 @click.pass_context
 @click.option("--version", "-v", is_flag=True)
-def figaro(ctx, version):
+@click.option(
+    "--profile", is_flag=True, help="Print phase timings and API calls as JSON"
+)
+@click.option(
+    "--trace",
+    "trace_file",
+    type=click.Path(dir_okay=False),
+    help="Write a Chrome trace of phases and API calls to a file",
+)
+@click.option(
+    "--shard",
+    metavar="I/N|auto",
+    help="Transfer slice I of N of the plan, auto takes it from SLURM or MPI",
+)
+def figaro(ctx, version, profile, trace_file, shard):
     """
     \b
     Figaro is a wrapper over Box (https://box.com)
     Python SDK to manage data syncronization requirements
     for supercomputing workloads on linux platforms.
     """
-    if ctx.invoked_subcommand is None and not version:
-        subprocess.run(
-            "export PATH=~/.local/bin:/usr/local/bin:$PATH && figaro --help",
-            shell=True,
-            check=True,
-        )
+    if ctx.invoked_subcommand is not None and (profile or trace_file):
+        lib.profile_start(ctx.invoked_subcommand)
+        ctx.call_on_close(lambda: lib.profile_stop(profile, trace_file))
+
+    if ctx.invoked_subcommand is not None and shard:
+        lib.shard_start(*lib.shard_parse(shard))
+        ctx.call_on_close(lib.shard_stop)
 
     if version:
-        click.echo(pkg_resources.require("figaro")[0].version)
+        click.echo(__version__)
+
+    elif ctx.invoked_subcommand is None:
+        click.echo(ctx.get_help())
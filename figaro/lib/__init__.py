@@ -1,6 +1,65 @@
 """Initialization for lib"""
 
-from ._config import *
-from ._boxmap import *
-from ._upload import *
-from ._download import *
+# Standard libraries
+import importlib
+
+# Modules of lib in import order, their public names are
+# loaded together on first use because importing them pulls
+# in boxsdk, requests, yaml and tqdm
+_MODULES = [
+    "_profile",
+    "_concurrency",
+    "_network",
+    "_config",
+    "_mapindex",
+    "_boxmap",
+    "_events",
+    "_hashcache",
+    "_scan",
+    "_chunked",
+    "_ranged",
+    "_compress",
+    "_bundle",
+    "_upload",
+    "_download",
+    "_scheduler",
+    "_plan",
+    "_shard",
+    "_watch",
+]
+
+_loaded = False
+
+
+def _load():
+    """
+    Import all modules of lib, like from ._module import *
+    """
+    global _loaded
+
+    if _loaded:
+        return
+
+    _loaded = True
+
+    for module_name in _MODULES:
+        module = importlib.import_module(f".{module_name}", __name__)
+        globals().update(
+            {
+                key: value
+                for key, value in vars(module).items()
+                if not key.startswith("_")
+            }
+        )
+
+
+def __getattr__(name):
+    """
+    Load lib on first use of one of its names
+    """
+    if not name.startswith("__"):
+        _load()
+        if name in globals():
+            return globals()[name]
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
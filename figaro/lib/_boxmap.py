@@ -2,19 +2,29 @@
 
 # Standard libraries
 import os
-import math
-import multiprocessing
+import collections
 
 # Specialized libraries
-import dill
 import yaml
-import psutil
-import joblib
-import time
 import pytz
 from datetime import datetime
 import hashlib
 
+# Internal imports
+from figaro import lib
+
+# Fields requested for items in folder listings
+BOXMAP_FIELDS = [
+    "type",
+    "id",
+    "name",
+    "sha1",
+    "size",
+    "modified_at",
+    "etag",
+    "sequence_id",
+]
+
 
 class YamlLoader(yaml.SafeLoader):
     """
@@ -42,6 +52,7 @@ class YamlLoader(yaml.SafeLoader):
         return super().construct_mapping(node, deep)
 
 
+@lib.profile_phase("hash")
 def calculate_file_hash(file_path, chunk_size=65536):
     """
     Calculates the SHA-1 hash of a file in chunks to avoid memory issues with large files.
@@ -67,7 +78,14 @@ def calculate_file_hash(file_path, chunk_size=65536):
     return sha1.hexdigest()
 
 
-def is_file_changed(local_path, box_file, upload=False, download=False):
+def is_file_changed(
+    local_path,
+    box_file,
+    upload=False,
+    download=False,
+    hashcache=None,
+    stat=None,
+):
     """
     Checks if the file has changed between local and cloud.
 
@@ -77,6 +95,12 @@ def is_file_changed(local_path, box_file, upload=False, download=False):
         Local path to the file.
     box_file   : boxsdk.file.File
         Box file object to compare.
+    hashcache  : HashCache
+        Cache of local file hashes. Files are hashed
+        from scratch if it is not provided.
+    stat       : os.stat_result
+        Stat result of the local file from a scan.
+        The file is stat-ed if it is not provided.
 
     Returns
     -------
@@ -88,11 +112,17 @@ def is_file_changed(local_path, box_file, upload=False, download=False):
     elif not upload and not download:
         raise ValueError(f"Need either upload or download to be true")
 
-    if not os.path.exists(local_path):
-        return True
+    # Stat the local file once for time and size,
+    # unless the stat result of a scan was passed in
+    local_stat = stat
+    if local_stat is None:
+        try:
+            local_stat = os.stat(local_path)
+        except FileNotFoundError:
+            return True
 
     # Get local file modification time (in seconds since the epoch)
-    local_mtime = os.path.getmtime(local_path)
+    local_mtime = local_stat.st_mtime
     local_time_utc = datetime.utcfromtimestamp(local_mtime).replace(tzinfo=pytz.UTC)
 
     # Get Box file modification time (converted to seconds since the epoch)
@@ -100,156 +130,317 @@ def is_file_changed(local_path, box_file, upload=False, download=False):
     box_time_utc = box_mtime.astimezone(pytz.UTC)
 
     # Get local file size
-    local_size = os.path.getsize(local_path)
+    local_size = local_stat.st_size
 
     # Compare file times and hashes for upload or download
-    if upload:
-        # Check if cloud file is older than the local file
-        if box_time_utc < local_time_utc:
-            #
-            # Get SHA-1 has for local and box file
+    if (upload and box_time_utc < local_time_utc) or (
+        download and box_time_utc > local_time_utc
+    ):
+        box_size = getattr(box_file, "size", None)
+        box_sha1 = box_file.sha1
+        #
+        # Compressed files are compared with the original bytes
+        if getattr(box_file, "encoding", None) is not None:
+            box_size = box_file.original_size
+            box_sha1 = box_file.original_sha1
+        #
+        # Files with different sizes have different contents
+        if box_size is not None and local_size != box_size:
+            return True
+        #
+        # Get SHA-1 has for local and box file
+        if hashcache is not None:
+            local_hash = hashcache.file_hash(local_path, local_stat, keep=upload)
+        else:
             local_hash = calculate_file_hash(local_path)
-            box_hash = box_file.sha1.lower()
-            #
-            # Check if hashes are inconsistent
-            if local_hash[:40] != box_hash:
-                return True
-
-    if download:
-        # Check if local file is older than the cloud file
-        if box_time_utc > local_time_utc:
-            #
-            # Get SHA-1 has for local and box file
-            local_hash = calculate_file_hash(local_path)
-            box_hash = box_file.sha1.lower()
-            #
-            # Check if hashes are inconsistent
-            if local_hash[:40] != box_hash:
-                return True
+        box_hash = box_sha1.lower()
+        #
+        # Check if hashes are inconsistent
+        if local_hash[:40] != box_hash:
+            return True
 
     return False
 
 
-def load_boxmap(config):
+def boxmap_migrate_yaml(config, filemap, foldermap):
     """
     \b
-    Load boxmap from .figaro/boxmap
+    One-time import of the YAML maps written by
+    earlier versions to .figaro/filemap and
+    .figaro/foldermap into the map index
+
+    Arguments
+    ---------
+    config	: configuration dictionary
+    filemap	: file map index
+    foldermap	: folder map index
     """
-    filemap = multiprocessing.Manager().dict()
-    foldermap = multiprocessing.Manager().dict()
+    for mapname, mapindex in [("filemap", filemap), ("foldermap", foldermap)]:
+        map_path = os.path.join(config["folder"]["local_path"], ".figaro", mapname)
 
-    filemap_path = os.path.join(config["folder"]["local_path"], ".figaro", "filemap")
-    foldermap_path = os.path.join(
-        config["folder"]["local_path"], ".figaro", "foldermap"
-    )
+        if os.path.isfile(map_path) and os.stat(map_path).st_size != 0:
+            with open(map_path, "r") as stream:
+                try:
+                    mapindex.update(yaml.load(stream, Loader=YamlLoader))
+                except yaml.YAMLError as exc:
+                    print(exc)
+                    raise ValueError(f"Unable to migrate {map_path!r}.")
+
+            print(f"Migrated {map_path!r} to .figaro/index.db")
+
+    filemap.store.set_meta("yaml_migrated", "1")
+    filemap.store.commit()
+
+
+@lib.profile_phase("map-load")
+def load_boxmap(config):
+    """
+    \b
+    Load boxmap from .figaro/index.db. Entries are
+    read on demand, so the cost does not depend
+    on the size of the project.
 
-    if os.stat(filemap_path).st_size != 0:
-        with open(filemap_path, "r") as stream:
-            try:
-                filemap.update(yaml.load(stream, Loader=YamlLoader))
-            except yaml.YAMLError as exc:
-                print(exc)
+    Arguments
+    ---------
+    config	: configuration dictionary
+
+    Returns
+    -------
+    filemap	: file map index
+    foldermap	: folder map index
+    """
+    store = lib.open_mapstore(config)
+
+    filemap = lib.MapIndex(store, "files", lib.BoxEntry)
+    foldermap = lib.MapIndex(store, "folders", lib.FolderEntry)
 
-    if os.stat(foldermap_path).st_size != 0:
-        with open(foldermap_path, "r") as stream:
-            try:
-                foldermap.update(yaml.load(stream, Loader=YamlLoader))
-            except yaml.YAMLError as exc:
-                print(exc)
+    if not store.get_meta("yaml_migrated"):
+        boxmap_migrate_yaml(config, filemap, foldermap)
 
     return filemap, foldermap
 
 
+@lib.profile_phase("map-write")
 def write_boxmap(config, filemap, foldermap):
     """
     \b
-    Write boxmap to .figaro/boxmap
+    Write boxmap to .figaro/index.db. Map indexes
+    commit their pending updates while plain dictionaries,
+    like the ones built by boxmap_from_root, replace the
+    stored map in a single transaction. Commits are appended
+    to the write-ahead log, so the cost of a write scales
+    with the number of changes, and it is safe to call
+    this after every change.
+
+    Arguments
+    ---------
+    config	: configuration dictionary
+    filemap	: file map index or dictionary
+    foldermap	: folder map index or dictionary
     """
-    with open(
-        os.path.join(config["folder"]["local_path"], ".figaro", "filemap"), "w"
-    ) as mapfile:
-        for key, value in filemap.items():
-            mapfile.write(f"{key}: {value}\n")
+    for mapping, mapindex in zip([filemap, foldermap], load_boxmap(config)):
+        if not isinstance(mapping, lib.MapIndex):
+            mapindex.clear()
+            mapindex.update(mapping)
 
-    with open(
-        os.path.join(config["folder"]["local_path"], ".figaro", "foldermap"), "w"
-    ) as mapfile:
-        for key, value in foldermap.items():
-            mapfile.write(f"{key}: {value}\n")
+    lib.open_mapstore(config).commit()
 
 
-def boxmap_from_item(item, path_from_root, filemap, foldermap):
+def boxmap_entry(box_file):
     """
+    \b
+    Build the map entry for a box file, keeping
+    the metadata needed to compare it with a
+    local file without another API call
+
     Arguments
     ---------
-    folder		: boxsdk folder/item object
-    path_from_root	: path from root
-    boxmap		: multiprocessing manager dictionary
-    """
-    item = dill.loads(item)
+    box_file	: boxsdk file object
 
-    if hasattr(item, "get_items"):
-        boxmap_from_folder(
-            item, os.path.join(path_from_root, item.name), filemap, foldermap
-        )
-        foldermap.update({os.path.join(path_from_root, item.name): item.object_id})
-    else:
-        filemap.update({os.path.join(path_from_root, item.name): item.object_id})
+    Returns
+    -------
+    entry	: BoxEntry object
+    """
+    return lib.BoxEntry(
+        box_file.object_id,
+        getattr(box_file, "sha1", None),
+        getattr(box_file, "size", None),
+        getattr(box_file, "modified_at", None),
+        getattr(box_file, "etag", None),
+    )
 
 
-def boxmap_from_folder(folder, path_from_root, filemap, foldermap):
+def boxmap_folder_entry(box_folder):
     """
     \b
-    Get a list of files from a box folder
+    Build the map entry for a box folder with
+    the markers of its current version
 
     Arguments
     ---------
-    folder		: boxsdk folder/item object
-    path_from_root	: path_from_root
+    box_folder	: boxsdk folder object
+
+    Returns
+    -------
+    entry	: FolderEntry object
     """
-    itemlist = list(folder.get_items())
-    cpu_avail = max(
-        1,
-        psutil.cpu_count()
-        - math.floor(psutil.cpu_percent() * psutil.cpu_count() / 100),
+    return lib.FolderEntry(
+        box_folder.object_id,
+        getattr(box_folder, "etag", None),
+        getattr(box_folder, "sequence_id", None),
+        getattr(box_folder, "modified_at", None),
+        getattr(box_folder, "size", None),
     )
 
-    num_procs = min(cpu_avail, len(itemlist))
 
-    if num_procs in [0, 1]:
+def boxmap_folder_unchanged(old_entry, entry):
+    """
+    \b
+    Check if a folder has the same id and markers
+    as when it was mapped. This assumes that Box
+    updates the modified time or the size of every
+    folder above a change, which Box does not
+    document for deep changes that keep sizes.
+    """
+    return (
+        old_entry is not None
+        and str(old_entry.id) == str(entry.id)
+        and entry.modified_at is not None
+        and old_entry[1:] == entry[1:]
+    )
 
-        [
-            boxmap_from_item(dill.dumps(item), path_from_root, filemap, foldermap)
-            for item in itemlist
-        ]
 
-    else:
+def boxmap_list_folder(folder):
+    """
+    \b
+    List items of a box folder, consuming
+    every page of the listing
 
-        with joblib.parallel_backend(n_jobs=num_procs, backend="loky"):
-            joblib.Parallel(batch_size="auto")(
-                joblib.delayed(boxmap_from_item)(
-                    dill.dumps(item), path_from_root, filemap, foldermap
-                )
-                for item in itemlist
-            )
+    Arguments
+    ---------
+    folder	: boxsdk folder object
 
+    Returns
+    -------
+    itemlist	: list of boxsdk items
+    """
+    return list(folder.get_items(limit=1000, fields=BOXMAP_FIELDS))
+
+
+def boxmap_from_folder(
+    folder,
+    path_from_root,
+    filemap,
+    foldermap,
+    num_threads,
+    bundles=None,
+    previous=None,
+):
+    """
+    \b
+    Get a list of files from a box folder using a
+    breadth-first crawl. A single work queue holds
+    the folders that remain to be listed and a bounded
+    pool of threads fetches their listings, so the crawl
+    is limited by API latency instead of process startup.
+    With a previous map, subfolders whose markers have
+    not changed are copied from it instead of listed.
 
-def boxmap_from_root(client, config):
+    Arguments
+    ---------
+    folder		: boxsdk folder/item object
+    path_from_root	: path_from_root
+    filemap		: dictionary of file ids
+    foldermap		: dictionary of folder ids
+    num_threads		: maximum number of listings in flight
+    bundles		: dictionary of bundle entries by id,
+                          bundles are left out of filemap
+    previous		: (filemap, foldermap) map indexes of
+                          the last listing
+    """
+    queue = collections.deque([(folder, path_from_root)])
+
+    def next_listing():
+        if not queue:
+            return None
+        box_folder, folder_path = queue.popleft()
+        return folder_path, boxmap_list_folder, (box_folder,)
+
+    def add_listing(folder_path, items):
+        for item in items:
+            item_path = os.path.join(folder_path, item.name)
+            if item.type == "folder":
+                entry = boxmap_folder_entry(item)
+                foldermap[item_path] = entry
+                if previous and boxmap_folder_unchanged(
+                    previous[1].entry(item_path), entry
+                ):
+                    filemap.update(previous[0].entries(item_path))
+                    foldermap.update(previous[1].entries(item_path))
+                else:
+                    queue.append((item, item_path))
+            elif lib.is_bundle_name(item.name):
+                if bundles is not None:
+                    bundles[item.object_id] = boxmap_entry(item)
+            else:
+                filemap[item_path] = boxmap_entry(item)
+
+    lib.run_bounded(num_threads, next_listing, add_listing)
+
+
+@lib.profile_phase("map-build")
+def boxmap_from_root(client, config, skip_unchanged=False):
     """
     \b
-    Get a list of files from a box folder
+    Get a list of files from a box folder. With
+    skip_unchanged set, folders that have not
+    changed since the saved map are copied from
+    it instead of listed.
 
     Arguments
     ---------
     client	: boxsdk client object
     config	: configuration dictionary
+    skip_unchanged	: copy unchanged folders from the map
     """
     folder = client.folder(config["folder"]["box_id"])
     path_from_root = ""
 
-    filemap = multiprocessing.Manager().dict()
-    foldermap = multiprocessing.Manager().dict()
+    filemap = {}
+    foldermap = {}
+    bundles = {}
+    previous = load_boxmap(config)
+
+    boxmap_from_folder(
+        folder,
+        path_from_root,
+        filemap,
+        foldermap,
+        lib.max_workers(config),
+        bundles,
+        previous if skip_unchanged else None,
+    )
 
-    boxmap_from_folder(folder, path_from_root, filemap, foldermap)
+    for item_path, box_file in previous[0].entries():
+        #
+        # Files packed in bundles are only known to the map,
+        # keep them for the bundles that are still on Box
+        if box_file.id in bundles and item_path not in filemap:
+            filemap[item_path] = box_file._replace(
+                modified_at=bundles[box_file.id].modified_at
+            )
+        #
+        # Compressed files are stored with a suffix, map them back
+        # to their local path while they are unchanged on Box
+        elif box_file.encoding is not None:
+            stored_path = item_path + lib.COMPRESSION_SUFFIXES[box_file.encoding]
+            stored_file = filemap.get(stored_path)
+            if stored_file is not None and stored_file.sha1 == box_file.sha1:
+                filemap[item_path] = stored_file._replace(
+                    encoding=box_file.encoding,
+                    original_sha1=box_file.original_sha1,
+                    original_size=box_file.original_size,
+                )
+                del filemap[stored_path]
 
     return filemap, foldermap
@@ -0,0 +1,266 @@
+"""Module for bundles of small files"""
+
+# Standard libraries
+import os
+import uuid
+import hashlib
+import tarfile
+import collections
+
+# Internal imports
+from figaro import lib
+
+# Bundles are stored on Box as uncompressed tar
+# files with names that start with this prefix
+BUNDLE_PREFIX = ".figaro-bundle-"
+
+
+def is_bundle_name(name):
+    """
+    Check if a Box file name is the name of a bundle
+    """
+    return name.startswith(BUNDLE_PREFIX) and name.endswith(".tar")
+
+
+def plan_bundles(config, filemap, plan):
+    """
+    \b
+    Group the items of a plan into bundles. Uploads
+    of files below bundle_threshold that are new or
+    already bundled are packed per folder into bundle
+    items of at most bundle_size bytes. Downloads of
+    several files from the same bundle become a single
+    unbundle item that fetches the bundle once.
+
+    Arguments
+    ---------
+    config	: configuration dictionary
+    filemap	: file map index
+    plan	: list of PlanItem objects
+
+    Returns
+    -------
+    plan	: list of PlanItem objects
+    """
+    bundle_threshold = lib.transfer_option(config, "bundle_threshold")
+    bundle_size = lib.transfer_option(config, "bundle_size")
+
+    result = []
+    uploads = collections.OrderedDict()
+    downloads = collections.OrderedDict()
+
+    for item in plan:
+        if item.action == "upload" and item.size < bundle_threshold:
+            box_file = filemap.entry(item.path_from_root)
+            if (
+                box_file is None or box_file.offset is not None
+            ) and lib.compression_policy(config, item.path_from_root) is None:
+                folder_from_root = os.path.dirname(item.path_from_root)
+                uploads.setdefault(folder_from_root, []).append(item)
+                continue
+
+        elif item.action == "download":
+            box_file = filemap.entry(item.path_from_root)
+            if box_file is not None and box_file.offset is not None:
+                downloads.setdefault(box_file.id, []).append(item)
+                continue
+
+        result.append(item)
+
+    for folder_from_root, items in uploads.items():
+        members = []
+        members_size = 0
+        for item in items:
+            if members and members_size + item.size > bundle_size:
+                result.extend(plan_bundle_upload(config, folder_from_root, members))
+                members = []
+                members_size = 0
+            members.append(item)
+            members_size += item.size
+        result.extend(plan_bundle_upload(config, folder_from_root, members))
+
+    for bundle_id, items in downloads.items():
+        if len(items) < 2:
+            result.extend(items)
+            continue
+
+        path_from_root = os.path.join(
+            os.path.dirname(items[0].path_from_root), f"{BUNDLE_PREFIX}{bundle_id}"
+        )
+        result.append(
+            lib.PlanItem(
+                "unbundle",
+                path_from_root,
+                None,
+                sum(item.size for item in items),
+                f"{len(items)} files in one bundle",
+                members=items,
+            )
+        )
+
+    return result
+
+
+def plan_bundle_upload(config, folder_from_root, members):
+    """
+    \b
+    Plan the upload of files from one folder as
+    a bundle, single files are uploaded as they are
+
+    Returns
+    -------
+    plan	: list of PlanItem objects
+    """
+    if len(members) < 2:
+        return members
+
+    path_from_root = os.path.join(
+        folder_from_root, f"{BUNDLE_PREFIX}{uuid.uuid4().hex}.tar"
+    )
+
+    return [
+        lib.PlanItem(
+            "bundle",
+            path_from_root,
+            os.path.join(config["folder"]["local_path"], path_from_root),
+            sum(member.size for member in members),
+            f"{len(members)} small files",
+            members=members,
+        )
+    ]
+
+
+def bundle_upload(client, config, filemap, foldermap, item):
+    """
+    \b
+    Pack the members of a bundle item into a tar file
+    under .figaro/bundles and upload it. Each member is
+    hashed while it is packed and recorded in the map
+    with the id of the bundle and the offset of its data.
+
+    Arguments
+    ---------
+    client	: boxsdk client object
+    config	: configuration dictionary
+    filemap	: file map index
+    foldermap	: folder map index
+    item	: PlanItem of the bundle
+
+    Returns
+    -------
+    message	: status message
+    filemap_update	: new file entries to merge into filemap
+    """
+    local_root = config["folder"]["local_path"]
+    folder_from_root = os.path.dirname(item.path_from_root)
+    bundle_name = os.path.basename(item.path_from_root)
+    bundle_dir = os.path.join(local_root, ".figaro", "bundles")
+    bundle_path = os.path.join(bundle_dir, bundle_name)
+
+    if folder_from_root:
+        upload_obj = client.folder(str(foldermap[folder_from_root]))
+    else:
+        upload_obj = client.folder(config["folder"]["box_id"])
+
+    hashcache = lib.load_hashcache(config)
+    members = {}
+
+    os.makedirs(bundle_dir, exist_ok=True)
+
+    try:
+        with tarfile.open(bundle_path, "w") as bundle:
+            for member in item.members:
+                hashcache.discard(member.local_path)
+                with open(member.local_path, "rb") as stream:
+                    stat = os.fstat(stream.fileno())
+                    info = tarfile.TarInfo(os.path.basename(member.path_from_root))
+                    info.size = stat.st_size
+                    info.mtime = stat.st_mtime
+                    info.mode = stat.st_mode & 0o7777
+
+                    reader = lib.HashingReader(stream)
+                    bundle.addfile(info, reader)
+
+                # Data is padded to whole blocks after the header
+                padded_size = -(-info.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+                offset = bundle.offset - padded_size
+                sha1 = reader.sha1.hexdigest()
+
+                hashcache.record(member.local_path, sha1, stat)
+                members[member.path_from_root] = (sha1, info.size, offset)
+
+        if os.stat(bundle_path).st_size < lib.transfer_option(
+            config, "chunked_threshold"
+        ):
+            box_file = upload_obj.upload(bundle_path, file_name=bundle_name)
+        else:
+            box_file = lib.chunked_upload(
+                config, upload_obj, bundle_path, file_name=bundle_name
+            )
+
+    finally:
+        if os.path.exists(bundle_path):
+            os.remove(bundle_path)
+
+    filemap_update = {
+        path_from_root: lib.BoxEntry(
+            box_file.id, sha1, size, box_file.modified_at, None, offset
+        )
+        for path_from_root, (sha1, size, offset) in members.items()
+    }
+
+    message = f'    - Bundle "{bundle_name}" with {len(members)} files uploaded to Box with file ID {box_file.id}'
+
+    return message, filemap_update
+
+
+def bundle_download(client, config, filemap, foldermap, item):
+    """
+    \b
+    Download a whole bundle once and extract
+    the members of an unbundle item
+
+    Arguments
+    ---------
+    client	: boxsdk client object
+    config	: configuration dictionary
+    filemap	: file map index
+    foldermap	: folder map index
+    item	: PlanItem of the unbundle
+
+    Returns
+    -------
+    message	: status message
+    filemap_update	: new file entries to merge into filemap
+    """
+    bundle_id = filemap.entry(item.members[0].path_from_root).id
+    bundle_dir = os.path.join(config["folder"]["local_path"], ".figaro", "bundles")
+    bundle_path = os.path.join(bundle_dir, f"{bundle_id}.tar")
+
+    os.makedirs(bundle_dir, exist_ok=True)
+
+    try:
+        with open(bundle_path, "wb") as download_stream:
+            client.file(bundle_id).download_to(download_stream)
+
+        hashcache = lib.load_hashcache(config)
+
+        with open(bundle_path, "rb") as bundle:
+            for member in item.members:
+                box_file = filemap.entry(member.path_from_root)
+                bundle.seek(box_file.offset)
+                data = bundle.read(box_file.size)
+                os.makedirs(os.path.dirname(member.local_path), exist_ok=True)
+                with open(bundle_path + ".part", "wb") as stream:
+                    stream.write(data)
+                os.replace(bundle_path + ".part", member.local_path)
+                hashcache.record(member.local_path, hashlib.sha1(data).hexdigest())
+
+    finally:
+        for path in [bundle_path, bundle_path + ".part"]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    message = f"    - Extracted {len(item.members)} files from bundle with file ID {bundle_id}"
+
+    return message, {}
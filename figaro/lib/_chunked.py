@@ -0,0 +1,288 @@
+"""Module for parallel chunked uploads"""
+
+# Standard libraries
+import os
+import json
+import time
+import hashlib
+import threading
+import concurrent.futures
+
+# Specialized libraries
+from boxsdk.exception import BoxAPIException
+from boxsdk.object.upload_session import UploadSession
+
+# Internal imports
+from figaro import lib
+
+
+def chunked_upload_resume(store, upload_obj, file_path, file_stat, file_name=None):
+    """
+    \b
+    Find the upload session saved for a file by an
+    earlier run, or create and save a new one. A saved
+    session is resumed only if it targets the same Box
+    item, the local file is unchanged and Box still
+    knows the session, otherwise it is discarded.
+
+    Arguments
+    ---------
+    store	: MapStore object
+    upload_obj	: boxsdk folder for a new file, or
+                  boxsdk file for a new version
+    file_path	: local path of the file
+    file_stat	: stat result of the file
+    file_name	: name of the new file on Box
+
+    Returns
+    -------
+    upload_session	: boxsdk upload session object
+    done_parts		: part records already uploaded, keyed by offset
+    """
+    file_path = os.path.abspath(file_path)
+    target = f"{upload_obj.object_type}/{upload_obj.object_id}/{file_name or ''}"
+    identity = (target, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns)
+
+    rows = store.execute(
+        "SELECT target, inode, size, mtime_ns, session_id FROM upload_sessions WHERE path = ?",
+        (file_path,),
+    )
+
+    if rows:
+        session_id = rows[0][-1]
+        upload_session = UploadSession(upload_obj.session, session_id)
+
+        try:
+            if tuple(rows[0][:-1]) == identity:
+                upload_session = upload_session.get()
+                done_parts = {
+                    offset: json.loads(part)
+                    for offset, part in store.execute(
+                        "SELECT offset, part FROM upload_parts WHERE session_id = ?",
+                        (session_id,),
+                    )
+                }
+                return upload_session, done_parts
+
+            upload_session.abort()
+
+        except BoxAPIException:
+            # The session expired or was already discarded on Box
+            pass
+
+        chunked_upload_forget(store, file_path)
+
+    upload_session = upload_obj.create_upload_session(file_stat.st_size, file_name)
+
+    store.execute(
+        "INSERT OR REPLACE INTO upload_sessions (path, target, inode, size, mtime_ns, session_id) VALUES (?, ?, ?, ?, ?, ?)",
+        (file_path, *identity, upload_session.object_id),
+    )
+    store.commit()
+
+    return upload_session, {}
+
+
+def chunked_upload_forget(store, file_path):
+    """
+    \b
+    Remove the upload session saved for a file
+    together with the records of its parts
+
+    Arguments
+    ---------
+    store	: MapStore object
+    file_path	: local path of the file
+    """
+    file_path = os.path.abspath(file_path)
+
+    with store.lock:
+        store.execute(
+            "DELETE FROM upload_parts WHERE session_id IN (SELECT session_id FROM upload_sessions WHERE path = ?)",
+            (file_path,),
+        )
+        store.execute("DELETE FROM upload_sessions WHERE path = ?", (file_path,))
+        store.commit()
+
+
+def chunked_upload_part(
+    store, upload_session, part, file_size, buffer_slots, failed, report
+):
+    """
+    \b
+    Upload one part of a chunked upload, save its
+    record so that an interrupted upload can resume,
+    and free its slot in the memory buffer
+
+    Arguments
+    ---------
+    store		: MapStore object
+    upload_session	: boxsdk upload session object
+    part		: (offset, bytes, sha1 digest) of the part
+    file_size		: total size of the file
+    buffer_slots	: semaphore bounding parts held in memory
+    failed		: event set when the upload of a part fails
+    report		: callable reporting the bytes of the part
+
+    Returns
+    -------
+    part_record	: part record returned by Box
+    """
+    offset, chunk, chunk_sha1 = part
+
+    try:
+        part_record = upload_session.upload_part_bytes(
+            chunk, offset, file_size, chunk_sha1
+        )
+
+        with store.lock:
+            store.execute(
+                "INSERT OR REPLACE INTO upload_parts (session_id, offset, part) VALUES (?, ?, ?)",
+                (upload_session.object_id, offset, json.dumps(part_record)),
+            )
+            store.commit()
+
+        report(len(chunk))
+        return part_record
+
+    except BaseException:
+        failed.set()
+        raise
+    finally:
+        buffer_slots.release()
+
+
+def chunked_upload(config, upload_obj, file_path, file_name=None, etag=None):
+    """
+    \b
+    Upload a file through a Box upload session with
+    several parts in flight. Parts are read in order
+    by the calling thread, which computes the digest
+    of the whole file as they stream, and are sent
+    by part_parallelism threads. At most buffer_size
+    bytes of parts are held in memory at any time.
+
+    The session and every finished part are saved in
+    .figaro/index.db. If the upload is interrupted, the
+    next upload of the unchanged file resumes the same
+    session and only sends the missing parts. Parts
+    that were already sent are read again to rebuild
+    the digest, since a partial SHA-1 cannot be saved.
+
+    Arguments
+    ---------
+    config	: configuration dictionary
+    upload_obj	: boxsdk folder for a new file, or
+                  boxsdk file for a new version
+    file_path	: local path of the file
+    file_name	: name of the new file on Box
+    etag	: only update a file whose etag matches
+
+    Returns
+    -------
+    box_file	: boxsdk file object that was uploaded
+    """
+    file_stat = os.stat(file_path)
+    file_size = file_stat.st_size
+    part_parallelism = lib.transfer_option(config, "part_parallelism")
+    buffer_size = lib.transfer_option(config, "buffer_size")
+
+    store = lib.open_mapstore(config)
+    upload_session, done_parts = chunked_upload_resume(
+        store, upload_obj, file_path, file_stat, file_name
+    )
+    part_size = upload_session.part_size
+
+    buffer_slots = threading.BoundedSemaphore(max(1, buffer_size // part_size))
+    content_sha1 = hashlib.sha1()
+    failed = threading.Event()
+    report = lib.plan_progress_reporter()
+    futures = []
+
+    with concurrent.futures.ThreadPoolExecutor(part_parallelism) as executor:
+        with open(file_path, "rb") as stream:
+            for offset in range(0, file_size, part_size):
+                buffer_slots.acquire()
+                chunk = stream.read(part_size)
+                content_sha1.update(chunk)
+
+                if offset in done_parts:
+                    buffer_slots.release()
+                    report(len(chunk))
+                    continue
+
+                part = (offset, chunk, hashlib.sha1(chunk).digest())
+                futures.append(
+                    executor.submit(
+                        chunked_upload_part,
+                        store,
+                        upload_session,
+                        part,
+                        file_size,
+                        buffer_slots,
+                        failed,
+                        report,
+                    )
+                )
+                #
+                # Stop reading as soon as a part fails
+                if failed.is_set():
+                    break
+
+        # Parts that were sent stay saved for the next run
+        parts = list(done_parts.values()) + [future.result() for future in futures]
+
+    try:
+        box_file = chunked_upload_commit(
+            upload_session, content_sha1.digest(), parts, etag=etag
+        )
+
+    except BoxAPIException as exc:
+        #
+        # A rejected commit, such as an etag or digest
+        # mismatch, cannot succeed when retried
+        if 400 <= exc.status < 500:
+            try:
+                upload_session.abort()
+            except BoxAPIException:
+                pass
+            chunked_upload_forget(store, file_path)
+        raise
+
+    chunked_upload_forget(store, file_path)
+
+    # Record the digest computed while streaming the parts
+    if os.stat(file_path).st_mtime_ns == file_stat.st_mtime_ns:
+        lib.load_hashcache(config).record(
+            file_path, content_sha1.hexdigest(), file_stat
+        )
+
+    return box_file
+
+
+def chunked_upload_commit(upload_session, content_sha1, parts, etag=None):
+    """
+    \b
+    Commit an upload session, waiting while Box
+    is still processing the parts
+
+    Arguments
+    ---------
+    upload_session	: boxsdk upload session object
+    content_sha1	: SHA-1 digest of the whole file
+    parts		: part records returned by Box
+    etag		: only update a file whose etag matches
+
+    Returns
+    -------
+    box_file	: boxsdk file object that was uploaded
+    """
+    parts = sorted(parts, key=lambda part: part["offset"])
+
+    for _ in range(30):
+        box_file = upload_session.commit(content_sha1, parts=parts, etag=etag)
+        if box_file is not None:
+            return box_file
+        time.sleep(2)
+
+    raise ValueError(f"Upload session {upload_session.object_id} was not committed.")
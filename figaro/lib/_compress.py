@@ -0,0 +1,266 @@
+"""Module for compression of stored files"""
+
+# Standard libraries
+import os
+import io
+import zlib
+import gzip
+import uuid
+
+# Specialized libraries
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Internal imports
+from figaro import lib
+
+# Suffix added to the Box name of a compressed file
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+# Level used when a policy does not give one
+COMPRESSION_LEVELS = {"gzip": 6, "zstd": 3}
+
+
+class DecompressingWriter:
+    """
+    Class DecompressingWriter for a writable stream that
+    decompresses the bytes written through it
+    """
+
+    def __init__(self, stream, encoding):
+        """
+        Constructor
+        """
+        self.stream = stream
+
+        if encoding == "gzip":
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self.decompressor = (
+                compression_module(encoding).ZstdDecompressor().decompressobj()
+            )
+
+    def write(self, data):
+        """
+        Decompress and write bytes to the stream
+        """
+        self.stream.write(self.decompressor.decompress(data))
+        return len(data)
+
+    def close(self):
+        """
+        Write out the bytes that are still buffered
+        """
+        if hasattr(self.decompressor, "flush"):
+            self.stream.write(self.decompressor.flush())
+
+
+def compression_module(encoding):
+    """
+    \b
+    Check that a compression encoding is known
+    and that the library it needs is installed
+
+    Arguments
+    ---------
+    encoding	: gzip or zstd
+    """
+    if encoding not in COMPRESSION_SUFFIXES:
+        raise ValueError(f"Unknown compression {encoding}, use gzip or zstd.")
+
+    if encoding == "zstd" and zstandard is None:
+        raise ValueError("zstd compression needs the zstandard package.")
+
+    return gzip if encoding == "gzip" else zstandard
+
+
+def compression_policy(config, path_from_root):
+    """
+    \b
+    Find the compression for a file in the
+    [compression] section of .figaro/config.
+    Keys are gitignore-style patterns and values
+    are "gzip", "zstd", or either with a level
+    such as "zstd:9". The first matching pattern
+    is used. As in .figaro/ignore, a pattern matches
+    a file or one of its parent folders, and one
+    ending with / only matches parent folders.
+
+    Arguments
+    ---------
+    config		: configuration dictionary
+    path_from_root	: path from root of the project
+
+    Returns
+    -------
+    policy	: (encoding, level) or None
+    """
+    parts = path_from_root.split(os.sep)
+    folders = ["/".join(parts[:index]) for index in range(1, len(parts))]
+
+    for pattern, value in config.get("compression", {}).items():
+        regex = lib.ignore_pattern_regex(pattern.rstrip("/"))
+        paths = folders if pattern.endswith("/") else folders + ["/".join(parts)]
+
+        if any(regex.match(path) for path in paths):
+            encoding, _, level = str(value).partition(":")
+            compression_module(encoding)
+            return encoding, int(level) if level else COMPRESSION_LEVELS[encoding]
+
+    return None
+
+
+def compression_for_upload(config, path_from_root, box_file=None):
+    """
+    \b
+    Find the compression for an upload. New files
+    follow the [compression] policy, files already
+    on Box keep the encoding they were stored with.
+
+    Arguments
+    ---------
+    config		: configuration dictionary
+    path_from_root	: path from root of the project
+    box_file		: map entry of a file already on Box
+
+    Returns
+    -------
+    policy	: (encoding, level) or None
+    """
+    policy = compression_policy(config, path_from_root)
+
+    if box_file is None:
+        return policy
+
+    encoding = getattr(box_file, "encoding", None)
+
+    if encoding is None:
+        return None
+
+    if policy is None or policy[0] != encoding:
+        return encoding, COMPRESSION_LEVELS[encoding]
+
+    return policy
+
+
+def compress_file(config, source, policy):
+    """
+    \b
+    Compress a file into a temporary file under
+    .figaro/compressed, hashing the original
+    bytes in the same pass
+
+    Arguments
+    ---------
+    config	: configuration dictionary
+    source	: readable stream of the original file
+    policy	: (encoding, level)
+
+    Returns
+    -------
+    temp_path	: path of the compressed file
+    sha1	: SHA-1 hash of the original bytes
+    size	: number of original bytes
+    """
+    encoding, level = policy
+    temp_dir = os.path.join(config["folder"]["local_path"], ".figaro", "compressed")
+    temp_path = os.path.join(temp_dir, uuid.uuid4().hex)
+    reader = lib.HashingReader(source)
+    size = 0
+
+    os.makedirs(temp_dir, exist_ok=True)
+
+    try:
+        with open(temp_path, "wb") as stream:
+            if encoding == "gzip":
+                # Fixed mtime keeps the output reproducible
+                with gzip.GzipFile(
+                    fileobj=stream, mode="wb", compresslevel=level, mtime=0
+                ) as compressed:
+                    while True:
+                        data = reader.read(io.DEFAULT_BUFFER_SIZE * 64)
+                        if not data:
+                            break
+                        compressed.write(data)
+                        size += len(data)
+            else:
+                compressor = compression_module(encoding).ZstdCompressor(level=level)
+                size = compressor.copy_stream(reader, stream)[0]
+
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    return temp_path, reader.sha1.hexdigest(), size
+
+
+def compressed_upload(
+    config,
+    upload_obj,
+    file_path,
+    stat,
+    policy,
+    file_name=None,
+    etag=None,
+    contents=None,
+):
+    """
+    \b
+    Compress a file and upload it as a new file
+    or a new version. The map entry returned keeps
+    the hash and size of the original bytes.
+
+    Arguments
+    ---------
+    config	: configuration dictionary
+    upload_obj	: boxsdk folder for a new file, or
+                  boxsdk file for a new version
+    file_path	: local path of the file
+    stat	: stat result of the file
+    policy	: (encoding, level)
+    file_name	: name of the new file on Box, without suffix
+    etag	: only update a file whose etag matches
+    contents	: bytes of the file if they were already read
+
+    Returns
+    -------
+    box_file	: boxsdk file object that was uploaded
+    entry	: BoxEntry for the map
+    """
+    encoding, _ = policy
+
+    if contents is None:
+        with open(file_path, "rb") as source:
+            temp_path, sha1, size = compress_file(config, source, policy)
+    else:
+        temp_path, sha1, size = compress_file(config, io.BytesIO(contents), policy)
+
+    try:
+        if file_name is not None:
+            file_name += COMPRESSION_SUFFIXES[encoding]
+
+        if os.stat(temp_path).st_size >= lib.transfer_option(
+            config, "chunked_threshold"
+        ):
+            box_file = lib.chunked_upload(
+                config, upload_obj, temp_path, file_name=file_name, etag=etag
+            )
+        else:
+            with open(temp_path, "rb") as stream:
+                if file_name is None:
+                    box_file = upload_obj.update_contents_with_stream(stream, etag=etag)
+                else:
+                    box_file = upload_obj.upload_stream(stream, file_name)
+
+    finally:
+        os.remove(temp_path)
+
+    # Record the hash computed while compressing
+    if os.stat(file_path).st_mtime_ns == stat.st_mtime_ns:
+        lib.load_hashcache(config).record(file_path, sha1, stat)
+
+    return box_file, lib.boxmap_entry(box_file)._replace(
+        encoding=encoding, original_sha1=sha1, original_size=size
+    )
@@ -0,0 +1,198 @@
+"""Module for adaptive control of concurrent requests"""
+
+# Standard libraries
+import time
+import threading
+import concurrent.futures
+
+# Defaults for the [concurrency] section of .figaro/config
+DEFAULT_FLOOR = 1
+DEFAULT_CAP = 16
+DEFAULT_INITIAL = 4
+
+
+class ConcurrencyController:
+    """
+    Class ConcurrencyController limiting the number of requests
+    in flight with additive-increase/multiplicative-decrease (AIMD).
+
+    Completed requests are counted in windows of one limit. After
+    each window the limit grows by one as long as throughput has not
+    dropped, and shrinks by one if it did, so the limit stops growing
+    once extra requests only add latency. A 429 or 5xx response halves
+    the limit and a Retry-After header pauses new requests until it
+    expires. The limit stays between floor and cap.
+    """
+
+    def __init__(self, floor=DEFAULT_FLOOR, cap=DEFAULT_CAP, initial=DEFAULT_INITIAL):
+        """
+        Constructor
+        """
+        if floor < 1 or cap < floor:
+            raise ValueError(f"Invalid concurrency floor {floor} and cap {cap}.")
+
+        self.floor = floor
+        self.cap = cap
+        self.limit = float(min(cap, max(floor, initial)))
+        self.inflight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.window_rate = None
+        self.avg_latency = None
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Wait for a free request slot
+        """
+        with self.condition:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    self.condition.wait(pause)
+                elif self.inflight < int(self.limit):
+                    break
+                else:
+                    self.condition.wait()
+
+            self.inflight += 1
+
+    def release(self, status, latency, retry_after=None):
+        """
+        \b
+        Release a request slot and adjust the limit
+        from the outcome of the request
+
+        Arguments
+        ---------
+        status		: HTTP status code, 599 for network errors
+        latency		: seconds the request took
+        retry_after	: value of the Retry-After header, if any
+        """
+        with self.condition:
+            self.inflight -= 1
+            now = time.monotonic()
+
+            if self.avg_latency is None:
+                self.avg_latency = latency
+            else:
+                self.avg_latency = 0.9 * self.avg_latency + 0.1 * latency
+
+            if status == 429 or status >= 500:
+                if retry_after:
+                    self.paused_until = max(self.paused_until, now + retry_after)
+                #
+                # Decrease at most once per round trip, a burst of
+                # errors from the same window is one congestion signal
+                if now - self.last_decrease > self.avg_latency:
+                    self.limit = max(self.floor, self.limit / 2)
+                    self.last_decrease = now
+                self.window_rate = None
+                self._reset_window(now)
+
+            else:
+                self.window_count += 1
+                if self.window_count >= int(self.limit):
+                    rate = self.window_count / max(now - self.window_start, 1e-6)
+                    if self.window_rate is None or rate >= 0.9 * self.window_rate:
+                        self.limit = min(self.cap, self.limit + 1)
+                    else:
+                        self.limit = max(self.floor, self.limit - 1)
+                    self.window_rate = rate
+                    self._reset_window(now)
+
+            self.condition.notify_all()
+
+    def _reset_window(self, now):
+        """
+        Start a new measurement window
+        """
+        self.window_start = now
+        self.window_count = 0
+
+
+def run_bounded(num_threads, next_task, on_done):
+    """
+    \b
+    Run tasks on a pool of threads, keeping at most
+    num_threads of them in flight. Tasks are pulled
+    as threads free up, so finishing tasks can make
+    new ones ready. If a task raises, the tasks in
+    flight finish before the error is raised.
+
+    Arguments
+    ---------
+    num_threads	: most tasks in flight
+    next_task	: callable returning the next ready task
+                  as (key, function, args), None if no
+                  task is ready
+    on_done	: callable(key, result) run in the calling
+                  thread when a task finishes
+    """
+    inflight = {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+        while True:
+            while len(inflight) < num_threads:
+                task = next_task()
+                if task is None:
+                    break
+                key, function, args = task
+                inflight[executor.submit(function, *args)] = key
+
+            if not inflight:
+                break
+
+            done, _ = concurrent.futures.wait(
+                inflight, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+
+            for future in done:
+                key = inflight.pop(future)
+                try:
+                    result = future.result()
+                except Exception:
+                    for pending in inflight:
+                        pending.cancel()
+                    concurrent.futures.wait(inflight)
+                    raise
+
+                on_done(key, result)
+
+
+def max_workers(config):
+    """
+    \b
+    Number of worker threads to start, which is the
+    cap on concurrent requests from .figaro/config
+
+    Arguments
+    ---------
+    config	: configuration dictionary
+    """
+    return config.get("concurrency", {}).get("cap", DEFAULT_CAP)
+
+
+def load_controller(config):
+    """
+    \b
+    Build a concurrency controller from the
+    [concurrency] section of .figaro/config
+
+    Arguments
+    ---------
+    config	: configuration dictionary
+
+    Returns
+    -------
+    controller	: ConcurrencyController object
+    """
+    options = config.get("concurrency", {})
+
+    return ConcurrencyController(
+        floor=options.get("floor", DEFAULT_FLOOR),
+        cap=options.get("cap", DEFAULT_CAP),
+        initial=options.get("initial", DEFAULT_INITIAL),
+    )
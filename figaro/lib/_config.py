@@ -6,8 +6,47 @@ import toml
 
 # Specialized libraries
 import boxsdk
-
-
+import boxsdk.session.session
+
+# Internal imports
+from figaro import lib
+
+# Defaults for the [transfer] section of .figaro/config
+TRANSFER_DEFAULTS = {
+    # Files of this size and above use chunked uploads,
+    # Box requires at least 20 MB for an upload session
+    "chunked_threshold": 20000000,
+    # Parts of one chunked upload, or ranges of one
+    # ranged download, transferred concurrently
+    "part_parallelism": 4,
+    # Bytes of parts one chunked upload holds in memory
+    "buffer_size": 256000000,
+    # Bytes of small files to upload kept in memory after
+    # they are hashed, for the whole process
+    "hash_buffer_size": 256000000,
+    # Files of this size and above are downloaded in ranges
+    "ranged_threshold": 64000000,
+    # Bytes in one range of a ranged download
+    "range_size": 16000000,
+    # New files below this size are packed into bundles
+    # per folder, 0 turns bundling off
+    "bundle_threshold": 0,
+    # Bytes of files packed into one bundle
+    "bundle_size": 1000000000,
+}
+
+# Defaults for the [watch] section of .figaro/config
+WATCH_DEFAULTS = {
+    # Seconds without new changes that close a batch
+    "debounce": 2.0,
+    # Longest seconds a batch waits for changes to settle
+    "max_delay": 30.0,
+    # Seconds between scans when inotify is not used
+    "poll_interval": 30.0,
+}
+
+
+@lib.profile_phase("config")
 def load_config():
     """
     \b
@@ -39,11 +78,56 @@ def load_config():
     return config
 
 
+def transfer_option(config, key):
+    """
+    \b
+    Get an option from the [transfer] section
+    of .figaro/config, or its default
+
+    Arguments
+    ---------
+    config	: configuration dictionary
+    key		: name of the option
+    """
+    value = config.get("transfer", {}).get(key, TRANSFER_DEFAULTS[key])
+
+    if key == "chunked_threshold" and value < TRANSFER_DEFAULTS[key]:
+        raise ValueError(
+            f"chunked_threshold must be at least {TRANSFER_DEFAULTS[key]}."
+        )
+
+    if key == "range_size" and value < 1:
+        raise ValueError("range_size must be positive.")
+
+    return value
+
+
+def watch_option(config, key):
+    """
+    \b
+    Get an option from the [watch] section
+    of .figaro/config, or its default
+
+    Arguments
+    ---------
+    config	: configuration dictionary
+    key		: name of the option
+    """
+    value = config.get("watch", {}).get(key, WATCH_DEFAULTS[key])
+
+    if value <= 0:
+        raise ValueError(f"{key} must be positive.")
+
+    return value
+
+
 def validate_credentials(config):
     """
     \b
     Validate user credentials for Oauth
-    or JWT authentication.
+    or JWT authentication. Requests of the
+    client are limited by a ConcurrencyController
+    built from the [concurrency] section.
 
     Arguments
     ---------
@@ -58,6 +142,10 @@ def validate_credentials(config):
         access_token=config["credentials"]["access_token"],
     )
 
-    client = boxsdk.Client(oauth)
+    network = lib.FigaroNetwork(lib.load_controller(config))
+    client = boxsdk.Client(
+        oauth,
+        session=boxsdk.session.session.AuthorizedSession(oauth, network_layer=network),
+    )
 
     return client
@@ -2,13 +2,9 @@
 
 # Standard libraries
 import os
-import math
+import threading
 
 # Specialized libraries
-import dill
-import psutil
-import joblib
-import tqdm
 
 # Internal imports
 from figaro import lib
@@ -22,29 +18,96 @@ def filedownload_to_path(client, config, filemap, foldermap, file_path):
     ---------
     client    : boxsdk client object
     config    : configuration dictionary
+    filemap   : file mapping dictionary
+    foldermap : folder mapping dictionary
     file_path : local file path where the file should be downloaded
-    """
-    client = dill.loads(client)
 
+    Returns
+    -------
+    message   : status message
+    filemap_update : new file entries to merge into filemap
+    """
     path_from_root = os.path.abspath(file_path).replace(
         config["folder"]["local_path"] + os.sep, ""
     )
 
-    if path_from_root in filemap.keys():
-        file_id = filemap[path_from_root]
-        box_file = client.file(file_id).get()
-
-        if lib.is_file_changed(file_path, box_file, download=True):
-            with open(file_path, "wb") as download_stream:
-                box_file.download_to(download_stream)
-            message = f'    - File "{box_file.name}" has been downloaded.'
+    if path_from_root in filemap:
+        box_file = filemap.entry(path_from_root)
+        file_name = os.path.basename(path_from_root)
+
+        # Compare with the metadata saved in the map
+        # and only ask Box for it when it is incomplete
+        if box_file.sha1 is None or box_file.modified_at is None:
+            box_file = client.file(box_file.id).get()
+
+        hashcache = lib.load_hashcache(config)
+
+        if lib.is_file_changed(file_path, box_file, download=True, hashcache=hashcache):
+            offset = getattr(box_file, "offset", None)
+            encoding = getattr(box_file, "encoding", None)
+
+            if (
+                offset is None
+                and encoding is None
+                and (box_file.size or 0)
+                >= lib.transfer_option(config, "ranged_threshold")
+            ):
+                lib.ranged_download(config, client, box_file, file_path)
+            else:
+                #
+                # Bytes are written to a partial file under
+                # .figaro/downloads that is renamed into place,
+                # so a scan never sees a half-written file
+                part_dir = os.path.join(
+                    config["folder"]["local_path"], ".figaro", "downloads"
+                )
+                part_path = os.path.join(
+                    part_dir,
+                    f"{os.getpid()}-{threading.get_ident()}-{box_file.id}.part",
+                )
+                os.makedirs(part_dir, exist_ok=True)
+
+                try:
+                    with open(part_path, "wb") as download_stream:
+                        writer = lib.HashingWriter(download_stream)
+                        if encoding is not None:
+                            #
+                            # Decompress while streaming, the hash is
+                            # computed on the original bytes
+                            decompressor = lib.DecompressingWriter(writer, encoding)
+                            client.file(box_file.id).download_to(decompressor)
+                            decompressor.close()
+                        elif offset is None:
+                            client.file(box_file.id).download_to(writer)
+                        elif box_file.size:
+                            #
+                            # Fetch only the data of a file packed in a bundle
+                            client.file(box_file.id).download_to(
+                                writer, byte_range=(offset, offset + box_file.size - 1)
+                            )
+
+                    os.makedirs(
+                        os.path.dirname(os.path.abspath(file_path)), exist_ok=True
+                    )
+                    os.replace(part_path, file_path)
+
+                except BaseException:
+                    if os.path.exists(part_path):
+                        os.remove(part_path)
+                    raise
+                #
+                # Hash the bytes as they are written, so the
+                # file is not read again by the next sync
+                hashcache.record(file_path, writer.sha1.hexdigest())
+
+            message = f'    - File "{file_name}" has been downloaded.'
         else:
-            message = f'    - File "{box_file.name}" is up to date. Skipped download.'
+            message = f'    - File "{file_name}" is up to date. Skipped download.'
 
     else:
         raise ValueError(f"{file_path} not found in filemap.")
 
-    return message
+    return message, {}
 
 
 def filedownload_from_list(client, config, filemap, foldermap, filelist):
@@ -55,31 +118,26 @@ def filedownload_from_list(client, config, filemap, foldermap, filelist):
     ---------
     client   : boxsdk client object
     config   : configuration dictionary
+    filemap  : file mapping dictionary
+    foldermap: folder mapping dictionary
     filelist : list of local file paths to download
     """
-    cpu_avail = max(
-        1,
-        psutil.cpu_count()
-        - math.floor(psutil.cpu_percent() * psutil.cpu_count() / 100),
-    )
+    plan = []
 
-    num_procs = min(cpu_avail, len(filelist))
+    for file_path in filelist:
+        path_from_root = os.path.abspath(file_path).replace(
+            config["folder"]["local_path"] + os.sep, ""
+        )
+        box_file = filemap.entry(path_from_root)
+        if box_file is None:
+            raise ValueError(f"{file_path} not found in filemap.")
 
-    if num_procs in [0, 1]:
-        messages = [
-            filedownload_to_path(
-                dill.dumps(client), config, filemap, foldermap, file_path
-            )
-            for file_path in tqdm.tqdm(filelist, position=0)
-        ]
-    else:
-        with joblib.parallel_backend(n_jobs=num_procs, backend="loky"):
-            messages = joblib.Parallel(batch_size="auto")(
-                joblib.delayed(filedownload_to_path)(
-                    dill.dumps(client), config, filemap, foldermap, file_path
-                )
-                for file_path in tqdm.tqdm(filelist, position=0)
-            )
+        plan.append(
+            lib.PlanItem("download", path_from_root, file_path, box_file.size or 0, "")
+        )
+
+    plan = lib.shard_plan(plan)
+    messages = lib.execute_plan(client, config, filemap, foldermap, plan)
 
     lib.write_boxmap(config, filemap, foldermap)
     [print(f"{message}") for message in messages]
@@ -95,44 +153,20 @@ def folderdownload_recursive(client, config, filemap, foldermap, local_folder_pa
     config              : configuration dictionary
     filemap             : file mapping dictionary
     foldermap           : folder mapping dictionary
-    folder_id           : Box folder ID to download from
     local_folder_path   : Local path where files should be downloaded
     """
-    path_from_root = os.path.abspath(local_folder_path).replace(
-        config["folder"]["local_path"] + os.sep, ""
+    print(f'Downloading box folder "{local_folder_path}"')
+
+    plan = lib.plan_sync(
+        client,
+        config,
+        filemap,
+        foldermap,
+        local_folder_path,
+        upload=False,
+        download=True,
     )
+    messages = lib.execute_plan(client, config, filemap, foldermap, plan)
 
-    folder_id = str(foldermap[path_from_root])
-
-    # Get the Box folder object using the folder_id
-    box_folder = client.folder(folder_id)
-
-    print(f'Downloading box folder "{path_from_root}"')
-
-    # Create the local folder if it doesn't exist
-    if not os.path.exists(local_folder_path):
-        os.makedirs(local_folder_path)
-        print(f'Created local folder "{path_from_root}"')
-
-    # Get the folder items (both files and subfolders)
-    folder_items = box_folder.get_items()
-
-    filelist = []
-    folderlist = []
-
-    for item in folder_items:
-        if item.type == "file":
-            filelist.append(os.path.join(os.path.abspath(local_folder_path), item.name))
-        elif item.type == "folder":
-            folderlist.append(
-                os.path.join(os.path.abspath(local_folder_path), item.name)
-            )
-
-    filedownload_from_list(client, config, filemap, foldermap, filelist)
-
-    for item in folderlist:
-        # Recursively download subfolder
-        new_local_folder_path = os.path.join(local_folder_path, item)
-        folderdownload_recursive(
-            client, config, filemap, foldermap, new_local_folder_path
-        )
+    lib.write_boxmap(config, filemap, foldermap)
+    [print(f"{message}") for message in messages]
@@ -0,0 +1,349 @@
+"""Module for incremental map updates from the Box events stream"""
+
+# Standard libraries
+import os
+import collections
+
+# Specialized libraries
+import boxsdk
+
+# Internal imports
+from figaro import lib
+
+# Events that leave an item in the state carried by the event
+EVENTS_UPSERT = [
+    "ITEM_CREATE",
+    "ITEM_UPLOAD",
+    "ITEM_MOVE",
+    "ITEM_RENAME",
+    "ITEM_COPY",
+    "ITEM_MODIFY",
+    "ITEM_UNDELETE_VIA_TRASH",
+]
+
+# Events that remove an item
+EVENTS_REMOVE = ["ITEM_TRASH"]
+
+# Largest page of events requested at once
+EVENTS_PAGE = 500
+
+
+def events_position(client):
+    """
+    \b
+    Get the current position of the events stream
+
+    Arguments
+    ---------
+    client	: boxsdk client object
+    """
+    return client.events().get_latest_stream_position()
+
+
+def events_since(client, position):
+    """
+    \b
+    Fetch every event after a stream position,
+    leaving out duplicates the stream may repeat
+
+    Arguments
+    ---------
+    client	: boxsdk client object
+    position	: stream position
+
+    Returns
+    -------
+    events	: list of boxsdk event objects in order
+    position	: stream position after the last event
+    """
+    events = collections.OrderedDict()
+
+    while True:
+        page = client.events().get_events(limit=EVENTS_PAGE, stream_position=position)
+        position = page["next_stream_position"]
+
+        for event in page["entries"]:
+            events.setdefault(getattr(event, "event_id", id(event)), event)
+
+        if len(page["entries"]) < EVENTS_PAGE:
+            break
+
+    return list(events.values()), position
+
+
+def events_path(config, source):
+    """
+    \b
+    Path from root of an item in an event, from
+    the folders in its path collection
+
+    Returns
+    -------
+    path_from_root	: path, or None if the item is
+                          not inside the project folder
+    """
+    root_id = str(config["folder"]["box_id"])
+    path_collection = getattr(source, "path_collection", None)
+
+    if not path_collection:
+        return None
+
+    folders = path_collection["entries"]
+    ids = [str(folder.object_id) for folder in folders]
+
+    if root_id not in ids:
+        return None
+
+    names = [folder.name for folder in folders[ids.index(root_id) + 1 :]]
+    return os.path.join(*names, source.name)
+
+
+def events_move_prefix(filemap, foldermap, old_path, new_path):
+    """
+    \b
+    Move every entry under a folder of the
+    map to a new folder path
+    """
+    for mapping in [filemap, foldermap]:
+        moved = {
+            new_path + path_from_root[len(old_path) :]: entry
+            for path_from_root, entry in mapping.entries(old_path)
+        }
+        for path_from_root, _ in mapping.prefix(old_path):
+            del mapping[path_from_root]
+        mapping.update(moved)
+
+
+def events_remove_prefix(filemap, foldermap, path_from_root):
+    """
+    \b
+    Remove a folder and every entry under
+    it from the map
+    """
+    for mapping in [filemap, foldermap]:
+        for item_path, _ in mapping.prefix(path_from_root):
+            del mapping[item_path]
+
+    if path_from_root in foldermap:
+        del foldermap[path_from_root]
+
+
+def events_apply_folder(client, config, filemap, foldermap, event_type, source):
+    """
+    Apply the last event of a folder to the map
+    """
+    path_from_root = events_path(config, source)
+    old_paths = foldermap.paths(source.object_id)
+
+    if event_type in EVENTS_REMOVE or path_from_root is None:
+        for old_path in old_paths:
+            events_remove_prefix(filemap, foldermap, old_path)
+        return
+
+    for old_path in old_paths:
+        if old_path != path_from_root:
+            events_move_prefix(filemap, foldermap, old_path, path_from_root)
+            del foldermap[old_path]
+
+    foldermap[path_from_root] = source.object_id
+
+    # Folders new to the map are listed. Contents moved in
+    # have no events of their own, and events of files put
+    # in a folder that was renamed afterwards carry the old
+    # path of the folder, which is dropped with its parent
+    if not old_paths:
+        subfilemap, subfoldermap = {}, {}
+        lib.boxmap_from_folder(
+            client.folder(source.object_id),
+            path_from_root,
+            subfilemap,
+            subfoldermap,
+            lib.max_workers(config),
+        )
+        filemap.update(subfilemap)
+        foldermap.update(subfoldermap)
+
+
+def events_apply_file(config, filemap, event_type, source):
+    """
+    Apply the last event of a file to the map
+    """
+    path_from_root = events_path(config, source)
+    old_paths = filemap.paths(source.object_id)
+
+    if event_type in EVENTS_REMOVE or path_from_root is None:
+        for old_path in old_paths:
+            del filemap[old_path]
+        return
+
+    # Bundles are only known through their members
+    if lib.is_bundle_name(source.name):
+        return
+
+    entry = lib.boxmap_entry(source)
+    old_entry = filemap.entry(old_paths[0]) if old_paths else None
+    #
+    # Compressed files keep their local path and the hash of the
+    # original, which is only known while the contents are unchanged
+    if old_entry is not None and old_entry.encoding is not None:
+        suffix = lib.COMPRESSION_SUFFIXES[old_entry.encoding]
+        if path_from_root.endswith(suffix):
+            path_from_root = path_from_root[: -len(suffix)]
+        if old_entry.sha1 == entry.sha1:
+            entry = old_entry._replace(modified_at=entry.modified_at, etag=entry.etag)
+        else:
+            entry = entry._replace(encoding=old_entry.encoding)
+
+    for old_path in old_paths:
+        if old_path != path_from_root:
+            del filemap[old_path]
+
+    filemap[path_from_root] = entry
+
+
+def events_apply(client, config, filemap, foldermap, events):
+    """
+    \b
+    Apply events to the map. Only the last event of
+    each item is applied, in the order they happened,
+    since it carries the latest state of the item.
+    Items moved out of the project folder or to the
+    trash are removed with everything under them.
+
+    Arguments
+    ---------
+    client	: boxsdk client object
+    config	: configuration dictionary
+    filemap	: file map index
+    foldermap	: folder map index
+    events	: list of boxsdk event objects
+
+    Returns
+    -------
+    changes	: number of items applied
+    """
+    root_id = str(config["folder"]["box_id"])
+    latest = collections.OrderedDict()
+
+    for event in events:
+        event_type = getattr(event, "event_type", None)
+        source = getattr(event, "source", None)
+
+        if event_type not in EVENTS_UPSERT + EVENTS_REMOVE:
+            continue
+
+        if getattr(source, "object_type", None) not in ["file", "folder"]:
+            continue
+
+        if str(source.object_id) == root_id:
+            continue
+
+        # The path of an item is needed to place it
+        if event_type in EVENTS_UPSERT and not getattr(source, "path_collection", None):
+            continue
+
+        key = (source.object_type, str(source.object_id))
+        latest.pop(key, None)
+        latest[key] = (event_type, source)
+
+    applied = []
+
+    for (object_type, _), (event_type, source) in latest.items():
+        if object_type == "folder":
+            events_apply_folder(client, config, filemap, foldermap, event_type, source)
+        else:
+            events_apply_file(config, filemap, event_type, source)
+        applied.append(events_path(config, source))
+    #
+    # Items placed in a folder that was trashed before it
+    # was ever mapped have no parent, leave them out
+    for path_from_root in sorted(filter(None, applied), key=len):
+        folder_from_root = os.path.dirname(path_from_root)
+        if folder_from_root and folder_from_root not in foldermap:
+            events_remove_prefix(filemap, foldermap, path_from_root)
+            if path_from_root in filemap:
+                del filemap[path_from_root]
+
+    return len(latest)
+
+
+def boxmap_pull_events(client, config, filemap, foldermap):
+    """
+    \b
+    Bring the map up to date with the events that
+    happened on Box since the stream position saved
+    by the last refresh. The cost depends on the
+    number of changes instead of the size of the tree.
+
+    Arguments
+    ---------
+    client	: boxsdk client object
+    config	: configuration dictionary
+    filemap	: file map index
+    foldermap	: folder map index
+
+    Returns
+    -------
+    pulled	: False if no position is saved or the
+                  stream could not be read, and a full
+                  listing is needed
+    """
+    # Shards plan from the same map, which has
+    # to be refreshed before the shards start
+    if lib.shard_current() is not None:
+        return False
+
+    store = filemap.store
+    position = store.get_meta("events_position")
+
+    if position is None:
+        return False
+
+    try:
+        events, position = events_since(client, position)
+    except boxsdk.BoxAPIException as error:
+        print(f"    - Cannot read Box events: {error.message or error.status}")
+        return False
+
+    changes = events_apply(client, config, filemap, foldermap, events)
+
+    store.set_meta("events_position", position)
+    lib.write_boxmap(config, filemap, foldermap)
+
+    print(f"Applied {changes} changes from {len(events)} Box events")
+    return True
+
+
+def boxmap_refresh(client, config, full=False, skip_unchanged=False):
+    """
+    \b
+    Refresh the map from Box with the events since
+    the last refresh, or by listing the tree when no
+    position is saved or the stream cannot be read.
+    Since the events do not cover such a listing, it
+    only skips folders that have not changed when
+    skip_unchanged is set. The stream position is
+    read before a listing, so changes made while it
+    runs are applied by the next refresh.
+
+    Arguments
+    ---------
+    client	: boxsdk client object
+    config	: configuration dictionary
+    full	: list every folder, ignoring events
+    skip_unchanged	: copy folders whose markers did
+              not change from the map
+    """
+    filemap, foldermap = lib.load_boxmap(config)
+
+    if not full and boxmap_pull_events(client, config, filemap, foldermap):
+        return
+
+    position = events_position(client)
+    new_filemap, new_foldermap = lib.boxmap_from_root(
+        client, config, skip_unchanged and not full
+    )
+
+    lib.write_boxmap(config, new_filemap, new_foldermap)
+    filemap.store.set_meta("events_position", position)
+    filemap.store.commit()
@@ -0,0 +1,281 @@
+"""Module for the local hash cache"""
+
+# Standard libraries
+import os
+import time
+import hashlib
+import threading
+
+# Internal imports
+from figaro import lib
+
+# Seconds that the contents kept for an upload stay valid,
+# later uploads read the file again
+HASHCACHE_KEEP_SECONDS = 300
+
+# Hash caches keyed by database path
+_HASHCACHES = {}
+_HASHCACHES_LOCK = threading.Lock()
+
+
+class HashCache:
+    """
+    Class HashCache for SHA-1 hashes of local files stored in
+    .figaro/index.db. An entry is valid as long as the inode,
+    size and modification time of the file are unchanged.
+
+    Files smaller than keep_below that are hashed before an
+    upload are read into memory, and their contents are kept
+    so that the upload can send them without reading the file
+    again. At most keep_bytes of contents are kept at once.
+    Kept contents are only sent if the file has the same stat
+    result when it is uploaded, within HASHCACHE_KEEP_SECONDS.
+    """
+
+    def __init__(self, store, rehash=False, keep_below=0, keep_bytes=0):
+        """
+        Constructor
+        """
+        self.store = store
+        self.rehash = rehash
+        self.keep_below = keep_below
+        self.keep_bytes = keep_bytes
+        self.lock = threading.Lock()
+        self.contents = {}
+        self.kept_bytes = 0
+        self.hashed = set()
+
+    def lookup(self, file_path, stat):
+        """
+        Return the cached hash for a stat result or None
+        """
+        rows = self.store.execute(
+            "SELECT sha1 FROM hashes WHERE path = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+            (os.path.abspath(file_path), stat.st_ino, stat.st_size, stat.st_mtime_ns),
+        )
+        return rows[0][0] if rows else None
+
+    def record(self, file_path, sha1, stat=None):
+        """
+        Record the hash of a file for its current stat result
+        """
+        if stat is None:
+            stat = os.stat(file_path)
+
+        self.hashed.add(os.path.abspath(file_path))
+        self.store.execute(
+            "INSERT OR REPLACE INTO hashes (path, inode, size, mtime_ns, sha1) VALUES (?, ?, ?, ?, ?)",
+            (
+                os.path.abspath(file_path),
+                stat.st_ino,
+                stat.st_size,
+                stat.st_mtime_ns,
+                sha1,
+            ),
+        )
+
+    def cached(self, file_path, stat):
+        """
+        \b
+        Get the cached hash of a file, or None if there
+        is no valid entry. With rehash set, only hashes
+        computed by this process are used.
+        """
+        if self.rehash and os.path.abspath(file_path) not in self.hashed:
+            return None
+
+        return self.lookup(file_path, stat)
+
+    def reserve(self, size):
+        """
+        \b
+        Reserve room for the contents of a file,
+        returning False if it is not kept
+        """
+        with self.lock:
+            #
+            # Contents kept too long are not sent anymore
+            expired = time.monotonic() - HASHCACHE_KEEP_SECONDS
+            for path, kept in list(self.contents.items()):
+                if kept[3] < expired:
+                    del self.contents[path]
+                    self.kept_bytes -= len(kept[0])
+
+            if size >= self.keep_below or self.kept_bytes + size > self.keep_bytes:
+                return False
+            self.kept_bytes += size
+            return True
+
+    def discard(self, file_path):
+        """
+        Drop the contents kept for a file, if any
+        """
+        with self.lock:
+            kept = self.contents.pop(os.path.abspath(file_path), None)
+            if kept is not None:
+                self.kept_bytes -= len(kept[0])
+
+    def file_hash(self, file_path, stat=None, keep=False):
+        """
+        \b
+        Get the SHA-1 hash of a file, computing it
+        only if the cache has no valid entry or a
+        rehash was requested
+
+        Arguments
+        ---------
+        file_path	: path to the file
+        stat		: os.stat_result of the file, if known
+        keep		: keep the contents of a file below
+                          keep_below for its upload
+
+        Returns
+        -------
+        str : The SHA-1 hash of the file.
+        """
+        if stat is None:
+            stat = os.stat(file_path)
+
+        sha1 = self.cached(file_path, stat)
+
+        if sha1 is None and keep and self.reserve(stat.st_size):
+            data, sha1 = self.read_contents(file_path)
+            with self.lock:
+                self.contents[os.path.abspath(file_path)] = (
+                    data,
+                    sha1,
+                    stat,
+                    time.monotonic(),
+                )
+                self.kept_bytes += len(data) - stat.st_size
+
+        elif sha1 is None:
+            sha1 = lib.calculate_file_hash(file_path)
+            #
+            # Only trust the hash if the file did not change while reading
+            if os.stat(file_path).st_mtime_ns == stat.st_mtime_ns:
+                self.record(file_path, sha1, stat)
+
+        return sha1
+
+    @lib.profile_phase("hash")
+    def read_contents(self, file_path):
+        """
+        \b
+        Read a whole file with a single pass, hash
+        it and record the hash. Contents kept by
+        file_hash are handed out instead of reading
+        the file again, once, if the file has not
+        changed since and they have not expired.
+
+        Arguments
+        ---------
+        file_path	: path to the file
+
+        Returns
+        -------
+        data	: bytes of the file
+        sha1	: SHA-1 hash of data
+        """
+        with self.lock:
+            kept = self.contents.pop(os.path.abspath(file_path), None)
+            if kept is not None:
+                self.kept_bytes -= len(kept[0])
+
+        # The stat result of a scan may be hours old
+        stat = os.stat(file_path)
+
+        if kept is not None:
+            data, sha1, kept_stat, kept_at = kept
+            if (stat.st_ino, stat.st_size, stat.st_mtime_ns) == (
+                kept_stat.st_ino,
+                kept_stat.st_size,
+                kept_stat.st_mtime_ns,
+            ) and time.monotonic() - kept_at < HASHCACHE_KEEP_SECONDS:
+                return data, sha1
+
+        with open(file_path, "rb") as stream:
+            data = stream.read()
+
+        sha1 = hashlib.sha1(data).hexdigest()
+
+        if os.stat(file_path).st_mtime_ns == stat.st_mtime_ns:
+            self.record(file_path, sha1, stat)
+
+        return data, sha1
+
+
+class HashingReader:
+    """
+    Class HashingReader for a readable stream that computes
+    the SHA-1 hash of the bytes read through it
+    """
+
+    def __init__(self, stream):
+        """
+        Constructor
+        """
+        self.stream = stream
+        self.sha1 = hashlib.sha1()
+
+    def read(self, size=-1):
+        """
+        Read and hash bytes from the stream
+        """
+        data = self.stream.read(size)
+        self.sha1.update(data)
+        return data
+
+
+class HashingWriter:
+    """
+    Class HashingWriter for a writable stream that computes
+    the SHA-1 hash of the bytes written through it
+    """
+
+    def __init__(self, stream):
+        """
+        Constructor
+        """
+        self.stream = stream
+        self.sha1 = hashlib.sha1()
+
+    def write(self, data):
+        """
+        Hash and write bytes to the stream
+        """
+        self.sha1.update(data)
+        return self.stream.write(data)
+
+
+def load_hashcache(config):
+    """
+    \b
+    Load the hash cache of a project. It is shared
+    by the planner and the uploads, so contents kept
+    while a plan is decided are sent by the upload.
+    Contents of files below chunked_threshold are
+    kept, up to hash_buffer_size bytes. Setting
+    config["sync"]["rehash"] ignores cached hashes
+    and recomputes them.
+
+    Arguments
+    ---------
+    config	: configuration dictionary
+
+    Returns
+    -------
+    hashcache	: HashCache object
+    """
+    store = lib.open_mapstore(config)
+
+    with _HASHCACHES_LOCK:
+        if store.path not in _HASHCACHES:
+            _HASHCACHES[store.path] = HashCache(
+                store,
+                rehash=config.get("sync", {}).get("rehash", False),
+                keep_below=lib.transfer_option(config, "chunked_threshold"),
+                keep_bytes=lib.transfer_option(config, "hash_buffer_size"),
+            )
+
+    return _HASHCACHES[store.path]
@@ -0,0 +1,396 @@
+"""Module for the on-disk map index"""
+
+# Standard libraries
+import os
+import atexit
+import sqlite3
+import threading
+import collections.abc
+
+# Internal imports
+from figaro import lib
+
+# Schema migrations applied in order, PRAGMA user_version
+# records how many of them have already been applied
+_MIGRATIONS = [
+    """
+    CREATE TABLE files (path TEXT PRIMARY KEY, id TEXT NOT NULL) WITHOUT ROWID;
+    CREATE TABLE folders (path TEXT PRIMARY KEY, id TEXT NOT NULL) WITHOUT ROWID;
+    CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+    """,
+    """
+    CREATE TABLE hashes (
+        path TEXT PRIMARY KEY,
+        inode INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        sha1 TEXT NOT NULL
+    ) WITHOUT ROWID;
+    """,
+    """
+    ALTER TABLE files ADD COLUMN sha1 TEXT;
+    ALTER TABLE files ADD COLUMN size INTEGER;
+    ALTER TABLE files ADD COLUMN modified_at TEXT;
+    ALTER TABLE files ADD COLUMN etag TEXT;
+    """,
+    """
+    CREATE TABLE upload_sessions (
+        path TEXT PRIMARY KEY,
+        target TEXT NOT NULL,
+        session_id TEXT NOT NULL,
+        inode INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    CREATE TABLE upload_parts (
+        session_id TEXT NOT NULL,
+        offset INTEGER NOT NULL,
+        part TEXT NOT NULL,
+        PRIMARY KEY (session_id, offset)
+    ) WITHOUT ROWID;
+    """,
+    """
+    CREATE TABLE download_ranges (
+        id TEXT NOT NULL,
+        sha1 TEXT NOT NULL,
+        offset INTEGER NOT NULL,
+        PRIMARY KEY (id, offset)
+    ) WITHOUT ROWID;
+    """,
+    """
+    ALTER TABLE files ADD COLUMN offset INTEGER;
+    """,
+    """
+    ALTER TABLE files ADD COLUMN encoding TEXT;
+    ALTER TABLE files ADD COLUMN original_sha1 TEXT;
+    ALTER TABLE files ADD COLUMN original_size INTEGER;
+    """,
+    """
+    CREATE INDEX files_id ON files (id);
+    CREATE INDEX folders_id ON folders (id);
+    """,
+    """
+    ALTER TABLE folders ADD COLUMN etag TEXT;
+    ALTER TABLE folders ADD COLUMN sequence_id TEXT;
+    ALTER TABLE folders ADD COLUMN modified_at TEXT;
+    ALTER TABLE folders ADD COLUMN size INTEGER;
+    """,
+]
+
+# Box metadata stored with each file, fields other
+# than the id are None when they are not known. Files
+# packed in a bundle have the id of the bundle and the
+# offset of their data in it. Compressed files have
+# an encoding and the hash and size of the original.
+BoxEntry = collections.namedtuple(
+    "BoxEntry",
+    [
+        "id",
+        "sha1",
+        "size",
+        "modified_at",
+        "etag",
+        "offset",
+        "encoding",
+        "original_sha1",
+        "original_size",
+    ],
+    defaults=[None] * 8,
+)
+
+# Box metadata stored with each folder, the markers
+# that change when the folder or its contents change.
+# They are None when they are not known.
+FolderEntry = collections.namedtuple(
+    "FolderEntry",
+    ["id", "etag", "sequence_id", "modified_at", "size"],
+    defaults=[None] * 4,
+)
+
+# Open stores keyed by database path
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+class MapStore:
+    """
+    Class MapStore for the SQLite database in .figaro/index.db
+    """
+
+    def __init__(self, db_path):
+        """
+        Constructor
+        """
+        self.path = db_path
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        #
+        # Commits are appended to the write-ahead log and folded
+        # into the database by checkpoints, so each commit costs
+        # as much as the changes it carries. Filesystems that do
+        # not support WAL keep the default rollback journal.
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+        atexit.register(self.close)
+
+    def _migrate(self):
+        """
+        Apply pending schema migrations
+        """
+        with self.lock:
+            version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+            for index, script in enumerate(_MIGRATIONS[version:], start=version + 1):
+                self.connection.executescript(
+                    f"BEGIN; {script} PRAGMA user_version = {index}; COMMIT;"
+                )
+
+    def execute(self, statement, parameters=()):
+        """
+        Execute a statement and return all rows
+        """
+        with self.lock:
+            return self.connection.execute(statement, parameters).fetchall()
+
+    def executemany(self, statement, sequence):
+        """
+        Execute a statement for each set of parameters
+        """
+        with self.lock:
+            self.connection.executemany(statement, sequence)
+
+    def get_meta(self, key, default=None):
+        """
+        Read a value from the meta table
+        """
+        rows = self.execute("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else default
+
+    def set_meta(self, key, value):
+        """
+        Write a value to the meta table
+        """
+        self.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value))
+        )
+
+    def commit(self):
+        """
+        Commit pending updates
+        """
+        with self.lock:
+            self.connection.commit()
+
+    def checkpoint(self):
+        """
+        Compact the write-ahead log into the database
+        """
+        with self.lock:
+            self.connection.commit()
+            self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        """
+        Checkpoint and close the connection
+        """
+        with self.lock:
+            if self.connection is not None:
+                self.checkpoint()
+                self.connection.close()
+                self.connection = None
+
+
+class MapIndex(collections.abc.MutableMapping):
+    """
+    Class MapIndex mapping paths from root to box ids
+    for one table of a MapStore. Lookups are point queries
+    on the primary key and updates are batched in the open
+    transaction until the store is committed. Tables with
+    metadata columns take an entry_type namedtuple, and
+    accept either an id or an entry on assignment.
+    """
+
+    def __init__(self, store, table, entry_type=None):
+        """
+        Constructor
+        """
+        self.store = store
+        self.table = table
+        self.entry_type = entry_type
+        #
+        # Columns written for each entry
+        columns = entry_type._fields if entry_type else ("id",)
+        self._columns = ", ".join(columns)
+        self._insert = (
+            f"INSERT OR REPLACE INTO {table} (path, {self._columns}) "
+            + f"VALUES (?{', ?' * len(columns)})"
+        )
+
+    def _row(self, path, value):
+        """
+        Convert an id or an entry to a table row
+        """
+        if self.entry_type is None:
+            return (path, str(value))
+
+        if not isinstance(value, self.entry_type):
+            value = self.entry_type(value)
+
+        return (path, str(value.id), *value[1:])
+
+    def __getitem__(self, path):
+        rows = self.store.execute(
+            f"SELECT id FROM {self.table} WHERE path = ?", (path,)
+        )
+        if not rows:
+            raise KeyError(path)
+        return rows[0][0]
+
+    def __setitem__(self, path, value):
+        self.store.execute(self._insert, self._row(path, value))
+
+    def __delitem__(self, path):
+        if path not in self:
+            raise KeyError(path)
+        self.store.execute(f"DELETE FROM {self.table} WHERE path = ?", (path,))
+
+    def __contains__(self, path):
+        return bool(
+            self.store.execute(f"SELECT 1 FROM {self.table} WHERE path = ?", (path,))
+        )
+
+    def __iter__(self):
+        return (path for path, _ in self.items())
+
+    def __len__(self):
+        return self.store.execute(f"SELECT COUNT(*) FROM {self.table}")[0][0]
+
+    def entry(self, path):
+        """
+        \b
+        Get the entry stored for a path, with every
+        column of the entry type, or None if the
+        path is not in the map
+        """
+        rows = self.store.execute(
+            f"SELECT {self._columns} FROM {self.table} WHERE path = ?", (path,)
+        )
+        if not rows:
+            return None
+        return self.entry_type(*rows[0]) if self.entry_type else rows[0][0]
+
+    def paths(self, box_id):
+        """
+        \b
+        Get the paths stored with a box id, there is
+        more than one for files packed in a bundle
+        """
+        return [
+            row[0]
+            for row in self.store.execute(
+                f"SELECT path FROM {self.table} WHERE id = ? ORDER BY path",
+                (str(box_id),),
+            )
+        ]
+
+    def items(self):
+        """
+        Iterate over (path, id) pairs in path order
+        """
+        return iter(
+            self.store.execute(f"SELECT path, id FROM {self.table} ORDER BY path")
+        )
+
+    def update(self, mapping=(), **kwargs):
+        """
+        Insert or replace several ids or entries with one statement
+        """
+        pairs = dict(mapping, **kwargs).items()
+        self.store.executemany(
+            self._insert, [self._row(path, value) for path, value in pairs]
+        )
+
+    def clear(self):
+        """
+        Remove every entry
+        """
+        self.store.execute(f"DELETE FROM {self.table}")
+
+    def prefix(self, path_from_root):
+        """
+        \b
+        Iterate over (path, id) pairs that lie under
+        a folder, using a range scan on the primary key
+
+        Arguments
+        ---------
+        path_from_root	: folder path from root, "" for all entries
+        """
+        return self._scan("id", path_from_root)
+
+    def entries(self, path_from_root=""):
+        """
+        \b
+        Iterate over (path, entry) pairs that lie
+        under a folder, see prefix
+
+        Arguments
+        ---------
+        path_from_root	: folder path from root, "" for all entries
+        """
+        if self.entry_type is None:
+            return self.prefix(path_from_root)
+
+        return (
+            (row[0], self.entry_type(*row[1:]))
+            for row in self._scan(self._columns, path_from_root)
+        )
+
+    def _scan(self, columns, path_from_root):
+        """
+        Range scan of a subtree in path order
+        """
+        if not path_from_root:
+            return iter(
+                self.store.execute(
+                    f"SELECT path, {columns} FROM {self.table} ORDER BY path"
+                )
+            )
+
+        lower = path_from_root + os.sep
+        upper = path_from_root + chr(ord(os.sep) + 1)
+        return iter(
+            self.store.execute(
+                f"SELECT path, {columns} FROM {self.table} "
+                + "WHERE path >= ? AND path < ? ORDER BY path",
+                (lower, upper),
+            )
+        )
+
+
+def open_mapstore(config):
+    """
+    \b
+    Open the map store for a project, reusing
+    the connection if it is already open, or the
+    delta of the running shard
+
+    Arguments
+    ---------
+    config	: configuration dictionary
+
+    Returns
+    -------
+    store	: MapStore object
+    """
+    # Shards of a sharded run write to their own delta
+    if lib.shard_current() is not None:
+        return lib.shard_mapstore(config)
+
+    db_path = os.path.join(config["folder"]["local_path"], ".figaro", "index.db")
+
+    with _STORES_LOCK:
+        if db_path not in _STORES:
+            _STORES[db_path] = MapStore(db_path)
+
+    return _STORES[db_path]
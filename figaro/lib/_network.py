@@ -0,0 +1,167 @@
+"""Module for the network layer of the Box client"""
+
+# Standard libraries
+import time
+import weakref
+import threading
+
+# Specialized libraries
+import requests
+from boxsdk.network.default_network import DefaultNetwork, DefaultNetworkResponse
+
+# Internal imports
+from figaro import lib
+
+
+class FigaroNetwork(DefaultNetwork):
+    """
+    Class FigaroNetwork for HTTP requests of the Box client.
+    Every request takes a slot from a ConcurrencyController
+    and reports its status and latency back to it. Streamed
+    downloads hold their slot until the body is read, so the
+    controller limits them and sees how long they take. Each worker
+    thread keeps its own requests session for its lifetime, so
+    connections stay alive across tasks and TLS handshakes are
+    not repeated for every file.
+    """
+
+    def __init__(self, controller):
+        """
+        Constructor
+        """
+        self._local = threading.local()
+        super().__init__()
+        self.controller = controller
+
+    @property
+    def _session(self):
+        """
+        Keep-alive session of the calling thread
+        """
+        session = getattr(self._local, "session", None)
+
+        if session is None:
+            session = self._local.session = requests.Session()
+
+        return session
+
+    @_session.setter
+    def _session(self, session):
+        """
+        DefaultNetwork assigns one shared session in its
+        constructor, sessions are created per thread instead
+        """
+
+    @property
+    def network_response_constructor(self):
+        """
+        Base class override
+        """
+        return FigaroNetworkResponse
+
+    def request(self, method, url, access_token, **kwargs):
+        """
+        Base class override
+        """
+        status, retry_after = 599, None
+        bytes_sent, bytes_received = 0, 0
+        released = threading.Event()
+
+        def release():
+            if released.is_set():
+                return
+            released.set()
+            end = time.perf_counter()
+            self.controller.release(status, end - start, retry_after)
+            lib.profile_request(
+                method, url, status, start, end, bytes_sent, bytes_received
+            )
+
+        self.controller.acquire()
+        start = time.perf_counter()
+        streamed = False
+
+        try:
+            response = super().request(method, url, access_token, **kwargs)
+            status = response.status_code
+            retry_after = network_retry_after(response.headers.get("Retry-After"))
+            bytes_sent = network_content_length(response.request_response.request)
+            bytes_received = network_content_length(response)
+            #
+            # The body of a streamed response is read after
+            # the request returns, its slot is released then
+            if kwargs.get("stream") and response.ok:
+                response.on_consumed = release
+                weakref.finalize(response, release)
+                streamed = True
+            return response
+
+        finally:
+            if not streamed:
+                release()
+
+
+class FigaroNetworkResponse(DefaultNetworkResponse):
+    """
+    Class FigaroNetworkResponse for a response whose streamed
+    body calls on_consumed once it has been read
+    """
+
+    on_consumed = None
+
+    @property
+    def response_as_stream(self):
+        """
+        Base class override
+        """
+        return NetworkStream(super().response_as_stream, self.on_consumed)
+
+
+class NetworkStream:
+    """
+    Class NetworkStream for the raw body of a response,
+    calling a function once the body has been streamed
+    """
+
+    def __init__(self, raw, on_consumed=None):
+        """
+        Constructor
+        """
+        self.raw = raw
+        self.on_consumed = on_consumed
+
+    def stream(self, *args, **kwargs):
+        """
+        Stream the body, then call on_consumed
+        """
+        try:
+            yield from self.raw.stream(*args, **kwargs)
+        finally:
+            if self.on_consumed is not None:
+                self.on_consumed()
+
+    def __getattr__(self, name):
+        """
+        Forward other attributes to the raw body
+        """
+        return getattr(self.raw, name)
+
+
+def network_retry_after(header):
+    """
+    Seconds to wait from a Retry-After header, or None
+    """
+    try:
+        return float(header) if header is not None else None
+    except ValueError:
+        return None
+
+
+def network_content_length(message):
+    """
+    Size of a request or response body from its headers
+    """
+    try:
+        return int(message.headers.get("Content-Length", 0))
+    except ValueError:
+        return 0
@@ -0,0 +1,448 @@
+"""Module for planning and executing transfers"""
+
+# Standard libraries
+import os
+import threading
+import collections
+import concurrent.futures
+
+# Specialized libraries
+import tqdm
+import boxsdk
+
+# Internal imports
+from figaro import lib
+
+# One step of a sync plan
+#
+#   action	: upload, download, bundle, unbundle, skip,
+#             mkdir-remote or mkdir-local
+#   path_from_root	: path from root of the project
+#   local_path	: absolute local path
+#   size	: number of bytes to transfer
+#   reason	: why the action was chosen
+#   stat	: stat result of the local file from the scan, if any
+#   members	: PlanItems of the files in a bundle, if any
+PlanItem = collections.namedtuple(
+    "PlanItem",
+    ["action", "path_from_root", "local_path", "size", "reason", "stat", "members"],
+    defaults=[None, None],
+)
+
+# Actions that move file contents
+TRANSFER_ACTIONS = ["upload", "download", "bundle", "unbundle"]
+
+# Actions that need their Box folder to exist first
+REMOTE_ACTIONS = ["mkdir-remote", "upload", "bundle"]
+
+# Progress bar of the running plan, None when no plan is
+# running, and bytes reported by parts of each item so far
+_progress = None
+_progress_parts = collections.Counter()
+_progress_lock = threading.Lock()
+
+# Item run by the calling worker thread
+_progress_local = threading.local()
+
+
+def plan_refresh(client, filemap, path_from_root, box_file):
+    """
+    \b
+    Fetch the Box metadata of a map entry that lacks
+    it, such as the entries imported from the YAML
+    map, and save it to the map so it is fetched once
+
+    Arguments
+    ---------
+    client	: boxsdk client object
+    filemap	: file map index
+    path_from_root	: path of the file from the root folder
+    box_file	: BoxEntry from the map
+
+    Returns
+    -------
+    box_file	: BoxEntry with the metadata, None if
+              the file is no longer on Box
+    """
+    try:
+        box_object = client.file(box_file.id).get(fields=lib.BOXMAP_FIELDS)
+    except boxsdk.BoxAPIException as error:
+        if error.status != 404:
+            raise
+        del filemap[path_from_root]
+        return None
+
+    entry = lib.boxmap_entry(box_object)
+    box_file = box_file._replace(
+        sha1=entry.sha1, size=entry.size, modified_at=entry.modified_at, etag=entry.etag
+    )
+    filemap[path_from_root] = box_file
+    return box_file
+
+
+def plan_decide(hashcache, upload, download, item, box_file):
+    """
+    \b
+    Decide what to do with a file that exists both
+    locally and in the map. The map metadata is used
+    instead of an API call, local hashes come from
+    the hash cache, which keeps the contents of small
+    files to upload so they are read only once.
+
+    Arguments
+    ---------
+    hashcache	: HashCache object
+    upload	: plan uploads
+    download	: plan downloads
+    item	: PlanItem for the file
+    box_file	: BoxEntry from the map
+
+    Returns
+    -------
+    item	: PlanItem with the chosen action
+    """
+    if upload and lib.is_file_changed(
+        item.local_path, box_file, upload=True, hashcache=hashcache, stat=item.stat
+    ):
+        return item._replace(action="upload", reason="changed locally")
+
+    # Contents kept while hashing are only sent by an upload
+    hashcache.discard(item.local_path)
+
+    if download and lib.is_file_changed(
+        item.local_path, box_file, download=True, hashcache=hashcache, stat=item.stat
+    ):
+        return item._replace(
+            action="download", size=box_file.size or 0, reason="changed on Box"
+        )
+
+    return item._replace(action="skip", reason="up to date")
+
+
+@lib.profile_phase("plan")
+def plan_sync(
+    client, config, filemap, foldermap, folder_path, upload=True, download=True
+):
+    """
+    \b
+    Diff a local folder against the map in one pass and
+    plan the transfers needed to bring both sides in
+    sync. Files missing on one side are transferred,
+    deletions are not propagated. Paths ignored by
+    .figaro/ignore are left out on both sides. Map
+    entries without Box metadata are fetched first.
+
+    Arguments
+    ---------
+    client	: boxsdk client object
+    config	: configuration dictionary
+    filemap	: file map index
+    foldermap	: folder map index
+    folder_path	: local folder to plan for
+    upload	: plan uploads of local changes
+    download	: plan downloads of changes on Box
+
+    Returns
+    -------
+    plan	: list of PlanItem objects, folders first
+    """
+    local_root = config["folder"]["local_path"]
+    folder_from_root = os.path.relpath(os.path.abspath(folder_path), local_root)
+    folder_from_root = "" if folder_from_root == os.curdir else folder_from_root
+
+    if folder_from_root.split(os.sep)[0] == os.pardir:
+        raise ValueError(f"{folder_path} is not inside {local_root}.")
+
+    if download and not upload and folder_from_root:
+        if folder_from_root not in foldermap:
+            raise ValueError(f"{folder_from_root} not found in foldermap.")
+
+    folders = []
+    files = []
+    compare = []
+
+    # Scan the local folder, stat-ing each file once
+    local_folders, local_files = lib.scan_tree(config, folder_from_root)
+    ignore = lib.load_ignore(config)
+
+    if upload:
+        ancestors = []
+        parent_from_root = os.path.dirname(folder_from_root)
+        while parent_from_root:
+            ancestors.insert(0, parent_from_root)
+            parent_from_root = os.path.dirname(parent_from_root)
+
+        for path_from_root in ancestors + [folder_from_root] + local_folders:
+            if path_from_root and path_from_root not in foldermap:
+                folders.append(
+                    PlanItem(
+                        "mkdir-remote",
+                        path_from_root,
+                        os.path.join(local_root, path_from_root),
+                        0,
+                        "not on Box",
+                    )
+                )
+
+    # Folders in the map that do not exist locally
+    if download:
+        for path_from_root, _ in foldermap.prefix(folder_from_root):
+            local_path = os.path.join(local_root, path_from_root)
+            if not ignore.ignores(path_from_root, is_dir=True) and not os.path.isdir(
+                local_path
+            ):
+                folders.append(
+                    PlanItem("mkdir-local", path_from_root, local_path, 0, "not local")
+                )
+
+    # Files in the map under the folder
+    for path_from_root, box_file in filemap.entries(folder_from_root):
+        local_path, stat = local_files.pop(path_from_root, (None, None))
+
+        if local_path is not None:
+            compare.append(
+                (
+                    PlanItem(
+                        "skip", path_from_root, local_path, stat.st_size, "", stat
+                    ),
+                    box_file,
+                )
+            )
+
+        elif download and not ignore.ignores(path_from_root):
+            local_path = os.path.join(local_root, path_from_root)
+            files.append(
+                PlanItem(
+                    "download",
+                    path_from_root,
+                    local_path,
+                    box_file.size or 0,
+                    "not local",
+                )
+            )
+
+    # Local files that are not in the map
+    if upload:
+        for path_from_root, (local_path, stat) in local_files.items():
+            files.append(
+                PlanItem(
+                    "upload",
+                    path_from_root,
+                    local_path,
+                    stat.st_size,
+                    "not on Box",
+                    stat,
+                )
+            )
+
+    # A shard of a sharded run keeps its own slice, so
+    # each file is hashed by a single shard. Files in the
+    # map are balanced on their size on Box, which all
+    # shards see the same while others write local files
+    if lib.shard_current() is not None:
+        kept = {
+            item.path_from_root
+            for item in lib.shard_plan(
+                folders
+                + files
+                + [item._replace(size=box_file.size or 0) for item, box_file in compare]
+            )
+        }
+        folders = [item for item in folders if item.path_from_root in kept]
+        files = [item for item in files if item.path_from_root in kept]
+        compare = [pair for pair in compare if pair[0].path_from_root in kept]
+
+    # Compare files that exist on both sides, hashing in parallel
+    hashcache = lib.load_hashcache(config)
+
+    def decide(item, box_file):
+        if box_file.sha1 is None or box_file.modified_at is None:
+            box_file = plan_refresh(client, filemap, item.path_from_root, box_file)
+            if box_file is None:
+                action = "upload" if upload else "skip"
+                return item._replace(action=action, reason="not on Box")
+        return plan_decide(hashcache, upload, download, item, box_file)
+
+    with concurrent.futures.ThreadPoolExecutor(lib.max_workers(config)) as executor:
+        files.extend(executor.map(lambda pair: decide(*pair), compare))
+
+    hashcache.store.commit()
+
+    return sorted(folders) + lib.plan_bundles(config, filemap, files)
+
+
+def print_plan(plan):
+    """
+    \b
+    Print a plan as a dry run with a summary
+    of the actions and bytes involved
+
+    Arguments
+    ---------
+    plan	: list of PlanItem objects
+    """
+    summary = collections.OrderedDict()
+
+    for item in plan:
+        if item.action != "skip":
+            print(
+                f"{item.action:<14}{plan_format_size(item.size):>10}  {item.path_from_root}"
+            )
+
+        count, size = summary.get(item.action, (0, 0))
+        summary[item.action] = (count + 1, size + item.size)
+
+    print("Plan summary:")
+    for action, (count, size) in summary.items():
+        print(f"    - {action:<14}{count:>8} items {plan_format_size(size):>10}")
+
+
+def plan_format_size(size):
+    """
+    Format a number of bytes for humans
+    """
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if size < 1000 or unit == "TB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1000
+
+
+def plan_progress_reporter():
+    """
+    \b
+    Function reporting the bytes moved by the parts of
+    the item run by the calling thread, so the progress
+    of large files advances while they are transferred.
+    It can be called from any thread.
+
+    Returns
+    -------
+    report	: callable(num_bytes)
+    """
+    key = getattr(_progress_local, "key", None)
+
+    def report(num_bytes):
+        with _progress_lock:
+            if _progress is None or key is None:
+                return
+            _progress_parts[key] += num_bytes
+            _progress.update(num_bytes)
+
+    return report
+
+
+def plan_execute_item(client, config, filemap, foldermap, item):
+    """
+    \b
+    Run one item of a plan
+
+    Returns
+    -------
+    message	: status message
+    filemap_update	: new file entries to merge into filemap
+    """
+    _progress_local.key = item.path_from_root
+
+    if item.action == "mkdir-remote":
+        return lib.folderupload_create(client, config, filemap, foldermap, item), {}
+
+    if item.action == "bundle":
+        return lib.bundle_upload(client, config, filemap, foldermap, item)
+
+    if item.action == "unbundle":
+        return lib.bundle_download(client, config, filemap, foldermap, item)
+
+    if item.action == "upload":
+        return lib.fileupload_from_path(
+            client, config, filemap, foldermap, item.local_path, stat=item.stat
+        )
+
+    return lib.filedownload_to_path(client, config, filemap, foldermap, item.local_path)
+
+
+@lib.profile_phase("transfer")
+def execute_plan(client, config, filemap, foldermap, plan):
+    """
+    \b
+    Execute a plan on a single pool of workers that
+    lives for the whole tree. Box folders and uploads
+    are scheduled as a DAG: a folder is created once its
+    parent exists and a file is uploaded once its folder
+    exists, so sibling subtrees are created and filled
+    concurrently. The largest transfers start first, and
+    smaller ones fill the workers left idle, so a large
+    file does not run alone at the end. Folders start as
+    early as the largest transfer they hold. Progress is
+    counted in bytes. New ids are merged into the map as
+    they arrive.
+
+    Arguments
+    ---------
+    client	: boxsdk client object
+    config	: configuration dictionary
+    filemap	: file map index
+    foldermap	: folder map index
+    plan	: list of PlanItem objects
+
+    Returns
+    -------
+    messages	: list of status messages
+    """
+    global _progress
+
+    messages = []
+    sizes = {}
+    graph = lib.TaskGraph()
+
+    for item in plan:
+        if item.action == "mkdir-local":
+            os.makedirs(item.local_path, exist_ok=True)
+            messages.append(f'Created local folder "{item.path_from_root}"')
+
+        elif item.action == "mkdir-remote" or item.action in TRANSFER_ACTIONS:
+            parent = os.path.dirname(item.path_from_root)
+            sizes[item.path_from_root] = item.size
+            graph.add(
+                item.path_from_root,
+                plan_execute_item,
+                client,
+                config,
+                filemap,
+                foldermap,
+                item,
+                depends_on=[parent] if item.action in REMOTE_ACTIONS else [],
+                priority=item.size,
+            )
+
+    if not graph.tasks:
+        return messages
+
+    num_local = len(messages)
+    progress = tqdm.tqdm(
+        total=sum(sizes.values()), unit="B", unit_scale=True, position=0
+    )
+
+    def on_result(key, result):
+        message, filemap_update = result
+        if filemap_update:
+            filemap.update(filemap_update)
+            lib.write_boxmap(config, filemap, foldermap)
+        messages.append(message)
+        with _progress_lock:
+            progress.update(max(0, sizes[key] - _progress_parts.pop(key, 0)))
+            progress.set_postfix_str(
+                f"{len(messages) - num_local}/{len(graph.tasks)} items"
+            )
+
+    with _progress_lock:
+        _progress = progress
+        _progress_parts.clear()
+
+    try:
+        graph.run(min(lib.max_workers(config), len(graph.tasks)), on_result)
+    finally:
+        with _progress_lock:
+            _progress = None
+        progress.close()
+
+    return messages
@@ -0,0 +1,257 @@
+"""Module for profiling of figaro commands"""
+
+# Standard libraries
+import os
+import re
+import sys
+import json
+import time
+import bisect
+import threading
+import contextlib
+import urllib.parse
+
+# Upper bounds in seconds of the request latency histogram
+LATENCY_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+# Profiler of the running command, None when profiling is off
+_profiler = None
+
+
+class Profiler:
+    """
+    Class Profiler recording the phases of a command, the
+    requests sent to each endpoint of the Box API and the
+    bytes moved by each worker thread. Records are kept as
+    spans so they can be written as a Chrome trace.
+    """
+
+    def __init__(self, command=None):
+        """
+        Constructor
+        """
+        self.command = command
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.spans = []
+
+    def span(self, category, name, start, end, **args):
+        """
+        Record a span of the calling thread
+        """
+        thread = threading.current_thread()
+        with self.lock:
+            self.spans.append(
+                (category, name, thread.ident, thread.name, start, end, args)
+            )
+
+    def summary(self):
+        """
+        \b
+        Aggregate spans into seconds and counts per phase,
+        requests and a latency histogram per endpoint, and
+        requests and bytes per worker thread
+
+        Returns
+        -------
+        summary	: dictionary of metrics
+        """
+        phases = {}
+        endpoints = {}
+        workers = {}
+        labels = [f"<={bound}s" for bound in LATENCY_BUCKETS] + ["slower"]
+
+        with self.lock:
+            spans = list(self.spans)
+
+        for category, name, _, thread_name, start, end, args in spans:
+            if category == "phase":
+                phase = phases.setdefault(name, {"count": 0, "seconds": 0.0})
+                phase["count"] += 1
+                phase["seconds"] += end - start
+                continue
+
+            endpoint = endpoints.setdefault(
+                name,
+                {
+                    "count": 0,
+                    "errors": 0,
+                    "seconds": 0.0,
+                    "bytes_sent": 0,
+                    "bytes_received": 0,
+                    "latency": dict.fromkeys(labels, 0),
+                },
+            )
+            worker = workers.setdefault(
+                thread_name, {"requests": 0, "bytes_sent": 0, "bytes_received": 0}
+            )
+
+            endpoint["count"] += 1
+            endpoint["errors"] += args["status"] == 429 or args["status"] >= 500
+            endpoint["seconds"] += end - start
+            endpoint["latency"][
+                labels[bisect.bisect_left(LATENCY_BUCKETS, end - start)]
+            ] += 1
+
+            for counts in [endpoint, worker]:
+                counts["bytes_sent"] += args["bytes_sent"]
+                counts["bytes_received"] += args["bytes_received"]
+            worker["requests"] += 1
+
+        return {
+            "command": self.command,
+            "seconds": time.perf_counter() - self.start,
+            "phases": phases,
+            "endpoints": endpoints,
+            "workers": workers,
+        }
+
+    def trace(self):
+        """
+        \b
+        Spans in the Chrome trace event format, which
+        chrome://tracing and Perfetto can open
+
+        Returns
+        -------
+        trace	: dictionary with traceEvents
+        """
+        events = []
+        threads = {}
+        pid = os.getpid()
+
+        with self.lock:
+            spans = list(self.spans)
+
+        for category, name, tid, thread_name, start, end, args in spans:
+            threads[tid] = thread_name
+            events.append(
+                {
+                    "name": name,
+                    "cat": category,
+                    "ph": "X",
+                    "ts": (start - self.start) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": pid,
+                    "tid": tid,
+                    "args": args,
+                }
+            )
+
+        events.extend(
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": thread_name},
+            }
+            for tid, thread_name in threads.items()
+        )
+
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": self.summary(),
+        }
+
+
+def profile_start(command=None):
+    """
+    \b
+    Start profiling a command
+
+    Arguments
+    ---------
+    command	: name of the command
+    """
+    global _profiler
+    _profiler = Profiler(command)
+
+
+def profile_stop(profile=False, trace_file=None):
+    """
+    \b
+    Stop profiling and write the results
+
+    Arguments
+    ---------
+    profile	: print the summary as JSON on stderr
+    trace_file	: path of a Chrome trace file to write
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+
+    if profiler is None:
+        return
+
+    if trace_file:
+        with open(trace_file, "w") as stream:
+            json.dump(profiler.trace(), stream)
+
+    if profile:
+        json.dump(profiler.summary(), sys.stderr, indent=2)
+        sys.stderr.write("\n")
+
+
+@contextlib.contextmanager
+def profile_phase(name):
+    """
+    \b
+    Record the time spent in a phase of a command,
+    used as a context manager or as a decorator
+
+    Arguments
+    ---------
+    name	: name of the phase
+    """
+    profiler = _profiler
+
+    if profiler is None:
+        yield
+        return
+
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        profiler.span("phase", name, start, time.perf_counter())
+
+
+def profile_request(method, url, status, start, end, bytes_sent, bytes_received):
+    """
+    \b
+    Record a request to the Box API. Ids in the
+    URL are replaced so requests are grouped by
+    endpoint.
+
+    Arguments
+    ---------
+    method		: HTTP method
+    url			: URL of the request
+    status		: HTTP status code, 599 for network errors
+    start		: time.perf_counter() when it was sent
+    end			: time.perf_counter() when it completed
+    bytes_sent		: size of the request body
+    bytes_received	: size of the response body
+    """
+    profiler = _profiler
+
+    if profiler is None:
+        return
+
+    path = urllib.parse.urlsplit(url).path
+    endpoint = (
+        f"{method.upper()} {re.sub(r'/(?=[^/.]*[0-9])[^/.]+(?=/|$)', '/{id}', path)}"
+    )
+
+    profiler.span(
+        "request",
+        endpoint,
+        start,
+        end,
+        status=status,
+        bytes_sent=bytes_sent,
+        bytes_received=bytes_received,
+    )
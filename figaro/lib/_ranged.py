@@ -0,0 +1,171 @@
+"""Module for parallel ranged downloads"""
+
+# Standard libraries
+import os
+import concurrent.futures
+
+# Internal imports
+from figaro import lib
+
+
+class RangeWriter:
+    """
+    Class RangeWriter for a writable stream that writes
+    one byte range of a file in place with pwrite
+    """
+
+    def __init__(self, fd, offset):
+        """
+        Constructor
+        """
+        self.fd = fd
+        self.offset = offset
+
+    def write(self, data):
+        """
+        Write data at the current offset
+        """
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self.fd, view, self.offset)
+            self.offset += written
+            view = view[written:]
+
+
+def ranged_download_range(store, client, box_file, fd, byte_range, report):
+    """
+    \b
+    Download one byte range of a file into the
+    partial file and record it in the journal
+
+    Arguments
+    ---------
+    store	: MapStore object
+    client	: boxsdk client object
+    box_file	: boxsdk file or BoxEntry
+    fd		: file descriptor of the partial file
+    byte_range	: (first, last) inclusive byte offsets
+    report	: callable reporting the bytes of the range
+    """
+    client.file(box_file.id).download_to(
+        RangeWriter(fd, byte_range[0]), byte_range=byte_range
+    )
+    os.fsync(fd)
+
+    with store.lock:
+        store.execute(
+            "INSERT OR REPLACE INTO download_ranges (id, sha1, offset) VALUES (?, ?, ?)",
+            (box_file.id, box_file.sha1, byte_range[0]),
+        )
+        store.commit()
+
+    report(byte_range[1] - byte_range[0] + 1)
+
+
+def ranged_download_forget(store, box_file):
+    """
+    \b
+    Remove the journal of a ranged download
+
+    Arguments
+    ---------
+    store	: MapStore object
+    box_file	: boxsdk file or BoxEntry
+    """
+    with store.lock:
+        store.execute("DELETE FROM download_ranges WHERE id = ?", (box_file.id,))
+        store.commit()
+
+
+def ranged_download(config, client, box_file, file_path):
+    """
+    \b
+    Download a large file in byte ranges fetched by
+    part_parallelism threads. Ranges are written in
+    place into a preallocated partial file under
+    .figaro/downloads, and a journal in .figaro/index.db
+    records the finished ones, so an interrupted
+    download resumes with the missing ranges as long
+    as the file is unchanged on Box. The partial file
+    is checked against the SHA-1 from Box and then
+    renamed to file_path.
+
+    Arguments
+    ---------
+    config	: configuration dictionary
+    client	: boxsdk client object
+    box_file	: boxsdk file or BoxEntry with id, sha1 and size
+    file_path	: local path of the file
+    """
+    part_parallelism = lib.transfer_option(config, "part_parallelism")
+    range_size = lib.transfer_option(config, "range_size")
+
+    store = lib.open_mapstore(config)
+    part_dir = os.path.join(config["folder"]["local_path"], ".figaro", "downloads")
+    part_path = os.path.join(part_dir, f"{box_file.id}.part")
+    os.makedirs(part_dir, exist_ok=True)
+
+    done_offsets = {
+        offset
+        for offset, sha1 in store.execute(
+            "SELECT offset, sha1 FROM download_ranges WHERE id = ?", (box_file.id,)
+        )
+        if sha1 == box_file.sha1
+    }
+
+    # Start over if the file changed on Box since the
+    # journal was written or the partial file is gone
+    if not os.path.isfile(part_path) or os.stat(part_path).st_size != box_file.size:
+        done_offsets = set()
+
+    if not done_offsets:
+        ranged_download_forget(store, box_file)
+
+    fd = os.open(part_path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    try:
+        if not done_offsets:
+            os.ftruncate(fd, 0)
+            try:
+                os.posix_fallocate(fd, 0, box_file.size)
+            except (AttributeError, OSError):
+                os.ftruncate(fd, box_file.size)
+
+        ranges = [
+            (offset, min(offset + range_size, box_file.size) - 1)
+            for offset in range(0, box_file.size, range_size)
+            if offset not in done_offsets
+        ]
+
+        report = lib.plan_progress_reporter()
+        report(box_file.size - sum(last - first + 1 for first, last in ranges))
+
+        with concurrent.futures.ThreadPoolExecutor(part_parallelism) as executor:
+            for future in [
+                executor.submit(
+                    ranged_download_range,
+                    store,
+                    client,
+                    box_file,
+                    fd,
+                    byte_range,
+                    report,
+                )
+                for byte_range in ranges
+            ]:
+                future.result()
+
+    finally:
+        os.close(fd)
+
+    sha1 = lib.calculate_file_hash(part_path)
+
+    if sha1 != box_file.sha1:
+        ranged_download_forget(store, box_file)
+        os.remove(part_path)
+        raise ValueError(f"SHA-1 of downloaded {file_path} does not match Box.")
+
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+    os.replace(part_path, file_path)
+    ranged_download_forget(store, box_file)
+    lib.load_hashcache(config).record(file_path, sha1)
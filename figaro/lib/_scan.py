@@ -0,0 +1,255 @@
+"""Module for scanning local folders"""
+
+# Standard libraries
+import os
+import re
+import collections
+
+# Internal imports
+from figaro import lib
+
+
+class IgnoreRules:
+    """
+    Class IgnoreRules for gitignore-style patterns read from
+    .figaro/ignore. Patterns are matched against paths from the
+    root of the project, the last matching pattern wins and a
+    pattern starting with ! includes a path again.
+    """
+
+    def __init__(self, lines=()):
+        """
+        Constructor
+        """
+        self.rules = []
+
+        for line in lines:
+            line = line.rstrip("\n").rstrip()
+            if not line or line.startswith("#"):
+                continue
+
+            negate = line.startswith("!")
+            if negate or line.startswith("\\"):
+                line = line[1:]
+
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+
+            self.rules.append((ignore_pattern_regex(line), negate, dir_only))
+
+    def match(self, path_from_root, is_dir=False):
+        """
+        \b
+        Check if a path is ignored, without
+        looking at its parent folders
+
+        Arguments
+        ---------
+        path_from_root	: path from root of the project
+        is_dir		: path is a folder
+        """
+        path = path_from_root.replace(os.sep, "/")
+        ignored = False
+
+        for regex, negate, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(path):
+                ignored = not negate
+
+        return ignored
+
+    def ignores(self, path_from_root, is_dir=False):
+        """
+        \b
+        Check if a path or one of its parent
+        folders is ignored
+
+        Arguments
+        ---------
+        path_from_root	: path from root of the project
+        is_dir		: path is a folder
+        """
+        if not self.rules:
+            return False
+
+        parts = path_from_root.split(os.sep)
+
+        for index in range(1, len(parts)):
+            if self.match(os.sep.join(parts[:index]), is_dir=True):
+                return True
+
+        return self.match(path_from_root, is_dir=is_dir)
+
+
+def ignore_pattern_regex(pattern):
+    """
+    \b
+    Translate a gitignore pattern into a regular
+    expression matching paths from the root of the
+    project. Patterns without a slash match at any
+    depth, others are anchored at the root.
+
+    Arguments
+    ---------
+    pattern	: pattern without negation or trailing slash
+    """
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    regex = ""
+    index = 0
+
+    while index < len(pattern):
+        char = pattern[index]
+
+        if pattern.startswith("**/", index):
+            regex += "(?:.*/)?"
+            index += 3
+            continue
+
+        if pattern.startswith("**", index):
+            regex += ".*"
+            index += 2
+            continue
+
+        if char == "*":
+            regex += "[^/]*"
+        elif char == "?":
+            regex += "[^/]"
+        elif char == "[" and "]" in pattern[index + 1 :]:
+            end = pattern.index("]", index + 1)
+            chars = pattern[index + 1 : end]
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            regex += f"[{chars}]"
+            index = end
+        elif char == "\\" and index + 1 < len(pattern):
+            index += 1
+            regex += re.escape(pattern[index])
+        else:
+            regex += re.escape(char)
+
+        index += 1
+
+    if not anchored:
+        regex = "(?:.*/)?" + regex
+
+    return re.compile(regex + "$")
+
+
+def load_ignore(config):
+    """
+    \b
+    Load the ignore rules of a project
+    from .figaro/ignore if it exists
+
+    Arguments
+    ---------
+    config	: configuration dictionary
+
+    Returns
+    -------
+    ignore	: IgnoreRules object
+    """
+    ignore_file = os.path.join(config["folder"]["local_path"], ".figaro", "ignore")
+
+    if not os.path.isfile(ignore_file):
+        return IgnoreRules()
+
+    with open(ignore_file) as stream:
+        return IgnoreRules(stream)
+
+
+def scan_folder(local_root, folder_from_root, ignore):
+    """
+    \b
+    List one local folder with a single scandir
+    call, stat each file once and leave out
+    ignored entries
+
+    Arguments
+    ---------
+    local_root		: local path of the project
+    folder_from_root	: folder path from root of the project
+    ignore		: IgnoreRules object
+
+    Returns
+    -------
+    folders	: list of subfolder paths from root
+    files	: list of (path_from_root, local_path, stat) tuples
+    """
+    folders = []
+    files = []
+
+    with os.scandir(os.path.join(local_root, folder_from_root)) as entries:
+        for entry in entries:
+            path_from_root = os.path.join(folder_from_root, entry.name)
+
+            if not folder_from_root and entry.name == ".figaro":
+                continue
+
+            if entry.is_dir():
+                #
+                # Symbolic links to folders are not followed
+                if not entry.is_symlink() and not ignore.match(
+                    path_from_root, is_dir=True
+                ):
+                    folders.append(path_from_root)
+
+            elif not ignore.match(path_from_root):
+                try:
+                    files.append((path_from_root, entry.path, entry.stat()))
+                except FileNotFoundError:
+                    # Broken symbolic link or file removed during the scan
+                    pass
+
+    return folders, files
+
+
+@lib.profile_phase("scan")
+def scan_tree(config, folder_from_root=""):
+    """
+    \b
+    Scan a local folder breadth-first with a pool of
+    threads listing folders concurrently. Ignored
+    folders are pruned before they are listed and
+    each file is stat-ed exactly once, the stat
+    results are handed on to the rest of the sync.
+
+    Arguments
+    ---------
+    config		: configuration dictionary
+    folder_from_root	: folder path from root of the project
+
+    Returns
+    -------
+    folders	: list of subfolder paths from root
+    files	: dictionary of (local_path, stat) keyed
+                  by path from root
+    """
+    local_root = config["folder"]["local_path"]
+    num_threads = lib.max_workers(config)
+    ignore = load_ignore(config)
+
+    folders = []
+    files = {}
+    queue = collections.deque([folder_from_root])
+
+    def next_listing():
+        if not queue:
+            return None
+        folder_path = queue.popleft()
+        return folder_path, scan_folder, (local_root, folder_path, ignore)
+
+    def add_listing(folder_path, listing):
+        subfolders, subfiles = listing
+        folders.extend(subfolders)
+        queue.extend(subfolders)
+        for path_from_root, local_path, stat in subfiles:
+            files[path_from_root] = (local_path, stat)
+
+    lib.run_bounded(num_threads, next_listing, add_listing)
+
+    return folders, files
@@ -0,0 +1,126 @@
+"""Module for dependency-aware scheduling of tasks"""
+
+# Standard libraries
+import heapq
+import collections
+
+# Internal imports
+from figaro import lib
+
+
+class TaskGraph:
+    """
+    Class TaskGraph for a DAG of tasks run on a pool of threads.
+    A task starts as soon as the tasks it depends on have finished,
+    so independent branches of the graph run concurrently. Among
+    ready tasks, the one with the highest priority starts first.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.tasks = {}
+        self.dependents = collections.defaultdict(list)
+        self.num_waiting = {}
+
+    def add(self, key, function, *args, depends_on=(), priority=0):
+        """
+        \b
+        Add a task to the graph
+
+        Arguments
+        ---------
+        key		: unique hashable key of the task
+        function	: callable to run
+        args		: arguments passed to function
+        depends_on	: keys of tasks that must finish first,
+                          keys not in the graph are ignored
+        priority	: tasks with a higher priority start first
+        """
+        if key in self.tasks:
+            raise ValueError(f"Task {key!r} is already in the graph.")
+
+        self.tasks[key] = (function, args, depends_on, priority)
+
+    def urgency(self):
+        """
+        \b
+        Priority of each task raised to the highest
+        priority of the tasks that wait on it, so a
+        task that unblocks urgent work is urgent too
+
+        Returns
+        -------
+        urgency	: dictionary of priorities by key
+        """
+        urgency = {key: task[3] for key, task in self.tasks.items()}
+        num_waiting = dict(self.num_waiting)
+        stack = [key for key, count in num_waiting.items() if count == 0]
+        order = []
+
+        while stack:
+            key = stack.pop()
+            order.append(key)
+            for dependent in self.dependents[key]:
+                num_waiting[dependent] -= 1
+                if num_waiting[dependent] == 0:
+                    stack.append(dependent)
+
+        for key in reversed(order):
+            for dependent in self.dependents[key]:
+                urgency[key] = max(urgency[key], urgency[dependent])
+
+        return urgency
+
+    def run(self, num_workers, on_result=None):
+        """
+        \b
+        Run every task of the graph, the most
+        urgent ready task first
+
+        Arguments
+        ---------
+        num_workers	: number of threads
+        on_result	: callable(key, result) run in the calling
+                          thread when a task finishes, before its
+                          dependents are started
+        """
+        for key, (_, _, depends_on, _) in self.tasks.items():
+            depends_on = [dep for dep in depends_on if dep in self.tasks]
+            self.num_waiting[key] = len(depends_on)
+            for dep in depends_on:
+                self.dependents[dep].append(key)
+
+        # Ready tasks as (-urgency, order added, key)
+        urgency = self.urgency()
+        order = {key: position for position, key in enumerate(self.tasks)}
+        ready = [
+            (-urgency[key], order[key], key)
+            for key, count in self.num_waiting.items()
+            if count == 0
+        ]
+        heapq.heapify(ready)
+
+        def next_task():
+            if not ready:
+                return None
+            _, _, key = heapq.heappop(ready)
+            function, args, _, _ = self.tasks[key]
+            return key, function, args
+
+        def finish_task(key, result):
+            if on_result:
+                on_result(key, result)
+
+            for dependent in self.dependents[key]:
+                self.num_waiting[dependent] -= 1
+                if self.num_waiting[dependent] == 0:
+                    heapq.heappush(
+                        ready, (-urgency[dependent], order[dependent], dependent)
+                    )
+
+        lib.run_bounded(num_workers, next_task, finish_task)
+
+        if any(self.num_waiting.values()):
+            raise ValueError("Task graph has a dependency cycle.")
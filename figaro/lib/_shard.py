@@ -0,0 +1,379 @@
+"""Module for sharded transfers across the ranks of a batch job"""
+
+# Standard libraries
+import os
+import glob
+import heapq
+import time
+import sqlite3
+import threading
+
+# Internal imports
+from figaro import lib
+
+# Environment variables with the rank and number of ranks,
+# in the order they are looked up by --shard auto
+SHARD_ENVIRONMENT = [
+    ("OMPI_COMM_WORLD_RANK", "OMPI_COMM_WORLD_SIZE"),
+    ("PMI_RANK", "PMI_SIZE"),
+    ("SLURM_PROCID", "SLURM_NTASKS"),
+]
+
+# Bytes that the fixed cost of transferring one file is
+# worth when balancing shards, so that empty and small
+# files are spread instead of piling on one shard
+SHARD_ITEM_BYTES = 1000000
+
+# Seconds a shard waits for the write-ahead log of
+# the index to be checkpointed before copying it
+SHARD_CHECKPOINT_SECONDS = 60
+
+# Tables of the map index whose changes are merged
+SHARD_TABLES = ["files", "folders", "hashes"]
+
+# Shard of the running command as (index, count),
+# None when transfers are not sharded
+_shard = None
+
+# Delta store of the running shard
+_shard_store = None
+_shard_lock = threading.Lock()
+
+
+def shard_parse(value):
+    """
+    \b
+    Parse the value of --shard, either I/N for
+    slice I of N or auto for the rank of a SLURM
+    or MPI job
+
+    Returns
+    -------
+    index	: index of the shard from 0
+    count	: number of shards
+    """
+    if value == "auto":
+        for rank_variable, size_variable in SHARD_ENVIRONMENT:
+            if rank_variable in os.environ and size_variable in os.environ:
+                value = f"{os.environ[rank_variable]}/{os.environ[size_variable]}"
+                break
+        else:
+            raise ValueError(
+                "No rank found in the environment, "
+                + f"set one of {', '.join(rank for rank, _ in SHARD_ENVIRONMENT)}."
+            )
+
+    try:
+        index, count = [int(part) for part in value.split("/")]
+    except ValueError:
+        raise ValueError(f"Shard {value!r} is not of the form I/N or auto.")
+
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Shard {value!r} is not of the form I/N with 0 <= I < N.")
+
+    return index, count
+
+
+def shard_start(index, count):
+    """
+    \b
+    Run the command as shard index of count. A
+    single shard is the same as no sharding.
+
+    Arguments
+    ---------
+    index	: index of the shard from 0
+    count	: number of shards
+    """
+    global _shard
+    _shard = (index, count) if count > 1 else None
+
+
+def shard_current():
+    """
+    \b
+    Shard of the running command
+
+    Returns
+    -------
+    shard	: (index, count), None when not sharded
+    """
+    return _shard
+
+
+def shard_assign(items, count):
+    """
+    \b
+    Assign work items to shards, largest first,
+    each to the shard with the least work so far.
+    Every shard computes the same assignment from
+    the same plan, ties are broken by path.
+
+    Arguments
+    ---------
+    items	: list of PlanItem objects
+    count	: number of shards
+
+    Returns
+    -------
+    ranks	: shard of each item
+    """
+    ranks = [0] * len(items)
+    loads = [(0, rank) for rank in range(count)]
+
+    for position in sorted(
+        range(len(items)),
+        key=lambda position: (-items[position].size, items[position].path_from_root),
+    ):
+        load, rank = heapq.heappop(loads)
+        ranks[position] = rank
+        heapq.heappush(loads, (load + items[position].size + SHARD_ITEM_BYTES, rank))
+
+    return ranks
+
+
+def shard_plan(plan):
+    """
+    \b
+    Keep the slice of a plan that belongs to the
+    running shard. Files are balanced by size across
+    shards, and a shard keeps the folders its files
+    need. Folders no file needs are kept by shard 0.
+
+    Arguments
+    ---------
+    plan	: list of PlanItem objects
+
+    Returns
+    -------
+    plan	: list of PlanItem objects of the shard
+    """
+    if _shard is None:
+        return plan
+
+    index, count = _shard
+    folders = [item for item in plan if item.action.startswith("mkdir")]
+    work = [item for item in plan if not item.action.startswith("mkdir")]
+    ranks = shard_assign(work, count)
+
+    # Shards that need each folder, with its ancestors
+    needed = {}
+
+    def need(folder_from_root, rank):
+        while folder_from_root:
+            needed.setdefault(folder_from_root, set()).add(rank)
+            folder_from_root = os.path.dirname(folder_from_root)
+
+    for item, rank in zip(work, ranks):
+        need(os.path.dirname(item.path_from_root), rank)
+
+    for item in folders:
+        if item.path_from_root not in needed:
+            need(item.path_from_root, 0)
+
+    mine = [item for item, rank in zip(work, ranks) if rank == index]
+    total_size = sum(item.size for item in work)
+    size = sum(item.size for item in mine)
+
+    print(
+        f"Shard {index}/{count}: {len(mine)} of {len(work)} files, "
+        + f"{lib.plan_format_size(size)} of {lib.plan_format_size(total_size)}"
+    )
+
+    return [item for item in folders if index in needed[item.path_from_root]] + mine
+
+
+def shard_delta_path(config, index, count):
+    """
+    Path of the map delta written by a shard
+    """
+    return os.path.join(
+        config["folder"]["local_path"],
+        ".figaro",
+        "deltas",
+        f"shard-{index}-of-{count}.db",
+    )
+
+
+def shard_mapstore(config):
+    """
+    \b
+    Open the map store of the running shard. It starts
+    as a copy of .figaro/index.db, and triggers record
+    the paths that the shard changes, so shards never
+    write to the shared index.
+
+    Arguments
+    ---------
+    config	: configuration dictionary
+
+    Returns
+    -------
+    store	: MapStore object
+    """
+    global _shard_store
+
+    with _shard_lock:
+        if _shard_store is not None:
+            return _shard_store
+
+        db_path = os.path.join(config["folder"]["local_path"], ".figaro", "index.db")
+        delta_path = shard_delta_path(config, *_shard)
+
+        if os.path.exists(delta_path):
+            raise ValueError(
+                f"{delta_path} is from a run that was not merged, "
+                + "run figaro merge-shards first."
+            )
+
+        os.makedirs(os.path.dirname(delta_path), exist_ok=True)
+
+        if os.path.isfile(db_path):
+            #
+            # A run killed before it closed the index leaves
+            # its last commits in the write-ahead log, which
+            # the immutable copy below does not read. Shards
+            # that start together checkpoint it in turn.
+            wal_path = db_path + "-wal"
+            deadline = time.monotonic() + SHARD_CHECKPOINT_SECONDS
+
+            while os.path.isfile(wal_path) and os.stat(wal_path).st_size:
+                if time.monotonic() > deadline:
+                    raise ValueError(
+                        f"{wal_path} could not be checkpointed, "
+                        + "run a figaro command without --shard first."
+                    )
+
+                connection = sqlite3.connect(db_path, timeout=SHARD_CHECKPOINT_SECONDS)
+                try:
+                    busy = connection.execute(
+                        "PRAGMA wal_checkpoint(TRUNCATE)"
+                    ).fetchone()[0]
+                finally:
+                    connection.close()
+
+                if busy:
+                    time.sleep(0.1)
+            #
+            # The index is read without locks, it is not
+            # written while the shards of a run are going
+            source = sqlite3.connect(f"file:{db_path}?immutable=1", uri=True)
+            target = sqlite3.connect(delta_path)
+            source.backup(target)
+            target.close()
+            source.close()
+
+        store = lib.MapStore(delta_path)
+
+        with store.lock:
+            store.connection.execute(
+                "CREATE TABLE IF NOT EXISTS shard_changes "
+                + "(tbl TEXT, path TEXT, PRIMARY KEY (tbl, path)) WITHOUT ROWID"
+            )
+            for table in SHARD_TABLES:
+                for event, row in [
+                    ("INSERT", "NEW"),
+                    ("UPDATE", "NEW"),
+                    ("DELETE", "OLD"),
+                ]:
+                    store.connection.execute(
+                        f"CREATE TRIGGER shard_{table}_{event.lower()} "
+                        + f"AFTER {event} ON {table} BEGIN "
+                        + "INSERT OR IGNORE INTO shard_changes (tbl, path) "
+                        + f"VALUES ('{table}', {row}.path); END"
+                    )
+            store.connection.commit()
+
+        _shard_store = store
+        return store
+
+
+def shard_stop():
+    """
+    \b
+    Finish the delta of the running shard, leaving
+    only the rows it changed
+    """
+    global _shard, _shard_store
+
+    with _shard_lock:
+        store, _shard_store, _shard = _shard_store, None, None
+
+    if store is None:
+        return
+
+    with store.lock:
+        for table in SHARD_TABLES:
+            for event in ["insert", "update", "delete"]:
+                store.connection.execute(f"DROP TRIGGER shard_{table}_{event}")
+            store.connection.execute(
+                f"DELETE FROM {table} WHERE path NOT IN "
+                + "(SELECT path FROM shard_changes WHERE tbl = ?)",
+                (table,),
+            )
+        store.connection.commit()
+        store.connection.execute("VACUUM")
+
+    store.close()
+
+
+def shard_merge(config):
+    """
+    \b
+    Fold the map deltas written by the shards of a
+    sharded run into .figaro/index.db. Only the rows
+    each shard changed are written, so entries that
+    no shard touched are kept. Merged deltas are
+    removed.
+
+    Arguments
+    ---------
+    config	: configuration dictionary
+    """
+    store = lib.open_mapstore(config)
+    delta_paths = sorted(
+        glob.glob(shard_delta_path(config, "*", "*")),
+        key=lambda path: [
+            int(part) for part in os.path.basename(path)[6:-3].split("-of-")
+        ],
+    )
+
+    if not delta_paths:
+        print("No shard deltas to merge")
+        return
+
+    for delta_path in delta_paths:
+        store.commit()
+        store.execute("ATTACH DATABASE ? AS delta", (delta_path,))
+
+        try:
+            changes = store.execute("SELECT COUNT(*) FROM delta.shard_changes")[0][0]
+
+            for table in SHARD_TABLES:
+                columns = ", ".join(
+                    row[1] for row in store.execute(f"PRAGMA main.table_info({table})")
+                )
+                changed = "(SELECT path FROM delta.shard_changes WHERE tbl = ?)"
+                store.execute(
+                    f"INSERT OR REPLACE INTO main.{table} ({columns}) "
+                    + f"SELECT {columns} FROM delta.{table} WHERE path IN {changed}",
+                    (table,),
+                )
+                store.execute(
+                    f"DELETE FROM main.{table} WHERE path IN {changed} "
+                    + f"AND path NOT IN (SELECT path FROM delta.{table})",
+                    (table,),
+                )
+            store.commit()
+
+        finally:
+            store.commit()
+            store.execute("DETACH DATABASE delta")
+
+        for path in [delta_path, delta_path + "-wal", delta_path + "-shm"]:
+            if os.path.exists(path):
+                os.remove(path)
+
+        print(f'    - Merged "{os.path.basename(delta_path)}" with {changes} changes')
+
+    store.checkpoint()
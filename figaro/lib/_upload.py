@@ -1,52 +1,73 @@
 """Module for library"""
 
 # Standard libraries
+import io
 import os
-import math
+from stat import S_ISREG
 
 # Specialized libraries
-import dill
-import psutil
-import joblib
-import tqdm
+import boxsdk
 
 # Internal imports
 from figaro import lib
 
 
-def fileupload_from_path(client, config, filemap, foldermap, file_path):
+def fileupload_from_path(client, config, filemap, foldermap, file_path, stat=None):
     """
     Arguments
     ---------
     client	: boxsdk client object
     config	: configuration dictionary
+    filemap	: file mapping dictionary
+    foldermap	: folder mapping dictionary
     file_path	: path to file from working directory
-    """
-    client = dill.loads(client)
+    stat	: stat result of the file from a scan, if any
 
-    if not os.path.isfile(file_path):
-        raise ValueError(f"{file_path} is not a valid file.")
+    Returns
+    -------
+    message	: status message
+    filemap_update	: new file entries to merge into filemap
+    """
+    if stat is None:
+        stat = upload_stat(file_path)
 
     path_from_root = os.path.abspath(file_path).replace(
         config["folder"]["local_path"] + os.sep, ""
     )
 
-    upload_size = os.stat(file_path).st_size
+    upload_size = stat.st_size
     upload_id = None
     upload_obj = client.folder(config["folder"]["box_id"])
     upload_name = path_from_root.split(os.sep)[-1]
 
-    if path_from_root in filemap.keys():
-        upload_id = str(filemap[path_from_root])
-        upload_obj = client.file(upload_id)
+    chunked_threshold = lib.transfer_option(config, "chunked_threshold")
+    #
+    # Files sent in one request are read once, the
+    # bytes hashed for the comparison are uploaded
+    hashcache = lib.load_hashcache(config)
+    box_file = filemap.entry(path_from_root)
 
-        # Check if the file has changed before uploading
-        box_file = upload_obj.get()
-        if not lib.is_file_changed(file_path, box_file, upload=True):
-            message = f'    - File "{box_file.name}" is up to date. Skipped upload.'
-            return message
+    if box_file is not None:
+        # Check if the file has changed before uploading, using the
+        # metadata saved in the map unless it is incomplete
+        if box_file.sha1 is None or box_file.modified_at is None:
+            box_file = client.file(box_file.id).get()
+        if not lib.is_file_changed(
+            file_path,
+            box_file,
+            upload=True,
+            hashcache=hashcache,
+            stat=stat,
+        ):
+            message = f'    - File "{upload_name}" is up to date. Skipped upload.'
+            return message, {}
 
-    elif os.sep.join(path_from_root.split(os.sep)[:-1]) in foldermap.keys():
+    # Files packed in a bundle are uploaded again as new files
+    if box_file is not None and getattr(box_file, "offset", None) is None:
+        upload_id = box_file.id
+        upload_obj = client.file(upload_id)
+
+    elif os.sep.join(path_from_root.split(os.sep)[:-1]) in foldermap:
         upload_id = None
         upload_obj = client.folder(
             str(foldermap[os.sep.join(path_from_root.split(os.sep)[:-1])])
@@ -57,33 +78,104 @@ def fileupload_from_path(client, config, filemap, foldermap, file_path):
     else:
         raise ValueError(f"{path_from_root} is not found in filemap or foldermap.")
 
+    filemap_update = {}
+    data = None
+    policy = lib.compression_for_upload(
+        config, path_from_root, box_file if upload_id else None
+    )
+
+    if upload_size < chunked_threshold:
+        data, sha1 = hashcache.read_contents(file_path)
+
     if upload_id:
-        if upload_size < 20000000:
-            updated_file = upload_obj.update_contents(file_path)
-            message = f'    - File "{updated_file.name}" has been updated'
+        try:
+            # etag guards against overwriting a version
+            # uploaded since the map was written
+            etag = getattr(box_file, "etag", None)
+            if policy is not None:
+                uploaded_file, entry = lib.compressed_upload(
+                    config,
+                    upload_obj,
+                    file_path,
+                    stat,
+                    policy,
+                    etag=etag,
+                    contents=data,
+                )
+            elif upload_size < chunked_threshold:
+                uploaded_file = upload_obj.update_contents_with_stream(
+                    io.BytesIO(data), etag=etag, sha1=sha1
+                )
+                entry = lib.boxmap_entry(uploaded_file)
+            else:
+                # uploads new large file version
+                uploaded_file = lib.chunked_upload(
+                    config, upload_obj, file_path, etag=etag
+                )
+                entry = lib.boxmap_entry(uploaded_file)
+        except boxsdk.BoxAPIException as exc:
+            if exc.status != 412:
+                raise
+            message = f'    - File "{upload_name}" changed on Box since it was mapped. Skipped upload.'
+            return message, {}
 
-        else:
-            # uploads new large file version
-            chunked_uploader = upload_obj.get_chunked_uploader(file_path)
-            uploaded_file = chunked_uploader.start()
-            message = f'    - File "{uploaded_file.name}" has been updated'
+        message = f'    - File "{uploaded_file.name}" has been updated'
+        filemap_update = {path_from_root: entry}
 
     else:
-        if upload_size < 20000000:
-            new_file = upload_obj.upload(file_path)
-            message = f'    - File "{new_file.name}" uploaded to Box with file ID {new_file.id}'
-            filemap[path_from_root] = new_file.id
+        if policy is not None:
+            uploaded_file, entry = lib.compressed_upload(
+                config,
+                upload_obj,
+                file_path,
+                stat,
+                policy,
+                file_name=upload_name,
+                contents=data,
+            )
+
+        elif upload_size < chunked_threshold:
+            uploaded_file = upload_obj.upload_stream(
+                io.BytesIO(data), upload_name, sha1=sha1
+            )
+            entry = lib.boxmap_entry(uploaded_file)
 
         else:
             # uploads large file to a root folder
-            chunked_uploader = upload_obj.get_chunked_uploader(
-                file_path=file_path, file_name=upload_name
+            uploaded_file = lib.chunked_upload(
+                config, upload_obj, file_path, file_name=upload_name
             )
-            uploaded_file = chunked_uploader.start()
-            message = f'    - File "{uploaded_file.name}" uploaded to Box with file ID {uploaded_file.id}'
-            filemap[path_from_root] = uploaded_file.id
+            entry = lib.boxmap_entry(uploaded_file)
 
-    return message
+        message = f'    - File "{uploaded_file.name}" uploaded to Box with file ID {uploaded_file.id}'
+        filemap_update = {path_from_root: entry}
+
+    return message, filemap_update
+
+
+def upload_stat(file_path):
+    """
+    \b
+    Stat a file to upload with a single
+    system call
+
+    Arguments
+    ---------
+    file_path	: path to file from working directory
+
+    Returns
+    -------
+    stat	: stat result of the file
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        stat = None
+
+    if stat is None or not S_ISREG(stat.st_mode):
+        raise ValueError(f"{file_path} is not a valid file.")
+
+    return stat
 
 
 def fileupload_from_list(client, config, filemap, foldermap, filelist):
@@ -92,36 +184,78 @@ def fileupload_from_list(client, config, filemap, foldermap, filelist):
     ---------
     client	: boxsdk client object
     config	: configuration dictionary
+    filemap	: file mapping dictionary
+    foldermap	: folder mapping dictionary
     filelist	: list of file paths to upload
     """
-    cpu_avail = max(
-        1,
-        psutil.cpu_count()
-        - math.floor(psutil.cpu_percent() * psutil.cpu_count() / 100),
-    )
+    plan = []
 
-    num_procs = min(cpu_avail, len(filelist))
+    for file_path in filelist:
+        stat = upload_stat(file_path)
 
-    if num_procs in [0, 1]:
-        messages = [
-            fileupload_from_path(
-                dill.dumps(client), config, filemap, foldermap, file_path
-            )
-            for file_path in tqdm.tqdm(filelist, position=0)
-        ]
-    else:
-        with joblib.parallel_backend(n_jobs=num_procs, backend="loky"):
-            messages = joblib.Parallel(batch_size="auto")(
-                joblib.delayed(fileupload_from_path)(
-                    dill.dumps(client), config, filemap, foldermap, file_path
-                )
-                for file_path in tqdm.tqdm(filelist, position=0)
-            )
+        path_from_root = os.path.abspath(file_path).replace(
+            config["folder"]["local_path"] + os.sep, ""
+        )
+        plan.append(
+            lib.PlanItem("upload", path_from_root, file_path, stat.st_size, "", stat)
+        )
+
+    plan = lib.plan_bundles(config, filemap, lib.shard_plan(plan))
+    messages = lib.execute_plan(client, config, filemap, foldermap, plan)
 
     lib.write_boxmap(config, filemap, foldermap)
     [print(f"{message}") for message in messages]
 
 
+def folderupload_create(client, config, filemap, foldermap, item):
+    """
+    \b
+    Create the Box folder for a plan item
+    inside its parent and save its id
+
+    Arguments
+    ---------
+    client	: boxsdk client object
+    config	: configuration dictionary
+    filemap	: file mapping dictionary
+    foldermap	: folder mapping dictionary
+    item	: PlanItem of the folder
+
+    Returns
+    -------
+    message	: status message
+    """
+    parent_relative_path = os.sep.join(item.path_from_root.split(os.sep)[:-1])
+
+    if not parent_relative_path:
+        parent_folder = client.folder(config["folder"]["box_id"])
+    elif parent_relative_path in foldermap:
+        parent_folder = client.folder(foldermap[parent_relative_path])
+    else:
+        raise ValueError(f"{parent_relative_path} not found in foldermap.")
+
+    # Create the new folder in Box
+    folder_name = os.path.basename(item.path_from_root)
+
+    try:
+        folder_id = parent_folder.create_subfolder(folder_name).id
+    except boxsdk.BoxAPIException as exc:
+        #
+        # Shards of a sharded run create the folders they
+        # share concurrently, use the one that was created
+        conflicts = (exc.context_info or {}).get("conflicts") or {}
+        if isinstance(conflicts, list):
+            conflicts = conflicts[0] if conflicts else {}
+        if exc.status != 409 or conflicts.get("type") != "folder":
+            raise
+        folder_id = conflicts["id"]
+
+    foldermap[item.path_from_root] = folder_id
+    lib.write_boxmap(config, filemap, foldermap)
+
+    return f'Created folder "{folder_name}" in Box with folder ID {folder_id}'
+
+
 def folderupload_recursive(client, config, filemap, foldermap, folder_path):
     """
     Recursively uploads a folder and its contents to Box.
@@ -134,41 +268,12 @@ def folderupload_recursive(client, config, filemap, foldermap, folder_path):
     foldermap   : folder mapping dictionary
     folder_path : local path to the folder that needs to be uploaded
     """
-    # Traverse the folder structure recursively
-    for root, dirs, files in os.walk(folder_path):
-        # Calculate the path relative to the root directory
-        relative_path = os.path.abspath(root).replace(
-            config["folder"]["local_path"] + os.sep, ""
-        )
+    print(f'Uploading local folder "{folder_path}"')
 
-        print(f'Uploading local folder "{relative_path}"')
-
-        # Check if the folder exists in the foldermap
-        if relative_path in foldermap.keys():
-            folder_id = foldermap[relative_path]
-            box_folder = client.folder(folder_id)
-        else:
-            # Create the folder in Box if it doesn't exist
-            parent_relative_path = os.sep.join(relative_path.split(os.sep)[:-1])
-            if parent_relative_path in foldermap.keys():
-                parent_folder_id = foldermap[parent_relative_path]
-                parent_folder = client.folder(parent_folder_id)
-            else:
-                parent_folder = client.folder(config["folder"]["box_id"])
+    plan = lib.plan_sync(
+        client, config, filemap, foldermap, folder_path, upload=True, download=False
+    )
+    messages = lib.execute_plan(client, config, filemap, foldermap, plan)
 
-            # Create the new folder in Box
-            new_folder = parent_folder.create_subfolder(os.path.basename(root))
-            print(
-                f'Created folder "{new_folder.name}" in Box with folder ID {new_folder.id}'
-            )
-            foldermap[relative_path] = new_folder.id
-            box_folder = new_folder
-
-        # Upload each file in the current folder
-        fileupload_from_list(
-            client,
-            config,
-            filemap,
-            foldermap,
-            [os.path.join(root, sfile) for sfile in files],
-        )
+    lib.write_boxmap(config, filemap, foldermap)
+    [print(f"{message}") for message in messages]
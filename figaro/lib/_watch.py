@@ -0,0 +1,523 @@
+"""Module for watching local folders for changes"""
+
+# Standard libraries
+import os
+import time
+import errno
+import ctypes
+import select
+import struct
+from stat import S_ISDIR, S_ISREG
+
+# Internal imports
+from figaro import lib
+
+# inotify event masks from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+# Events watched on every folder, files count as changed once
+# they are closed after writing or moved in, new folders once
+# they are created or moved in
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+
+# wd, mask, cookie and len of struct inotify_event
+INOTIFY_EVENT = struct.Struct("iIII")
+
+# Filesystems where inotify does not see changes
+# made on other nodes, these are polled instead
+REMOTE_FILESYSTEMS = [
+    "nfs",
+    "nfs4",
+    "cifs",
+    "smb3",
+    "lustre",
+    "gpfs",
+    "beegfs",
+    "panfs",
+    "ceph",
+    "fuse.sshfs",
+    "9p",
+]
+
+
+class InotifyWatcher:
+    """
+    Class InotifyWatcher for changes under a local folder reported
+    by inotify, called through ctypes. Every folder of the tree has
+    a watch, folders created or moved in are watched and listed as
+    they appear. When the kernel queue overflows the tree is listed
+    again and every file is reported.
+    """
+
+    name = "inotify"
+
+    def __init__(self, config, folder_from_root=""):
+        """
+        Constructor
+        """
+        self.config = config
+        self.folder_from_root = folder_from_root
+        self.local_root = config["folder"]["local_path"]
+        self.ignore = lib.load_ignore(config)
+        self.paths = {}
+
+        try:
+            self.libc = ctypes.CDLL(None, use_errno=True)
+            self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except AttributeError:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+        try:
+            self.add_tree(folder_from_root)
+        except OSError:
+            self.close()
+            raise
+
+    def add_watch(self, folder_from_root):
+        """
+        Watch one folder
+        """
+        local_path = os.path.join(self.local_root, folder_from_root)
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(local_path), INOTIFY_MASK)
+
+        if wd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code), local_path)
+
+        # A folder moved inside the tree keeps its
+        # watch, which is mapped to the new path
+        self.paths[wd] = folder_from_root
+
+    def add_tree(self, folder_from_root):
+        """
+        \b
+        Watch a folder and its subfolders
+
+        Returns
+        -------
+        folders	: list of folder paths from root
+        """
+        folders = [folder_from_root] + lib.scan_tree(self.config, folder_from_root)[0]
+
+        for path_from_root in folders:
+            self.add_watch(path_from_root)
+
+        return folders
+
+    def add_new_tree(self, folder_from_root, changes):
+        """
+        \b
+        Watch a folder that appeared and report its
+        contents. Files are listed after the watches
+        are in place, so none written in between are
+        missed.
+        """
+        try:
+            changes.update(self.add_tree(folder_from_root))
+            changes.update(lib.scan_tree(self.config, folder_from_root)[1])
+        except FileNotFoundError:
+            pass
+        except OSError as error:
+            print(f'    - Folder "{folder_from_root}" is not watched: {error.strerror}')
+
+    def parse(self, data):
+        """
+        \b
+        Turn a buffer of inotify events into paths
+        from root that changed
+
+        Returns
+        -------
+        changes	: set of paths from root
+        """
+        changes = set()
+        offset = 0
+
+        while offset < len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            start = offset + INOTIFY_EVENT.size
+            name = os.fsdecode(data[start : start + length].rstrip(b"\0"))
+            offset = start + length
+
+            if mask & IN_Q_OVERFLOW:
+                self.add_new_tree(self.folder_from_root, changes)
+                continue
+
+            if mask & IN_IGNORED:
+                self.paths.pop(wd, None)
+                continue
+
+            folder_from_root = self.paths.get(wd)
+
+            if folder_from_root is None or not name:
+                continue
+
+            if not folder_from_root and name == ".figaro":
+                continue
+
+            path_from_root = os.path.join(folder_from_root, name)
+
+            if mask & IN_ISDIR:
+                if not self.ignore.ignores(path_from_root, is_dir=True):
+                    self.add_new_tree(path_from_root, changes)
+
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                changes.add(path_from_root)
+
+        return changes
+
+    def read(self, timeout=None):
+        """
+        \b
+        Wait for changes
+
+        Arguments
+        ---------
+        timeout	: seconds to wait, None waits until
+                  something changes
+
+        Returns
+        -------
+        changes	: set of paths from root, empty
+                  if the timeout expired
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        changes = set()
+
+        while not changes:
+            wait = None if deadline is None else deadline - time.monotonic()
+            if wait is not None and wait <= 0:
+                break
+
+            if not select.select([self.fd], [], [], wait)[0]:
+                break
+
+            try:
+                changes.update(self.parse(os.read(self.fd, 65536)))
+            except BlockingIOError:
+                pass
+
+        return changes
+
+    def close(self):
+        """
+        Release the inotify instance
+        """
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    Class PollingWatcher for changes under a local folder found by
+    listing the tree every poll_interval seconds and comparing the
+    inode, size and modification time of each file with the last
+    listing. Used where inotify is not available or does not see
+    changes made by other nodes.
+    """
+
+    name = "polling"
+
+    def __init__(self, config, folder_from_root=""):
+        """
+        Constructor
+        """
+        self.config = config
+        self.folder_from_root = folder_from_root
+        self.interval = lib.watch_option(config, "poll_interval")
+        self.snapshot = self.scan()
+        self.next_poll = time.monotonic() + self.interval
+
+    def scan(self):
+        """
+        List the tree into a snapshot
+        """
+        folders, files = lib.scan_tree(self.config, self.folder_from_root)
+        snapshot = dict.fromkeys(folders, ())
+
+        for path_from_root, (_, stat) in files.items():
+            snapshot[path_from_root] = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+        return snapshot
+
+    def read(self, timeout=None):
+        """
+        \b
+        Wait for changes
+
+        Arguments
+        ---------
+        timeout	: seconds to wait, None waits until
+                  something changes
+
+        Returns
+        -------
+        changes	: set of paths from root, empty
+                  if the timeout expired
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            if deadline is not None and deadline < self.next_poll:
+                time.sleep(max(deadline - time.monotonic(), 0))
+                return set()
+
+            time.sleep(max(self.next_poll - time.monotonic(), 0))
+            self.next_poll = time.monotonic() + self.interval
+
+            snapshot = self.scan()
+            changes = {
+                path_from_root
+                for path_from_root, key in snapshot.items()
+                if self.snapshot.get(path_from_root) != key
+            }
+            self.snapshot = snapshot
+
+            if changes:
+                return changes
+
+    def close(self):
+        """
+        Nothing to release
+        """
+
+
+def watch_filesystem(local_path):
+    """
+    \b
+    Find the type of the filesystem a path is
+    on from /proc/self/mounts
+
+    Returns
+    -------
+    fstype	: filesystem type, None if unknown
+    """
+    local_path = os.path.realpath(local_path)
+    fstype, mount_length = None, -1
+
+    try:
+        with open("/proc/self/mounts") as stream:
+            mounts = [line.split() for line in stream]
+    except OSError:
+        return None
+
+    for fields in mounts:
+        if len(fields) < 3:
+            continue
+        #
+        # Spaces and tabs in mount points are octal escapes
+        mount_point = fields[1].encode().decode("unicode_escape")
+        if (
+            local_path == mount_point
+            or local_path.startswith(mount_point.rstrip(os.sep) + os.sep)
+        ) and len(mount_point) > mount_length:
+            fstype, mount_length = fields[2], len(mount_point)
+
+    return fstype
+
+
+def watch_open(config, folder_from_root="", poll=False):
+    """
+    \b
+    Start watching a folder with inotify, or by
+    polling when asked to, when the folder is on
+    a remote filesystem, or when inotify fails
+
+    Arguments
+    ---------
+    config		: configuration dictionary
+    folder_from_root	: folder path from root of the project
+    poll		: always poll
+
+    Returns
+    -------
+    watcher	: InotifyWatcher or PollingWatcher object
+    """
+    local_path = os.path.join(config["folder"]["local_path"], folder_from_root)
+    fstype = watch_filesystem(local_path)
+
+    if not poll and fstype not in REMOTE_FILESYSTEMS:
+        try:
+            return InotifyWatcher(config, folder_from_root)
+        except OSError as error:
+            print(f"    - Cannot use inotify: {error.strerror}")
+
+    return PollingWatcher(config, folder_from_root)
+
+
+def watch_batches(watcher, debounce, max_delay):
+    """
+    \b
+    Coalesce changes into batches. A batch closes
+    once nothing changed for debounce seconds, or
+    max_delay seconds after its first change so
+    files that change constantly are still sent.
+
+    Arguments
+    ---------
+    watcher	: InotifyWatcher or PollingWatcher object
+    debounce	: seconds without changes that close a batch
+    max_delay	: longest seconds a batch stays open
+
+    Yields
+    ------
+    batch	: set of paths from root
+    """
+    batch = set()
+    deadline = None
+
+    while True:
+        if not batch:
+            batch = watcher.read()
+            deadline = time.monotonic() + max_delay
+            continue
+
+        wait = min(debounce, deadline - time.monotonic())
+        changes = watcher.read(wait) if wait > 0 else set()
+
+        if changes:
+            batch.update(changes)
+        else:
+            yield batch
+            batch = set()
+
+
+def plan_watch(config, filemap, foldermap, paths):
+    """
+    \b
+    Plan the uploads for a batch of changed paths.
+    Paths that no longer exist or are ignored are
+    left out, and Box folders missing for the rest
+    are created first.
+
+    Arguments
+    ---------
+    config	: configuration dictionary
+    filemap	: file map index
+    foldermap	: folder map index
+    paths	: paths from root that changed
+
+    Returns
+    -------
+    plan	: list of PlanItem objects, folders first
+    """
+    local_root = config["folder"]["local_path"]
+    ignore = lib.load_ignore(config)
+
+    folders = set()
+    files = []
+
+    for path_from_root in sorted(paths):
+        local_path = os.path.join(local_root, path_from_root)
+
+        try:
+            stat = os.stat(local_path)
+        except OSError:
+            continue
+
+        if S_ISDIR(stat.st_mode):
+            folder_from_root = path_from_root
+        elif S_ISREG(stat.st_mode):
+            folder_from_root = os.path.dirname(path_from_root)
+        else:
+            continue
+
+        if ignore.ignores(path_from_root, is_dir=S_ISDIR(stat.st_mode)):
+            continue
+
+        if S_ISREG(stat.st_mode):
+            files.append(
+                lib.PlanItem(
+                    "upload",
+                    path_from_root,
+                    local_path,
+                    stat.st_size,
+                    "changed locally",
+                    stat,
+                )
+            )
+
+        while folder_from_root and folder_from_root not in foldermap:
+            folders.add(folder_from_root)
+            folder_from_root = os.path.dirname(folder_from_root)
+
+    plan = [
+        lib.PlanItem(
+            "mkdir-remote",
+            path_from_root,
+            os.path.join(local_root, path_from_root),
+            0,
+            "not on Box",
+        )
+        for path_from_root in sorted(folders)
+    ]
+
+    return plan + lib.plan_bundles(config, filemap, files)
+
+
+def watch_folder(client, config, filemap, foldermap, folder_path, poll=False):
+    """
+    \b
+    Upload a folder, then keep uploading the files that
+    change in it until interrupted. The map and client
+    stay in memory, and each batch of changes goes
+    through the same plan and upload steps as
+    upload-folder. Paths of a batch that failed are
+    retried with the next batch.
+
+    Arguments
+    ---------
+    client	: boxsdk client object
+    config	: configuration dictionary
+    filemap	: file map index
+    foldermap	: folder map index
+    folder_path	: local folder to watch
+    poll	: poll instead of using inotify
+    """
+    local_root = config["folder"]["local_path"]
+    folder_from_root = os.path.relpath(os.path.abspath(folder_path), local_root)
+    folder_from_root = "" if folder_from_root == os.curdir else folder_from_root
+
+    if folder_from_root.split(os.sep)[0] == os.pardir:
+        raise ValueError(f"{folder_path} is not inside {local_root}.")
+
+    debounce = lib.watch_option(config, "debounce")
+    max_delay = lib.watch_option(config, "max_delay")
+    #
+    # Watch before the first upload so that no
+    # change made while it runs is missed
+    watcher = watch_open(config, folder_from_root, poll)
+    failed = set()
+
+    try:
+        lib.folderupload_recursive(client, config, filemap, foldermap, folder_path)
+        print(f'Watching local folder "{folder_path}" with {watcher.name}')
+
+        for batch in watch_batches(watcher, debounce, max_delay):
+            batch |= failed
+            plan = plan_watch(config, filemap, foldermap, batch)
+
+            try:
+                messages = lib.execute_plan(client, config, filemap, foldermap, plan)
+            except Exception as error:
+                failed = batch
+                print(f"    - Upload of {len(batch)} changed paths failed: {error}")
+                continue
+
+            failed = set()
+            lib.write_boxmap(config, filemap, foldermap)
+            [print(f"{message}") for message in messages]
+
+    except KeyboardInterrupt:
+        print(f'Stopped watching local folder "{folder_path}"')
+
+    finally:
+        watcher.close()
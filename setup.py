@@ -23,7 +23,10 @@ with open("figaro/__meta__.py", mode="r") as source:
     }
 
 # core dependancies
-DEPENDENCIES = ["click", "toml", "boxsdk", "joblib", "tqdm", "dill", "pyyaml"]
+DEPENDENCIES = ["click", "toml", "boxsdk", "tqdm", "pyyaml"]
+
+# optional dependancies
+EXTRAS = {"zstd": ["zstandard"]}
 
 setup(
     name=metadata["__pkgname__"],
@@ -43,4 +46,5 @@ setup(
         "License :: OSI Approved :: Apache Software License",
     ],
     install_requires=DEPENDENCIES,
+    extras_require=EXTRAS,
 )
@@ -0,0 +1,67 @@
+"""Tests for the compression policy"""
+
+# Standard libraries
+import os
+
+# Specialized libraries
+import pytest
+
+# Internal imports
+from figaro import lib
+
+
+def policy(patterns, path_from_root):
+    return lib.compression_policy(
+        {"compression": patterns}, path_from_root.replace("/", os.sep)
+    )
+
+
+def test_no_section():
+    assert lib.compression_policy({}, "run.log") is None
+
+
+@pytest.mark.parametrize(
+    "path_from_root",
+    ["checkpoints/x.dat", "checkpoints/step1/x.dat", "a/checkpoints/x"],
+)
+def test_folder_pattern_matches_files_below(path_from_root):
+    assert policy({"checkpoints/": "gzip:9"}, path_from_root) == ("gzip", 9)
+
+
+@pytest.mark.parametrize(
+    "path_from_root", ["checkpoints", "other/x.dat", "checkpointsx/y"]
+)
+def test_folder_pattern_needs_a_parent_folder(path_from_root):
+    assert policy({"checkpoints/": "gzip"}, path_from_root) is None
+
+
+def test_anchored_folder_pattern():
+    patterns = {"/runs/checkpoints/": "gzip"}
+    assert policy(patterns, "runs/checkpoints/x.dat") == ("gzip", 6)
+    assert policy(patterns, "old/runs/checkpoints/x.dat") is None
+
+
+def test_file_pattern_matches_file_and_folders():
+    patterns = {"*.log": "gzip:1"}
+    assert policy(patterns, "run.log") == ("gzip", 1)
+    assert policy(patterns, "a/b/run.log") == ("gzip", 1)
+    assert policy(patterns, "old.log/x.dat") == ("gzip", 1)
+    assert policy(patterns, "run.log.txt") is None
+
+
+def test_double_star_pattern():
+    patterns = {"data/**/*.h5": "gzip"}
+    assert policy(patterns, "data/x.h5") == ("gzip", 6)
+    assert policy(patterns, "data/a/b/x.h5") == ("gzip", 6)
+    assert policy(patterns, "other/data/x.h5") is None
+
+
+def test_first_matching_pattern_wins():
+    patterns = {"*.log": "gzip", "logs/": "gzip:9"}
+    assert policy(patterns, "logs/run.log") == ("gzip", 6)
+    assert policy(patterns, "logs/run.txt") == ("gzip", 9)
+
+
+def test_unknown_encoding():
+    with pytest.raises(ValueError):
+        policy({"*.log": "lzma"}, "run.log")
@@ -0,0 +1,147 @@
+"""Tests for the adaptive request limit"""
+
+# Standard libraries
+import importlib
+import threading
+
+# Specialized libraries
+import pytest
+
+# Internal imports
+from figaro import lib
+
+_concurrency = importlib.import_module("figaro.lib._concurrency")
+
+
+class Clock:
+    """
+    Clock advanced by hand in place of time.monotonic
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(_concurrency.time, "monotonic", clock)
+    return clock
+
+
+def complete(controller, clock, count, seconds, status=200, retry_after=None):
+    """
+    Run count requests one after the other, each taking seconds
+    """
+    for _ in range(count):
+        controller.acquire()
+        clock.now += seconds
+        controller.release(status, seconds, retry_after)
+
+
+@pytest.mark.parametrize("floor, cap", [(0, 4), (4, 2)])
+def test_invalid_bounds(floor, cap):
+    with pytest.raises(ValueError):
+        lib.ConcurrencyController(floor=floor, cap=cap)
+
+
+def test_initial_limit_is_clamped():
+    assert lib.ConcurrencyController(floor=2, cap=8, initial=20).limit == 8
+    assert lib.ConcurrencyController(floor=2, cap=8, initial=1).limit == 2
+
+
+def test_limit_grows_while_throughput_holds(clock):
+    controller = lib.ConcurrencyController(floor=1, cap=6, initial=2)
+
+    complete(controller, clock, 2, 0.1)
+    assert controller.limit == 3
+    complete(controller, clock, 3, 0.1)
+    assert controller.limit == 4
+    complete(controller, clock, 100, 0.1)
+    assert controller.limit == 6
+
+
+def test_limit_shrinks_when_throughput_drops(clock):
+    controller = lib.ConcurrencyController(floor=1, cap=16, initial=4)
+
+    complete(controller, clock, 4, 0.1)
+    assert controller.limit == 5
+    complete(controller, clock, 5, 0.5)
+    assert controller.limit == 4
+
+
+def test_errors_halve_the_limit_once_per_round_trip(clock):
+    controller = lib.ConcurrencyController(floor=1, cap=16, initial=8)
+    complete(controller, clock, 1, 0.2)
+
+    complete(controller, clock, 1, 0.0, status=429)
+    complete(controller, clock, 1, 0.0, status=503)
+    assert controller.limit == 4
+
+    clock.now += 1.0
+    complete(controller, clock, 1, 0.0, status=503)
+    assert controller.limit == 2
+
+    clock.now += 1.0
+    complete(controller, clock, 1, 0.0, status=429)
+    clock.now += 1.0
+    complete(controller, clock, 1, 0.0, status=429)
+    assert controller.limit == 1
+
+
+def test_network_errors_count_as_congestion(clock):
+    controller = lib.ConcurrencyController(floor=1, cap=16, initial=8)
+    complete(controller, clock, 1, 0.1, status=599)
+    assert controller.limit == 4
+
+
+def test_retry_after_pauses_new_requests(clock):
+    controller = lib.ConcurrencyController(floor=1, cap=4, initial=4)
+    complete(controller, clock, 1, 0.1, status=429, retry_after=30)
+
+    assert controller.paused_until == clock.now + 30
+
+
+def test_acquire_waits_for_a_free_slot():
+    controller = lib.ConcurrencyController(floor=1, cap=1, initial=1)
+    controller.acquire()
+    acquired = threading.Event()
+
+    thread = threading.Thread(target=lambda: (controller.acquire(), acquired.set()))
+    thread.start()
+    assert not acquired.wait(0.1)
+
+    controller.release(200, 0.1)
+    assert acquired.wait(5)
+    thread.join()
+    assert controller.inflight == 1
+
+
+def test_max_workers_and_load_controller():
+    config = {"concurrency": {"floor": 2, "cap": 5, "initial": 3}}
+
+    assert lib.max_workers({}) == _concurrency.DEFAULT_CAP
+    assert lib.max_workers(config) == 5
+
+    controller = lib.load_controller(config)
+    assert (controller.floor, controller.cap, controller.limit) == (2, 5, 3)
+
+
+def test_network_stream_releases_after_the_body():
+    class Raw:
+        status = 200
+
+        def stream(self, amount=None, decode_content=None):
+            yield b"ab"
+            yield b"cd"
+
+    calls = []
+    stream = lib.NetworkStream(Raw(), lambda: calls.append(1))
+    chunks = stream.stream(decode_content=True)
+
+    assert next(chunks) == b"ab" and calls == []
+    assert list(chunks) == [b"cd"] and calls == [1]
+    assert stream.status == 200
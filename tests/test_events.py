@@ -0,0 +1,235 @@
+"""Tests for applying Box events to the map"""
+
+# Standard libraries
+import os
+from types import SimpleNamespace
+
+# Specialized libraries
+import pytest
+
+# Internal imports
+from figaro import lib
+
+ROOT_ID = "0"
+
+
+@pytest.fixture
+def maps(tmp_path):
+    """
+    Empty file and folder map indexes of a project
+    """
+    store = lib.MapStore(str(tmp_path / "index.db"))
+    yield lib.MapIndex(store, "files", lib.BoxEntry), lib.MapIndex(
+        store, "folders", lib.FolderEntry
+    )
+    store.close()
+
+
+class Client:
+    """
+    Client listing folders from a dictionary of items by folder id
+    """
+
+    def __init__(self, listings=None):
+        self.listings = listings or {}
+
+    def folder(self, folder_id):
+        return SimpleNamespace(
+            get_items=lambda **kwargs: self.listings.get(folder_id, [])
+        )
+
+
+CONFIG = {"folder": {"box_id": ROOT_ID, "local_path": ""}}
+
+
+def path(value):
+    return value.replace("/", os.sep)
+
+
+def source(object_type, object_id, folder, name, sha1=None):
+    """
+    Event source for an item under folders given as (id, name) pairs
+    """
+    entries = [
+        SimpleNamespace(object_id=item_id, name=item_name)
+        for item_id, item_name in [("00", "All Files"), (ROOT_ID, "project")] + folder
+    ]
+    return SimpleNamespace(
+        object_type=object_type,
+        type=object_type,
+        object_id=object_id,
+        name=name,
+        sha1=sha1,
+        size=1,
+        path_collection={"entries": entries},
+    )
+
+
+def event(event_type, item, event_id=None):
+    return SimpleNamespace(event_type=event_type, source=item, event_id=event_id)
+
+
+def test_upload_and_modify(maps):
+    filemap, foldermap = maps
+    foldermap[path("a")] = "1"
+
+    changes = lib.events_apply(
+        Client(),
+        CONFIG,
+        filemap,
+        foldermap,
+        [
+            event("ITEM_UPLOAD", source("file", "10", [("1", "a")], "x", "s1")),
+            event("ITEM_MODIFY", source("file", "10", [("1", "a")], "x", "s2")),
+        ],
+    )
+
+    assert changes == 1
+    assert filemap.entry(path("a/x")).sha1 == "s2"
+
+
+def test_rename_file(maps):
+    filemap, foldermap = maps
+    foldermap[path("a")] = "1"
+    filemap[path("a/x")] = lib.BoxEntry("10", "s1", 1, None, None)
+
+    lib.events_apply(
+        Client(),
+        CONFIG,
+        filemap,
+        foldermap,
+        [event("ITEM_RENAME", source("file", "10", [("1", "a")], "y", "s1"))],
+    )
+
+    assert list(filemap) == [path("a/y")]
+
+
+def test_trash_file(maps):
+    filemap, foldermap = maps
+    filemap["x"] = lib.BoxEntry("10", "s1", 1, None, None)
+
+    lib.events_apply(
+        Client(),
+        CONFIG,
+        filemap,
+        foldermap,
+        [event("ITEM_TRASH", source("file", "10", [], "x"))],
+    )
+
+    assert "x" not in filemap
+
+
+def test_move_folder_moves_contents(maps):
+    filemap, foldermap = maps
+    foldermap.update({path("a"): "1", path("a/b"): "2", path("c"): "3"})
+    filemap[path("a/b/x")] = lib.BoxEntry("10", "s1", 1, None, None)
+
+    lib.events_apply(
+        Client(),
+        CONFIG,
+        filemap,
+        foldermap,
+        [event("ITEM_MOVE", source("folder", "1", [("3", "c")], "a"))],
+    )
+
+    assert sorted(foldermap) == sorted([path("c"), path("c/a"), path("c/a/b")])
+    assert list(filemap) == [path("c/a/b/x")]
+
+
+def test_move_out_of_project_removes_contents(maps):
+    filemap, foldermap = maps
+    foldermap.update({path("a"): "1", path("a/b"): "2"})
+    filemap[path("a/b/x")] = lib.BoxEntry("10", "s1", 1, None, None)
+    outside = source("folder", "1", [], "a")
+    outside.path_collection["entries"] = outside.path_collection["entries"][:1]
+
+    lib.events_apply(
+        Client(), CONFIG, filemap, foldermap, [event("ITEM_MOVE", outside)]
+    )
+
+    assert len(foldermap) == 0
+    assert len(filemap) == 0
+
+
+def test_new_folder_is_listed(maps):
+    filemap, foldermap = maps
+    listed = source("file", "10", [("1", "a")], "x", "s1")
+
+    lib.events_apply(
+        Client({"1": [listed]}),
+        CONFIG,
+        filemap,
+        foldermap,
+        [event("ITEM_CREATE", source("folder", "1", [], "a"))],
+    )
+
+    assert path("a") in foldermap
+    assert filemap.entry(path("a/x")).sha1 == "s1"
+
+
+def test_only_last_event_is_applied(maps):
+    filemap, foldermap = maps
+
+    lib.events_apply(
+        Client(),
+        CONFIG,
+        filemap,
+        foldermap,
+        [
+            event("ITEM_UPLOAD", source("file", "10", [], "x", "s1")),
+            event("ITEM_TRASH", source("file", "10", [], "x")),
+        ],
+    )
+
+    assert len(filemap) == 0
+
+
+def test_ignored_events(maps):
+    filemap, foldermap = maps
+    no_path = source("file", "11", [], "y")
+    no_path.path_collection = None
+
+    changes = lib.events_apply(
+        Client(),
+        CONFIG,
+        filemap,
+        foldermap,
+        [
+            event("ITEM_PREVIEW", source("file", "10", [], "x")),
+            event("ITEM_UPLOAD", no_path),
+            event("ITEM_RENAME", source("folder", ROOT_ID, [], "project")),
+            event("ITEM_UPLOAD", source("web_link", "12", [], "z")),
+        ],
+    )
+
+    assert changes == 0
+    assert len(filemap) == 0 and len(foldermap) == 0
+
+
+def test_file_in_unmapped_folder_is_left_out(maps):
+    filemap, foldermap = maps
+
+    lib.events_apply(
+        Client(),
+        CONFIG,
+        filemap,
+        foldermap,
+        [event("ITEM_UPLOAD", source("file", "10", [("1", "gone")], "x", "s1"))],
+    )
+
+    assert len(filemap) == 0
+
+
+def test_bundles_are_left_out(maps):
+    filemap, foldermap = maps
+    name = lib.BUNDLE_PREFIX + "1.tar"
+
+    lib.events_apply(
+        Client(),
+        CONFIG,
+        filemap,
+        foldermap,
+        [event("ITEM_UPLOAD", source("file", "10", [], name))],
+    )
+
+    assert len(filemap) == 0
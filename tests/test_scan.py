@@ -0,0 +1,127 @@
+"""Tests for the gitignore-style pattern rules"""
+
+# Standard libraries
+import os
+
+# Specialized libraries
+import pytest
+
+# Internal imports
+from figaro import lib
+
+
+def ignores(lines, path, is_dir=False):
+    return lib.IgnoreRules(lines).ignores(path.replace("/", os.sep), is_dir=is_dir)
+
+
+@pytest.mark.parametrize(
+    "pattern, path, matched",
+    [
+        ("*.log", "run.log", True),
+        ("*.log", "a/b/run.log", True),
+        ("*.log", "run.logs", False),
+        ("*.log", "a/run.log.txt", False),
+        ("data", "data", True),
+        ("data", "a/data", True),
+        ("data", "database", False),
+        ("/data", "data", True),
+        ("/data", "a/data", False),
+        ("a/*.txt", "a/x.txt", True),
+        ("a/*.txt", "a/b/x.txt", False),
+        ("a/*.txt", "b/a/x.txt", False),
+        ("**/logs", "logs", True),
+        ("**/logs", "a/b/logs", True),
+        ("a/**/x", "a/x", True),
+        ("a/**/x", "a/b/c/x", True),
+        ("a/**", "a/b/c", True),
+        ("a/**", "a", False),
+        ("file?.dat", "file1.dat", True),
+        ("file?.dat", "file10.dat", False),
+        ("file?.dat", "file/.dat", False),
+        ("[abc].dat", "b.dat", True),
+        ("[abc].dat", "d.dat", False),
+        ("[!abc].dat", "d.dat", True),
+        ("[!abc].dat", "a.dat", False),
+        ("\\*.dat", "*.dat", True),
+        ("\\*.dat", "x.dat", False),
+        ("a.b", "axb", False),
+        ("a+b(1)", "a+b(1)", True),
+    ],
+)
+def test_pattern_regex(pattern, path, matched):
+    assert bool(lib.ignore_pattern_regex(pattern).match(path)) is matched
+
+
+def test_comments_and_blank_lines():
+    rules = lib.IgnoreRules(["# *.log\n", "\n", "   \n", "/\n"])
+    assert rules.rules == []
+    assert not ignores(["# *.log"], "# *.log")
+
+
+def test_escaped_hash_and_bang():
+    assert ignores(["\\#notes"], "#notes")
+    assert ignores(["\\!important"], "!important")
+
+
+def test_trailing_spaces_are_stripped():
+    assert ignores(["*.log   \n"], "run.log")
+
+
+def test_folder_only_pattern():
+    assert ignores(["build/"], "build", is_dir=True)
+    assert not ignores(["build/"], "build")
+    assert ignores(["build/"], "build/out.o")
+    assert ignores(["build/"], "src/build/out.o")
+
+
+def test_parent_folder_ignores_contents():
+    assert ignores(["/data"], "data/a/b.dat")
+    assert not ignores(["/data"], "other/data/b.dat")
+
+
+def test_last_matching_pattern_wins():
+    assert not ignores(["*.log", "!keep.log"], "keep.log")
+    assert ignores(["*.log", "!keep.log"], "other.log")
+    assert ignores(["!keep.log", "*.log"], "keep.log")
+
+
+def test_negated_file_in_ignored_folder_stays_ignored():
+    assert ignores(["logs/", "!logs/keep.log"], "logs/keep.log")
+
+
+def test_no_rules():
+    assert not lib.IgnoreRules().ignores("anything")
+
+
+def test_load_ignore(tmp_path):
+    os.makedirs(tmp_path / ".figaro")
+    config = {"folder": {"local_path": str(tmp_path)}}
+    assert lib.load_ignore(config).rules == []
+
+    (tmp_path / ".figaro" / "ignore").write_text("*.tmp\n!keep.tmp\n")
+    rules = lib.load_ignore(config)
+    assert rules.ignores("x.tmp")
+    assert not rules.ignores("keep.tmp")
+
+
+def test_scan_tree(tmp_path):
+    for path in [".figaro/ignore", "a/x.dat", "a/x.tmp", "a/build/out.o", "b/c/y.dat"]:
+        os.makedirs(os.path.dirname(tmp_path / path), exist_ok=True)
+        (tmp_path / path).write_text("build/\n*.tmp\n" if "ignore" in path else path)
+    os.symlink(tmp_path / "b", tmp_path / "a" / "link")
+    config = {"folder": {"local_path": str(tmp_path)}, "concurrency": {"cap": 2}}
+
+    folders, files = lib.scan_tree(config)
+
+    assert sorted(folders) == ["a", "b", os.path.join("b", "c")]
+    assert sorted(files) == [
+        os.path.join("a", "x.dat"),
+        os.path.join("b", "c", "y.dat"),
+    ]
+    local_path, stat = files[os.path.join("a", "x.dat")]
+    assert local_path == str(tmp_path / "a" / "x.dat")
+    assert stat.st_size == len("a/x.dat")
+
+    folders, files = lib.scan_tree(config, "b")
+    assert folders == [os.path.join("b", "c")]
+    assert list(files) == [os.path.join("b", "c", "y.dat")]
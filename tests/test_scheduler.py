@@ -0,0 +1,186 @@
+"""Tests for the task graph and bounded thread pool"""
+
+# Standard libraries
+import time
+import threading
+
+# Specialized libraries
+import pytest
+
+# Internal imports
+from figaro import lib
+
+
+def recorder():
+    """
+    Task function appending its key to a list
+    """
+    finished = []
+    lock = threading.Lock()
+
+    def task(key, seconds=0.0):
+        time.sleep(seconds)
+        with lock:
+            finished.append(key)
+        return key
+
+    return finished, task
+
+
+def test_dependencies_finish_first():
+    finished, task = recorder()
+    graph = lib.TaskGraph()
+    graph.add("c", task, "c", depends_on=["a", "b"])
+    graph.add("a", task, "a", 0.02)
+    graph.add("b", task, "b", depends_on=["a"])
+
+    graph.run(4)
+
+    assert finished == ["a", "b", "c"]
+
+
+def test_independent_tasks_overlap():
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def task():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+
+    graph = lib.TaskGraph()
+    for key in range(4):
+        graph.add(key, task)
+
+    graph.run(4)
+
+    assert max(peak) > 1
+
+
+def test_unknown_dependencies_are_ignored():
+    finished, task = recorder()
+    graph = lib.TaskGraph()
+    graph.add("a", task, "a", depends_on=["not in graph"])
+
+    graph.run(1)
+
+    assert finished == ["a"]
+
+
+def test_on_result_runs_before_dependents():
+    finished, task = recorder()
+    results = []
+    graph = lib.TaskGraph()
+    graph.add("a", task, "a")
+    graph.add("b", task, "b", depends_on=["a"])
+
+    graph.run(2, on_result=lambda key, result: results.append((key, list(finished))))
+
+    assert results == [("a", ["a"]), ("b", ["a", "b"])]
+
+
+def test_duplicate_key():
+    graph = lib.TaskGraph()
+    graph.add("a", print)
+
+    with pytest.raises(ValueError):
+        graph.add("a", print)
+
+
+def test_cycle():
+    finished, task = recorder()
+    graph = lib.TaskGraph()
+    graph.add("free", task, "free")
+    graph.add("a", task, "a", depends_on=["b"])
+    graph.add("b", task, "b", depends_on=["a"])
+
+    with pytest.raises(ValueError):
+        graph.run(2)
+
+    assert finished == ["free"]
+
+
+def test_error_stops_dependents():
+    finished, task = recorder()
+
+    def fail():
+        raise RuntimeError("task failed")
+
+    graph = lib.TaskGraph()
+    graph.add("fail", fail)
+    graph.add("after", task, "after", depends_on=["fail"])
+
+    with pytest.raises(RuntimeError):
+        graph.run(2)
+
+    assert finished == []
+
+
+def test_run_bounded_limits_tasks_in_flight():
+    pending = list(range(20))
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def task(value):
+        with lock:
+            running.append(value)
+            peak.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.remove(value)
+        return value
+
+    def next_task():
+        return (pending[0], task, (pending.pop(0),)) if pending else None
+
+    done = []
+    lib.run_bounded(3, next_task, lambda key, result: done.append(result))
+
+    assert sorted(done) == list(range(20))
+    assert max(peak) <= 3
+
+
+def test_run_bounded_adds_tasks_from_results():
+    queue = [3]
+    seen = []
+
+    def next_task():
+        return (queue[0], lambda value: value, (queue.pop(0),)) if queue else None
+
+    def on_done(key, value):
+        seen.append(value)
+        if value:
+            queue.append(value - 1)
+
+    lib.run_bounded(2, next_task, on_done)
+
+    assert seen == [3, 2, 1, 0]
+
+
+def test_highest_priority_starts_first():
+    finished, task = recorder()
+    graph = lib.TaskGraph()
+    for key, priority in [("small", 1), ("huge", 100), ("medium", 10), ("tie", 10)]:
+        graph.add(key, task, key, priority=priority)
+
+    graph.run(1)
+
+    assert finished == ["huge", "medium", "tie", "small"]
+
+
+def test_blocking_task_runs_before_less_urgent_work():
+    finished, task = recorder()
+    graph = lib.TaskGraph()
+    graph.add("medium file", task, "medium file", priority=10)
+    graph.add("folder", task, "folder")
+    graph.add("subfolder", task, "subfolder", depends_on=["folder"])
+    graph.add("big file", task, "big file", depends_on=["subfolder"], priority=100)
+
+    graph.run(1)
+
+    assert finished == ["folder", "subfolder", "big file", "medium file"]
@@ -0,0 +1,126 @@
+"""Tests for splitting plans across shards"""
+
+# Standard libraries
+import os
+
+# Specialized libraries
+import pytest
+
+# Internal imports
+from figaro import lib
+
+
+@pytest.fixture
+def shard():
+    """
+    Start a shard, and stop sharding after the test
+    """
+    yield lib.shard_start
+    lib.shard_start(0, 1)
+
+
+def item(action, path, size=0):
+    path = path.replace("/", os.sep)
+    return lib.PlanItem(action, path, os.path.join(os.sep, "project", path), size, "")
+
+
+def test_parse():
+    assert lib.shard_parse("0/1") == (0, 1)
+    assert lib.shard_parse("3/8") == (3, 8)
+
+
+@pytest.mark.parametrize("value", ["1", "a/b", "4/4", "-1/4", "0/0", "1/2/3"])
+def test_parse_invalid(value):
+    with pytest.raises(ValueError):
+        lib.shard_parse(value)
+
+
+def test_parse_auto(monkeypatch):
+    for rank, size in lib.SHARD_ENVIRONMENT:
+        monkeypatch.delenv(rank, raising=False)
+        monkeypatch.delenv(size, raising=False)
+
+    with pytest.raises(ValueError):
+        lib.shard_parse("auto")
+
+    monkeypatch.setenv("SLURM_PROCID", "2")
+    monkeypatch.setenv("SLURM_NTASKS", "4")
+    assert lib.shard_parse("auto") == (2, 4)
+
+    monkeypatch.setenv("OMPI_COMM_WORLD_RANK", "1")
+    monkeypatch.setenv("OMPI_COMM_WORLD_SIZE", "3")
+    assert lib.shard_parse("auto") == (1, 3)
+
+
+def test_single_shard_is_not_sharded(shard):
+    shard(0, 1)
+    assert lib.shard_current() is None
+
+
+def test_assign_largest_first():
+    items = [item("upload", f"f{size}", size * 10**9) for size in [1, 5, 3, 4, 2]]
+
+    ranks = lib.shard_assign(items, 2)
+
+    loads = [
+        sum(it.size for it, rank in zip(items, ranks) if rank == r) for r in [0, 1]
+    ]
+    assert sorted(loads) == [7 * 10**9, 8 * 10**9]
+    assert ranks[1] != ranks[3]
+
+
+def test_assign_spreads_small_files():
+    items = [item("upload", f"f{index}") for index in range(10)]
+
+    ranks = lib.shard_assign(items, 3)
+
+    assert sorted(ranks.count(rank) for rank in range(3)) == [3, 3, 4]
+
+
+def test_assign_ignores_item_order():
+    items = [item("upload", f"f{index}", 1000 * (index % 3)) for index in range(12)]
+
+    ranks = dict(zip(items, lib.shard_assign(items, 4)))
+    reversed_ranks = dict(zip(items[::-1], lib.shard_assign(items[::-1], 4)))
+
+    assert ranks == reversed_ranks
+
+
+def test_plan_covers_every_file_once(shard, capsys):
+    plan = [
+        item("mkdir-remote", "a"),
+        item("mkdir-remote", "a/b"),
+        item("mkdir-remote", "c"),
+        item("mkdir-remote", "empty"),
+        item("mkdir-remote", "empty/deeper"),
+    ] + [
+        item("upload", f"{folder}/f{index}", index * 1000)
+        for folder in ["a/b", "c"]
+        for index in range(5)
+    ]
+    work = [it for it in plan if it.action == "upload"]
+    slices = []
+
+    for index in range(3):
+        shard(index, 3)
+        slices.append(lib.shard_plan(plan))
+
+    kept = [it for plan_slice in slices for it in plan_slice if it.action == "upload"]
+    assert sorted(kept) == sorted(work)
+
+    for index, plan_slice in enumerate(slices):
+        folders = {it.path_from_root for it in plan_slice if it.action != "upload"}
+        for it in plan_slice:
+            parent = os.path.dirname(it.path_from_root)
+            while parent:
+                assert parent in folders
+                parent = os.path.dirname(parent)
+        assert ("empty" in folders) is (index == 0)
+        assert (os.path.join("empty", "deeper") in folders) is (index == 0)
+
+    assert "Shard 2/3" in capsys.readouterr().out
+
+
+def test_plan_without_shard_is_unchanged():
+    plan = [item("upload", "a/f", 10), item("mkdir-remote", "a")]
+    assert lib.shard_plan(plan) is plan